@@ -8,7 +8,7 @@ Created on Thu Jul  6 10:57:40 2017
 # For communication with lock-in amplifier
 from __future__ import print_function
 import numpy as np
-import zhinst.utils
+import sim_daq # Simulated instrument for hardware-free runs
 
 # For graphical user interface
 import tkinter as tk
@@ -26,6 +26,9 @@ import matplotlib.pyplot as plt # Subplots
 
 import tooltip
 
+import measurement_store # Preallocated measurement buffers
+import run_average # Vectorised averaging over repeated values
+
 import webbrowser # To open link to help web page
 
 import os # To delete files
@@ -59,9 +62,8 @@ class HystGUI(tk.Frame):
         self.plotOptions = self.plotSelection
         self.units = ('V', 'V', 'V', 'V', 'Rad', 's', 'V', 'V')
                 
-        # Dictionary storing measurements
-        self.measurements = {'TotalV': np.empty((0)), 'X': np.empty((0)), 'Y': np.empty((0)), 'R': np.empty((0)), 'Phase': np.empty((0)),
-                             't': np.empty((0)), 'ProbeV': np.empty((0)), 'BotElectV': np.empty((0))} 
+        # Columnar store of measurements, accessed like a dictionary of arrays
+        self.measurements = measurement_store.MeasurementStore(self.plotSelection)
         
         self.lengths = np.empty((0))
         self.biases_in_meas = ('TotalV', 'ProbeV', 'BotElectV')
@@ -679,7 +681,7 @@ class HystGUI(tk.Frame):
         # - the device ID string that specifies the device branch in the server's node hierarchy.
         # - the device's discovery properties.
         err_msg = "This example only supports instruments with demodulators."
-        (daq, device, props) = zhinst.utils.create_api_session(device_id, apilevel,
+        (daq, device, props) = sim_daq.api_session(device_id, apilevel,
                                                                required_devtype='.*LI|.*IA|.*IS&HF2',
                                                                required_err_msg=err_msg)
     
@@ -721,6 +723,12 @@ class HystGUI(tk.Frame):
         # the poll() command and 2. clear the API's data buffers.
         daq.sync()
     
+        # Plan measurement buffer capacity for the whole run from the demodulator rate,
+        # with some headroom for polls that return slightly more samples than expected
+        demod_rate = daq.getDouble('/%s/demods/%d/rate' % (device, demod_index))
+        expected_len = int(1.1*numLoops*numSteps*(biasTime+zeroVTime)*demod_rate)
+        self.measurements.reserve(self.measurements.size('t')+expected_len)
+    
         # Set polling parameters
         poll_timeout = 500  # [ms]
         poll_flags=0
@@ -1078,18 +1086,15 @@ class HystGUI(tk.Frame):
     # Record all relevant measurements in dictionary
     def record_meas(self, sample):
         
-        # Append sampled data to sample train
-        self.measurements['X'] = np.append(self.measurements['X'], sample['x'])
-        self.measurements['Y'] = np.append(self.measurements['Y'], sample['y'])
-        self.measurements['R'] = np.append(self.measurements['R'], sample['R'])
-        self.measurements['Phase'] = np.append(self.measurements['Phase'], sample['Phase'])
-        try:
-            self.measurements['t'] = np.append(self.measurements['t'], sample['t']+self.measurements['t'][-1])
-        except IndexError:
-            self.measurements['t'] = np.append(self.measurements['t'], sample['t'])
-        self.measurements['ProbeV'] = np.append(self.measurements['ProbeV'], sample['ProbeV'])
-        self.measurements['BotElectV'] = np.append(self.measurements['BotElectV'], sample['BotElectV'])
-        self.measurements['TotalV'] = np.append(self.measurements['TotalV'], sample['ProbeV']-sample['BotElectV'])
+        # Append sampled data to sample train. Times continue on from the last recorded time
+        self.measurements.append('X', sample['x'])
+        self.measurements.append('Y', sample['y'])
+        self.measurements.append('R', sample['R'])
+        self.measurements.append('Phase', sample['Phase'])
+        self.measurements.append('t', sample['t']+self.measurements.last('t', 0.0))
+        self.measurements.append('ProbeV', sample['ProbeV'])
+        self.measurements.append('BotElectV', sample['BotElectV'])
+        self.measurements.append('TotalV', sample['ProbeV']-sample['BotElectV'])
         
         # Update graph
         self.update_graph()
@@ -1122,8 +1127,7 @@ class HystGUI(tk.Frame):
         
     # Clear measurements dictionary
     def clear_meas(self):
-        for key in self.measurements:
-            self.measurements[key] = np.empty((0))
+        self.measurements.clear()
         
         
     # Plot results of hysteresis measurement
@@ -1161,46 +1165,7 @@ class HystGUI(tk.Frame):
         
     # Average over repeated x values. Can average over y by passing x and y the other way around
     def avg_xrepeats(self, x, y):
-        
-        avgedx, avgedy = np.empty((0)), np.empty((0))
-        
-        total = 0
-        start, end = 0, 1   # Average between y[start] and y[end] so x and y have same lengths
-        prevx = x[0]
-
-        # If the next value of x is not the same as the previous, add it to the array
-        for i in range(1, len(x)):
-            # If x is same as previous
-            if x[i] == prevx:
-                end += 1
-                    
-                # Check if this is the last element of the array
-                if i == len(x)-1:
-                    avgedx = np.append(avgedx, prevx)
-                    
-                    for j in range(start, end):
-                        total += y[i]
-                    avgedy = np.append(avgedy, total/(end-start))
-                        
-                    
-            # If x is not the same as previous
-            else:
-                avgedx = np.append(avgedx, prevx)
-                prevx = x[i]
-                    
-                for j in range(start, end):
-                    total += y[j]
-                avgedy = np.append(avgedy, total/(end-start))
-                    
-                total = 0
-                start, end = i, i+1
-                    
-                # Check if this is the last element of the array
-                if i == len(x)-1:
-                    avgedx = np.append(avgedx, x[i])
-                    avgedy = np.append(avgedy, y[i])
-
-        return avgedx, avgedy
+        return run_average.avg_xrepeats(x, y)
         
     
     # Output full measurements dictionary
@@ -1209,10 +1174,12 @@ class HystGUI(tk.Frame):
     
     # Output data dictionary
     def output_dictionary(self, measurements):        
-            
+        
+        keys = self.plotSelection
+        
         text = ""
-            
-        for heading in self.plotSelection:
+        
+        for heading in keys:
                 text += " "+heading
         text += "\n"
         
@@ -1220,7 +1187,9 @@ class HystGUI(tk.Frame):
                 text += " "+unit
         text += "\n"
 
-        # Average over repeating values and print to file
+        data = np.column_stack([measurements[key] for key in keys])
+        
+        # Average all columns over repeating values in one pass
         x_get = self.avgRepeatedx.get()
         if x_get == 1 or self.avgRepeatedy.get() == 1:
             
@@ -1229,58 +1198,8 @@ class HystGUI(tk.Frame):
                 x_axis = self.plotxEntry.get()
             else:
                 x_axis = self.plotyEntry.get()
-            
-            total = [0 for meas in measurements] # Sums of values to average over initially 0            
-            start, end = 0, 1   # Average between y[start] and y[end] so x and y have same lengths
-            prevx = measurements[x_axis][0]
-    
-            # If the next value of x is not the same as the previous, add data to the array
-            for i in range(1, len(measurements[x_axis])):
-                # If x is same as previous
-                if measurements[x_axis][i] == prevx:
-                    end += 1
-                        
-                    # Check if this is the last element of the array
-                    if i == len(measurements[x_axis])-1:
-                        # Add averages to output
-                        for k, key in enumerate(measurements):
-                            if key == x_axis:
-                                text += str(prevx) + "    "
-                            else:
-                                for j in range(start, end):                              
-                                    total[k] += measurements[key][i]
-                                text += str(total[k]/(end-start)) + "    "
-                        text += "\n"
-                            
-                        
-                # If x is not the same as previous
-                else:
-                    for k, key in enumerate(measurements):
-                        if key == x_axis:
-                            text += str(prevx) + "    "
-                            prevx = measurements[x_axis][i]
-                        else:
-                            for j in range(start, end):                              
-                                total[k] += measurements[key][j]
-                            text += str(total[k]/(end-start)) + "    "
-                    text += "\n"
-                        
-                    for l in range(len(total)):
-                        total[l] = 0
-                    start, end = i, i+1
-                        
-                    # Check if this is the last element of the array
-                    if i == len(measurements[x_axis])-1:
-                        for key in measurements:
-                            text += str(measurements[key][i]) + "    "
-                        text += "\n"
-        
-        else:
-            # Print data to file without averaging repeats
-            for i in range(len(measurements['X'])):
-                for key in measurements:
-                    text += str(measurements[key][i])+"    "
-                text += "\n"
+                
+            data = run_average.avg_runs(measurements[x_axis], data)
             
         # Get save location
         f = tk.filedialog.asksaveasfile(mode='w', defaultextension=".txt")
@@ -1291,6 +1210,7 @@ class HystGUI(tk.Frame):
         f.write(self.metadata())
         
         f.write(text)
+        np.savetxt(f, data, fmt='%.16g', delimiter='    ')
         f.close()
         
         
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+# Binary CFM captures. A capture is a directory holding the scope's raw 16-bit waves back to
+# back in waves.npy, a table with one row of per-shot headers for each shot in shots.npy and a
+# meta.json with the scale and the measurement metadata. Waves are only scaled to voltages when
+# they are read, so a capture is written at the rate the scope produces it.
+
+import numpy as np
+
+import hyst_file # Appendable .npy files
+
+import json
+import os
+import shutil
+
+import time # Benchmark timing
+
+extension = '.cfm'
+meta_name = 'meta.json'
+waves_name = 'waves.npy'
+shots_name = 'shots.npy'
+format_version = 1
+
+# Per-shot headers. offset and length locate the shot's samples in the waves file
+shot_dtype = np.dtype([('offset', '<i8'), ('length', '<i4'), ('timestamp', '<u8'), ('dt', '<f8'),
+                       ('bwlimit', '<i4'), ('channel', '<i4'), ('trigchannel', '<i4'),
+                       ('probeOffset', '<f8'), ('botElectOffset', '<f8'), ('time', '<f8'),
+                       ('set', '<i4')])
+
+
+# Whether a CFM location is a binary capture rather than a legacy text file
+def is_capture(path):
+    return path.endswith(extension)
+
+
+# Delete a capture's contents
+def clear(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+class CaptureWriter(object):
+    """Appends scope shots to a capture. Shots are grouped into bias sets, each started by
+    bias_set() with the offsets applied while its shots were taken. Opening an existing
+    capture appends to it."""
+
+    def __init__(self, path, scale, metadata=''):
+        self.path = path
+
+        if os.path.exists(os.path.join(path, meta_name)):
+            with open(os.path.join(path, meta_name), 'r') as f:
+                self.meta = json.load(f)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {'format': 'cfm', 'version': format_version, 'scale': [], 'metadata': []}
+
+        self._waves = hyst_file.ColumnFile(os.path.join(path, waves_name), np.int16)
+        self._shots = hyst_file.ColumnFile(os.path.join(path, shots_name), shot_dtype)
+
+        # The scale can change between measurements so it is recorded with the first shot it applies to
+        self.meta['scale'].append([self._shots.length, scale])
+        self.meta['metadata'].append([self._shots.length, metadata])
+        self.write_meta()
+
+        self._set = self._last_set()
+        self._offsets = (0.0, 0.0, 0.0)
+
+    def _last_set(self):
+        if self._shots.length == 0:
+            return -1
+        shots = np.load(os.path.join(self.path, shots_name), mmap_mode='r')
+        return int(shots['set'][-1])
+
+    def write_meta(self):
+        fileName = os.path.join(self.path, meta_name)
+        with open(fileName+'.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(fileName+'.tmp', fileName)
+
+    # Start a bias set. t is the time since the start of the measurement
+    def bias_set(self, probeOffset, botElectOffset, t):
+        self._set += 1
+        self._offsets = (probeOffset, botElectOffset, t)
+
+    # Append the shots in a scope poll to the current bias set
+    def append(self, shot_sets):
+        if len(shot_sets) == 0:
+            return
+
+        waves = [np.ravel(shot_set['wave']) for shot_set in shot_sets]
+        shots = np.zeros(len(waves), dtype=shot_dtype)
+        lengths = np.array([len(wave) for wave in waves])
+        shots['offset'] = self._waves.length+np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        shots['length'] = lengths
+        for field in ('timestamp', 'dt', 'bwlimit', 'channel', 'trigchannel'):
+            shots[field] = [shot_set.get(field, 0) for shot_set in shot_sets]
+        shots['probeOffset'], shots['botElectOffset'], shots['time'] = self._offsets
+        shots['set'] = self._set
+
+        self._waves.append(np.concatenate(waves))
+        self._shots.append(shots)
+
+    def flush(self):
+        self._waves.flush()
+        self._shots.flush()
+
+    def close(self):
+        self._waves.close()
+        self._shots.close()
+
+
+class Capture(object):
+    """Read access to a capture. The waves are memory mapped and only the shots asked for
+    are read and scaled."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, meta_name), 'r') as f:
+            self.meta = json.load(f)
+        self.raw = np.load(os.path.join(path, waves_name), mmap_mode='r')
+        self.shots = np.load(os.path.join(path, shots_name))
+
+        # Scale of each shot
+        starts = [start for start, scale in self.meta['scale']]
+        scales = np.array([scale for start, scale in self.meta['scale']], dtype=np.float64)
+        self.scales = scales[np.searchsorted(starts, np.arange(len(self.shots)), side='right')-1]
+
+    def __len__(self):
+        return len(self.shots)
+
+    # Scaled wave of shot i
+    def wave(self, i):
+        shot = self.shots[i]
+        return self.scales[i]*self.raw[shot['offset']:shot['offset']+shot['length']]
+
+    # Indices of the shots in each bias set
+    def sets(self):
+        starts = np.flatnonzero(np.diff(self.shots['set']))+1
+        return np.split(np.arange(len(self.shots)), starts)
+
+    # Scaled waves of several shots of equal length as rows of a 2D array
+    def waves(self, indices):
+        indices = np.asarray(indices)
+        if len(indices) == 0:
+            return np.empty((0, 0))
+        length = int(self.shots['length'][indices[0]])
+        rows = self.shots['offset'][indices][:, np.newaxis]+np.arange(length)
+        return self.scales[indices][:, np.newaxis]*self.raw[rows]
+
+
+# Compare capture size and write time with the legacy text format
+if __name__ == "__main__":
+
+    import tempfile
+
+    shot_len = 2048
+    num_shots = 2000
+    scale = 1.0/2**15
+
+    shot_sets = [{'timestamp': i, 'dt': 1e-6, 'bwlimit': 1, 'channel': 0, 'trigchannel': -1,
+                  'wave': np.random.randint(-2**15, 2**15, shot_len).astype(np.int16)} for i in range(num_shots)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        capture_file = os.path.join(directory, 'run'+extension)
+        text_file = os.path.join(directory, 'run.txt')
+
+        start = time.perf_counter()
+        writer = CaptureWriter(capture_file, scale)
+        for i in range(0, num_shots, 10):
+            writer.bias_set(i, -i, 0.1*i)
+            writer.append(shot_sets[i:i+10])
+        writer.close()
+        binary_write = time.perf_counter()-start
+
+        start = time.perf_counter()
+        with open(text_file, 'w') as f:
+            for shot_set in shot_sets:
+                for key in shot_set:
+                    if key != 'wave':
+                        f.write(str(key)+"\n")
+                        f.write(str(shot_set[key])+"\n")
+                    else:
+                        f.write("wave\n")
+                        for scaled_shot in scale*shot_set['wave']:
+                            f.write(str(scaled_shot)+"\n")
+        text_write = time.perf_counter()-start
+
+        capture = Capture(capture_file)
+        assert len(capture) == num_shots and len(capture.sets()) == num_shots//10
+        assert all(np.array_equal(capture.wave(i), scale*shot_sets[i]['wave']) for i in (0, 7, num_shots-1))
+        assert np.array_equal(capture.waves(capture.sets()[3]),
+                              scale*np.array([shot_set['wave'] for shot_set in shot_sets[30:40]]))
+
+        binary_size = sum(os.path.getsize(os.path.join(capture_file, name)) for name in os.listdir(capture_file))
+        print("{0} shots x {1} samples".format(num_shots, shot_len))
+        print("         write (s)    size (MB)")
+        print("binary   {0:9.2f}    {1:9.1f}".format(binary_write, binary_size/1e6))
+        print("text     {0:9.2f}    {1:9.1f}".format(text_write, os.path.getsize(text_file)/1e6))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,685 @@
+# -*- coding: utf-8 -*-
+
+# Fourier filtering of CFM data. The data is read once, one bias set at a time, and every shot
+# and bias set train is transformed once. Every requested filter chain is applied to that one
+# spectrum, and all outputs are written in the same pass. Post-processing time therefore does
+# not grow with the number of filters.
+
+import numpy as np
+
+import cfm_index # Random access to CFM shots
+import hyst_file # Binary columnar run files
+
+import concurrent.futures
+import functools
+import os
+import shutil
+import tempfile
+import threading
+
+import time # Benchmark timing
+
+filter_modes = ('Shot Set', 'Bias Set', 'Bias Set Stream')
+
+# Most worker processes filtering may use when their number is chosen automatically. None uses
+# every core
+max_workers = None
+
+# CFM samples to filter for each worker process. Starting a process and merging its results
+# back only pays off once it has millions of samples to filter, so smaller data is filtered in
+# fewer processes, or in the caller's
+samples_per_worker = 2**22
+
+
+# Filter responses. Each takes the frequencies to respond at followed by its parameters
+def _low_pass(freq, cutoff):
+    return (freq <= cutoff).astype(np.float64)
+
+def _high_pass(freq, cutoff):
+    return (freq >= cutoff).astype(np.float64)
+
+def _band_pass(freq, low, high):
+    return ((freq >= low) & (freq <= high)).astype(np.float64)
+
+# Removes a band of width around a centre frequency and its harmonics, e.g. mains pickup
+def _notch(freq, centre, width=1.0, harmonics=1):
+    response = np.ones(len(freq))
+    for harmonic in range(1, int(harmonics)+1):
+        response[np.abs(freq-harmonic*centre) <= width/2] = 0.0
+    return response
+
+# Maximally flat magnitude responses, which roll off smoothly rather than cutting off
+def _butterworth_low_pass(freq, cutoff, order=4):
+    with np.errstate(over='ignore'):
+        return 1/np.sqrt(1+(freq/cutoff)**(2*order))
+
+def _butterworth_high_pass(freq, cutoff, order=4):
+    with np.errstate(divide='ignore', over='ignore'):
+        return 1/np.sqrt(1+(cutoff/freq)**(2*order))
+
+# Name: (response, number of required parameters, number of optional parameters)
+sub_filters = {'Low Pass': (_low_pass, 1, 0),
+               'High Pass': (_high_pass, 1, 0),
+               'Band Pass': (_band_pass, 2, 0),
+               'Notch': (_notch, 1, 2),
+               'Butterworth Low Pass': (_butterworth_low_pass, 1, 1),
+               'Butterworth High Pass': (_butterworth_high_pass, 1, 1)}
+
+
+# Split the GUI's ';' separated filter chains into their ':' separated subfilters, paired by
+# position with the ';' separated parameters. Subfilters with several parameters separate them
+# with ','. 'None' only asks for the unfiltered transform. Chains are tuples so their compiled
+# responses can be cached, and settings are only parsed once
+@functools.lru_cache(maxsize=32)
+def parse_chains(filter_types, filter_params):
+
+    filters = [filt.strip() for filt in filter_types.split(';') if filt.strip() != '']
+    params = [param.strip() for param in filter_params.split(';') if param.strip() != '']
+
+    chains = []
+    for param_idx, filt in enumerate(filters):
+        sub_filts = [sub_filt.strip() for sub_filt in filt.split(':') if sub_filt.strip() not in ('', 'None')]
+        if not sub_filts:
+            continue
+
+        sub_params = params[param_idx] if param_idx < len(params) else ''
+        sub_params = [param.strip() for param in sub_params.split(':') if param.strip() != '']
+        if len(sub_params) < len(sub_filts):
+            raise ValueError("Filter '%s' needs parameters for each of its %d subfilters" % (filt, len(sub_filts)))
+
+        chain = []
+        for sub_filt, sub_param in zip(sub_filts, sub_params):
+            if not sub_filt in sub_filters:
+                raise ValueError("Unknown filter '%s'" % sub_filt)
+            values = tuple(float(value) for value in sub_param.split(',') if value.strip() != '')
+            response, required, optional = sub_filters[sub_filt]
+            if not required <= len(values) <= required+optional:
+                raise ValueError("Filter '%s' takes %d to %d parameters" % (sub_filt, required, required+optional))
+            chain.append((sub_filt, values))
+
+        chains.append((filt, tuple(chain)))
+
+    return tuple(chains)
+
+
+# Frequency grids are cached by (length, dt) as the shots of a run all share one
+_freq_grids = {}
+
+def rfft_freq(n, dt):
+    if not (n, dt) in _freq_grids:
+        _freq_grids[(n, dt)] = np.fft.rfftfreq(n, dt)
+    return _freq_grids[(n, dt)]
+
+def fft_freq(n, dt):
+    if not (n, -dt) in _freq_grids:
+        _freq_grids[(n, -dt)] = np.fft.fftfreq(n, dt)
+    return _freq_grids[(n, -dt)]
+
+
+# Frequency response of a filter chain: the product of its subfilters' responses
+def chain_response(chain, freq):
+    response = np.ones(len(freq))
+    for sub_filt, values in chain:
+        response *= sub_filters[sub_filt][0](freq, *values)
+    return response
+
+
+# Compiled responses, cached by chain and grid. Each is applied to a spectrum as one multiply
+_responses = {}
+max_responses = 64
+
+# Response of a chain on the real FFT grid of n samples spaced by dt
+def response(chain, n, dt):
+    key = (chain, n, dt)
+    if not key in _responses:
+        if len(_responses) >= max_responses:
+            _responses.clear()
+        freq = rfft_freq(n, dt)
+        _responses[key] = chain_response(chain, freq)
+    return _responses[key]
+
+
+# Real Fourier transform rows of equal length signals together and filter their spectra with
+# each filter chain. Returns the spectra and, for each chain, the filtered signals
+def filter_batch(signals, dt, chains):
+    n = signals.shape[-1]
+    spectra = np.fft.rfft(signals, axis=-1)
+    filtered = [np.fft.irfft(spectra*response(chain, n, dt), n, axis=-1) for name, chain in chains]
+    return spectra, filtered
+
+
+# Two-sided spectrum of a real signal from its one-sided spectrum
+def full_spectrum(spectrum, n):
+    return np.concatenate((spectrum, np.conj(spectrum[1:(n+1)//2][::-1])))
+
+
+# FIR kernel with the response of a filter chain: the chain's response sampled on a grid of taps
+# samples, centred so it has linear phase, and windowed to limit ripple. taps should be odd
+def fir_kernel(chain, taps, dt):
+    kernel = np.fft.irfft(response(chain, taps, dt), taps)
+    return np.roll(kernel, taps//2)*np.blackman(taps)
+
+
+class OverlapSave(object):
+    """Filters a signal that arrives in chunks by overlap-save block convolution with an FIR
+    kernel, so memory is bounded by the block size however long the signal is. The output is
+    the centred ('same') convolution, aligned sample for sample with the input. Samples are
+    returned as soon as they are complete, which is len(kernel)//2 samples behind the input,
+    and flush() returns the rest."""
+
+    def __init__(self, kernel, block=None):
+        self.taps = len(kernel)
+        self.block = block or 2**int(np.ceil(np.log2(4*self.taps)))
+        self.step = self.block-self.taps+1
+        self.kernel_fft = np.fft.rfft(kernel, self.block)
+
+        self._buffer = np.zeros(self.taps-1) # Input not yet filtered, after the history filtering needs
+        self._skip = self.taps//2 # Leading samples of the full convolution before the centred output starts
+        self._received = 0
+        self._returned = 0
+
+    def process(self, chunk):
+        self._received += len(chunk)
+        return self._filter(np.concatenate((self._buffer, chunk)))
+
+    def flush(self):
+        return self._filter(np.concatenate((self._buffer, np.zeros(self.taps//2))), final=True)
+
+    def _filter(self, buffer, final=False):
+        out = []
+        while len(buffer) >= self.block or (final and len(buffer) > self.taps-1):
+            block = buffer[:self.block]
+            if len(block) < self.block:
+                block = np.concatenate((block, np.zeros(self.block-len(block))))
+            out.append(np.fft.irfft(np.fft.rfft(block)*self.kernel_fft, self.block)[self.taps-1:])
+            buffer = buffer[self.step:]
+        self._buffer = buffer
+
+        out = np.concatenate(out) if out else np.empty(0)
+        skip = min(self._skip, len(out))
+        out = out[skip:]
+        self._skip -= skip
+
+        out = out[:self._received-self._returned]
+        self._returned += len(out)
+        return out
+
+
+# Run file the filtered CFM signals are saved to
+def filtered_path(path):
+    return os.path.splitext(path.rstrip('/\\'))[0]+'_filtered'+hyst_file.extension
+
+
+# Worker processes to filter num_shots shots of shot_len samples with: one for every
+# samples_per_worker samples, up to max_workers or the number of cores
+def choose_workers(num_shots, shot_len):
+    workers = int(num_shots*shot_len//samples_per_worker)
+    cores = os.cpu_count() or 1
+    return max(1, min(workers, cores, max_workers or cores))
+
+
+# Run file column of a mode's filter chain
+def _column(mode, chain_idx):
+    return mode.lower().replace(' ', '_')+'_'+str(chain_idx)
+
+
+class FourierPipeline(object):
+    """Transforms and filters CFM data in a single pass. Shots are read and transformed in
+    batches of up to batch_size with real FFTs. Bias set trains are either transformed whole
+    ('Bias Set') or streamed through overlap-save FIR filters of taps taps ('Bias Set Stream'),
+    which keeps memory bounded however long a bias set is. The transforms and filtered signals
+    are appended to a tab separated Fourier file, one block per shot or bias set, with a column
+    for each filter chain. Streamed bias sets have no spectrum and are written a batch at a time.
+    The filtered signals can also be saved to a run file with a column for each mode and filter
+    chain, aligned sample for sample with the CFM data. Both outputs hold the results of the
+    latest run, replacing any from filtering the data before. Bias sets are independent, so with
+    more than one worker they are filtered in parallel processes and the results merged in order.
+    workers='auto' chooses the number of workers from the number and length of the shots."""
+
+    def __init__(self, path, chains, modes, fourier_file=None, filtered_file=None, metadata='', batch_size=256,
+                 taps=1023, workers=1):
+        self.path = path
+        self.chains = chains
+        self.modes = [mode for mode in filter_modes if mode in modes]
+        self.fourier_file = fourier_file
+        self.filtered_file = filtered_file
+        self.metadata = metadata
+        self.batch_size = batch_size
+        self.taps = taps
+        self.workers = workers
+
+    def run(self):
+        cfm = cfm_index.open_cfm(self.path)
+        sets = cfm.sets()
+        workers = self.workers
+        if workers == 'auto':
+            workers = choose_workers(len(cfm), np.mean(cfm.index['length']) if len(cfm) else 0)
+
+        # Outputs are written beside where they go and only replace the results of filtering the
+        # data before once they are complete, so a failed run leaves those as they were
+        fourier_tmp = self.fourier_file+'.tmp' if self.fourier_file else None
+        filtered_tmp = self.filtered_file.rstrip('/\\')+'.tmp' if self.filtered_file and self.chains else None
+        if filtered_tmp is not None and os.path.exists(filtered_tmp):
+            shutil.rmtree(filtered_tmp)
+
+        f = None
+        if fourier_tmp is not None:
+            f = open(fourier_tmp, "w")
+            f.write(self.metadata)
+            f.write("time\tSignal\tfrequency\tfft_real\tfft_imag"+"".join("\t"+name for name, chain in self.chains)+"\n")
+            f.write("s\t-\tHz\t-\t-"+"\t-"*len(self.chains)+"\n")
+
+        writer = None
+        if filtered_tmp is not None:
+            attributes = {'cfm': self.path, 'filters': {_column(mode, chain_idx): mode+", "+name
+                                                        for mode in self.modes
+                                                        for chain_idx, (name, chain) in enumerate(self.chains)}}
+            writer = hyst_file.RunWriter(filtered_tmp, self.columns(), ['V']*len(self.columns()), attributes)
+
+        complete = False
+        try:
+            # Process startup only pays off once there is more than a batch of shots to share out
+            if workers > 1 and len(sets) > 1 and len(cfm) > self.batch_size:
+                self.run_shards(sets, f, writer, workers)
+            else:
+                self.filter_sets(cfm, sets, f, writer)
+            complete = True
+        finally:
+            if f is not None:
+                f.close()
+            if writer is not None:
+                writer.close()
+
+            if fourier_tmp is not None:
+                if complete:
+                    os.replace(fourier_tmp, self.fourier_file)
+                else:
+                    os.remove(fourier_tmp)
+            if filtered_tmp is not None:
+                if complete and os.path.exists(self.filtered_file):
+                    shutil.rmtree(self.filtered_file)
+                if complete:
+                    os.replace(filtered_tmp, self.filtered_file)
+                else:
+                    shutil.rmtree(filtered_tmp, ignore_errors=True)
+
+    # Run file columns of every mode and filter chain
+    def columns(self):
+        return [_column(mode, chain_idx) for mode in self.modes for chain_idx in range(len(self.chains))]
+
+    # Filter contiguous shards of bias sets in worker processes. Each worker opens the CFM data
+    # itself, so captures are memory mapped and text files are read by the offsets in their index
+    # rather than being copied to it. Each shard's results are written to temporary files that
+    # are appended to the outputs in bias set order
+    def run_shards(self, sets, f, writer, workers):
+        num_shards = min(len(sets), 4*workers) # Several shards per worker balance uneven bias sets
+        bounds = np.linspace(0, len(sets), num_shards+1).astype(int)
+
+        directory = tempfile.mkdtemp(prefix='cfm_filter_')
+        try:
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                jobs = []
+                for shard in range(num_shards):
+                    fourier_shard = os.path.join(directory, str(shard)+'.txt') if f is not None else None
+                    filtered_shard = os.path.join(directory, str(shard)+hyst_file.extension) if writer is not None else None
+                    jobs.append(executor.submit(_filter_shard, self, bounds[shard], bounds[shard+1],
+                                                fourier_shard, filtered_shard))
+
+                for job in jobs:
+                    fourier_shard, filtered_shard = job.result()
+                    if fourier_shard is not None:
+                        with open(fourier_shard, "r") as shard_file:
+                            shutil.copyfileobj(shard_file, f)
+                        os.remove(fourier_shard)
+                    if filtered_shard is not None:
+                        columns, meta = hyst_file.load(filtered_shard, mmap=True)
+                        writer.append(columns)
+                        del columns
+                        shutil.rmtree(filtered_shard)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    # Filter bias sets, appending the results to the Fourier file f and run file writer. Bias set
+    # trains are gathered across batches in this call, so calls can be made at the same time
+    def filter_sets(self, cfm, sets, f, writer):
+        index = cfm.index
+        train, train_start = [], None # Shots of the bias set being gathered for 'Bias Set'
+        stream = None # Overlap-save filters of the bias set being streamed
+        for batch in self.batches(sets):
+            shots = np.concatenate([segment for segment, first, last in batch])
+
+            # Read each shot once. Shots of the same length and dt are stacked to be transformed together
+            if self.uniform(index, shots):
+                waves = cfm.waves(shots)
+                groups = [(shots, waves)]
+            else:
+                waves = [cfm.wave(i) for i in shots]
+                groups = [([i], wave[np.newaxis]) for i, wave in zip(shots, waves)]
+
+            shot_results = {}
+            if 'Shot Set' in self.modes:
+                for group, group_waves in groups:
+                    spectra, filtered = filter_batch(group_waves, index['dt'][group[0]], self.chains)
+                    for row, i in enumerate(group):
+                        shot_results[i] = (spectra[row], [filt[row] for filt in filtered])
+
+            row = 0
+            for indices, first, last in batch:
+                set_waves = waves[row:row+len(indices)]
+                row += len(indices)
+                filtered = {}
+
+                if 'Shot Set' in self.modes:
+                    for chain_idx in range(len(self.chains)):
+                        filtered[_column('Shot Set', chain_idx)] = np.concatenate(
+                            [shot_results[i][1][chain_idx] for i in indices])
+                    if f is not None:
+                        for i, wave in zip(indices, set_waves):
+                            self.write(f, 'Shot Set', index['start'][i], index['dt'][i], wave, *shot_results[i])
+
+                if 'Bias Set' in self.modes:
+                    if first:
+                        train = []
+                        train_start = index['start'][indices[0]]
+                    train.extend(set_waves)
+
+                    if last:
+                        signal = np.concatenate(train)
+                        train = []
+                        dt = index['dt'][indices[0]]
+                        spectra, set_filtered = filter_batch(signal[np.newaxis], dt, self.chains)
+                        for chain_idx in range(len(self.chains)):
+                            filtered[_column('Bias Set', chain_idx)] = set_filtered[chain_idx][0]
+                        if f is not None:
+                            self.write(f, 'Bias Set', train_start, dt, signal, spectra[0],
+                                       [filt[0] for filt in set_filtered])
+
+                if 'Bias Set Stream' in self.modes:
+                    stream = self.stream(f, filtered, index, indices, set_waves, first, last, stream)
+
+                if writer is not None:
+                    writer.append(filtered)
+
+    # Filter the next part of a bias set train through each chain's overlap-save filter. Takes and
+    # returns the state of the train's stream, which is started afresh at its first part
+    def stream(self, f, filtered, index, indices, set_waves, first, last, stream=None):
+        dt = index['dt'][indices[0]]
+        if first:
+            stream = {'filters': [OverlapSave(fir_kernel(chain, self.taps, dt)) for name, chain in self.chains],
+                      'signal': np.empty(0), # Input waiting for its filtered samples
+                      'time': index['start'][indices[0]]}
+
+        signal = np.concatenate(list(set_waves))
+        outputs = [overlap_save.process(signal) for overlap_save in stream['filters']]
+        if last:
+            outputs = [np.concatenate((output, overlap_save.flush())) for output, overlap_save in zip(outputs, stream['filters'])]
+        for chain_idx, output in enumerate(outputs):
+            filtered[_column('Bias Set Stream', chain_idx)] = output
+
+        # Filtered samples lag the input, so write the input they belong to
+        stream['signal'] = np.concatenate((stream['signal'], signal))
+        n = len(outputs[0]) if outputs else len(stream['signal'])
+        signal, stream['signal'] = stream['signal'][:n], stream['signal'][n:]
+        if f is not None and n > 0:
+            blank = np.full(n, np.nan)
+            f.write("Meta: Bias Set Stream\n")
+            np.savetxt(f, np.column_stack([stream['time']+dt*np.arange(n), signal, blank, blank, blank]+outputs),
+                       fmt='%.16g', delimiter='\t')
+            f.write("\n")
+        stream['time'] += dt*n
+        return stream
+
+    # Whether shots all have the same length and dt
+    @staticmethod
+    def uniform(index, shots):
+        return (np.all(index['length'][shots] == index['length'][shots[0]]) and
+                np.all(index['dt'][shots] == index['dt'][shots[0]]))
+
+    # Consecutive shots grouped into batches of up to batch_size shots. Each batch is a list of
+    # (shots, first, last) segments of bias sets, where first and last mark the ends of a set
+    def batches(self, sets):
+        batch, size = [], 0
+        for indices in sets:
+            start = 0
+            while start < len(indices):
+                take = min(len(indices)-start, self.batch_size-size)
+                batch.append((indices[start:start+take], start == 0, start+take == len(indices)))
+                size += take
+                start += take
+                if size == self.batch_size:
+                    yield batch
+                    batch, size = [], 0
+        if batch:
+            yield batch
+
+    # Append a block of results to the Fourier file
+    def write(self, f, mode, start, dt, signal, spectrum, filtered):
+        n = len(signal)
+        spectrum = full_spectrum(spectrum, n)
+        f.write("Meta: "+mode+"\n")
+        np.savetxt(f, np.column_stack([start+dt*np.arange(n), signal, fft_freq(n, dt), spectrum.real, spectrum.imag]+filtered),
+                   fmt='%.16g', delimiter='\t')
+        f.write("\n")
+
+
+class FilterWorker(threading.Thread):
+    """Runs a pipeline in a worker thread so that the GUI stays responsive while CFM data is
+    filtered. The error the pipeline failed with, if any, is kept for the GUI to raise once the
+    worker has finished. The worker is not a daemon, so filtering finishes and replaces the
+    outputs of filtering before even if the GUI is closed."""
+
+    def __init__(self, pipeline):
+        threading.Thread.__init__(self)
+        self.pipeline = pipeline
+        self.error = None
+
+    def run(self):
+        try:
+            self.pipeline.run()
+        except Exception as err:
+            self.error = err
+
+
+# Filter bias sets first_set up to last_set in a worker process, writing the results to shard files
+def _filter_shard(pipeline, first_set, last_set, fourier_file, filtered_file):
+    cfm = cfm_index.open_cfm(pipeline.path)
+    f = open(fourier_file, "w") if fourier_file else None
+    writer = hyst_file.RunWriter(filtered_file, pipeline.columns()) if filtered_file else None
+    try:
+        pipeline.filter_sets(cfm, cfm.sets()[first_set:last_set], f, writer)
+    finally:
+        if f is not None:
+            f.close()
+        if writer is not None:
+            writer.close()
+    return fourier_file, filtered_file
+
+# Check that streaming a long bias set train through overlap-save filters matches filtering the
+# whole train at once. Then compare batched real FFT filtering with transforming and masking each
+# shot in a loop, filtering shots one at a time with cached responses against recompiling them,
+# and filtering with several chains in one pass against one pass per chain
+if __name__ == "__main__":
+
+    shot_len = 2048
+    num_sets = 20
+    shots_per_set = 5
+    dt = 1e-6
+
+    # A 2 s bias set train streamed in shot sized chunks
+    train_dt = 1e-5
+    train = np.sin(2*np.pi*30.0*train_dt*np.arange(200000))+0.3*np.random.randn(200000)
+    chain = parse_chains('Butterworth Low Pass', '1e3,4')[0][1]
+    kernel = fir_kernel(chain, 1023, train_dt)
+
+    start = time.perf_counter()
+    overlap_save = OverlapSave(kernel)
+    streamed = [overlap_save.process(train[i:i+shot_len]) for i in range(0, len(train), shot_len)]
+    streamed = np.concatenate(streamed+[overlap_save.flush()])
+    stream_time = time.perf_counter()-start
+
+    # Whole train convolved at once with the same kernel
+    start = time.perf_counter()
+    whole = np.fft.irfft(np.fft.rfft(train, len(train)+len(kernel)-1)*np.fft.rfft(kernel, len(train)+len(kernel)-1),
+                         len(train)+len(kernel)-1)[len(kernel)//2:len(kernel)//2+len(train)]
+    whole_time = time.perf_counter()-start
+    assert len(streamed) == len(train)
+    assert np.allclose(streamed, whole, atol=1e-10)
+    assert np.allclose(streamed[:5000], np.convolve(train[:5000+len(kernel)], kernel, 'same')[:5000], atol=1e-10)
+
+    # Whole train transformed and filtered with the chain's response. The FIR kernel only
+    # approximates the response, so they agree to within its truncation away from the ends
+    spectral = filter_batch(train[np.newaxis], train_dt, ((None, chain),))[1][0][0]
+    interior = slice(len(kernel), -len(kernel))
+    print("{0} sample train".format(len(train)))
+    print("streamed (ms)    whole train (ms)    max difference    max difference from spectral filter")
+    print("{0:13.1f}    {1:16.1f}    {2:14.2e}    {3:35.2e}".format(1000*stream_time, 1000*whole_time,
+          np.max(np.abs(streamed-whole)), np.max(np.abs(streamed[interior]-spectral[interior]))))
+    print()
+
+    directory = tempfile.mkdtemp()
+    try:
+        # Text CFM file as saved during a measurement
+        cfm_file = os.path.join(directory, 'run.txt')
+        t = dt*np.arange(shot_len)
+        with open(cfm_file, 'w') as f:
+            for j in range(num_sets):
+                f.write("\nProbe Offset\n"+str(0.1*j)+"\nBottom Electrode Offset\n0.0\nTime\n"+str(0.5*j)+"\n")
+                for k in range(shots_per_set):
+                    f.write("timestamp\n"+str(k)+"\nwave\n")
+                    for value in 0.03*(1+np.sin(2*np.pi*5e3*t))+0.006*np.random.randn(shot_len):
+                        f.write(str(value)+"\n")
+                    f.write("bwlimit\n1\ndt\n"+str(dt)+"\n")
+
+        chains = parse_chains('Low Pass:High Pass', '2e4:1e3')
+        cfm = cfm_index.open_cfm(cfm_file)
+        waves = cfm.waves(np.arange(len(cfm)))
+
+        def loop_filter(wave):
+            fft = np.fft.fft(wave)
+            freq = np.fft.fftfreq(len(wave), dt)
+            for i in range(len(wave)):
+                if abs(freq[i]) > 2e4 or abs(freq[i]) < 1e3:
+                    fft[i] = 0+0j
+            return np.real(np.fft.ifft(fft))
+
+        start = time.perf_counter()
+        spectra, filtered = filter_batch(waves, dt, chains)
+        batch_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        looped = np.array([loop_filter(wave) for wave in waves])
+        loop_time = time.perf_counter()-start
+
+        assert np.allclose(filtered[0], looped)
+        print("{0} shots x {1} samples".format(len(waves), shot_len))
+        print("batched (ms)    loop (ms)")
+        print("{0:12.1f}    {1:9.1f}".format(1000*batch_time, 1000*loop_time))
+        print()
+
+        # Mains pickup is removed by a notch at 50 Hz and its harmonics
+        mains_dt = 1e-4
+        mains_t = mains_dt*np.arange(10000)
+        signal = np.sin(2*np.pi*7.0*mains_t)
+        pickup = 0.5*np.sin(2*np.pi*50.0*mains_t)+0.2*np.sin(2*np.pi*150.0*mains_t)
+        spectra, notched = filter_batch((signal+pickup)[np.newaxis], mains_dt, parse_chains('Notch', '50,1,3'))
+        assert np.allclose(notched[0][0], signal, atol=1e-6)
+
+        chains = parse_chains('Butterworth Low Pass:Notch;Band Pass', '2e4,4:1e4,500,5;1e3,2e4')
+        start = time.perf_counter()
+        for wave in waves:
+            cached = filter_batch(wave[np.newaxis], dt, chains)[1]
+        cached_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        for wave in waves:
+            spectrum = np.fft.rfft(wave)
+            freq = np.fft.rfftfreq(len(wave), dt)
+            compiled = [np.fft.irfft(spectrum*chain_response(chain, freq), len(wave)) for name, chain in chains]
+        compile_time = time.perf_counter()-start
+
+        assert all(np.allclose(cached[i][0], compiled[i]) for i in range(len(chains)))
+        print("cached responses (ms)    recompiled (ms)")
+        print("{0:21.1f}    {1:15.1f}".format(1000*cached_time, 1000*compile_time))
+        print()
+
+        print("chains    single pass (s)    pass per chain (s)")
+        for num_chains in (1, 2, 4):
+            filters = ";".join(['Low Pass', 'High Pass', 'Low Pass:High Pass', 'High Pass'][:num_chains])
+            params = ";".join(['2e4', '1e3', '2e4:1e3', '5e3'][:num_chains])
+            chains = parse_chains(filters, params)
+
+            def run_file(name):
+                return os.path.join(directory, str(num_chains)+'_'+name+hyst_file.extension)
+
+            start = time.perf_counter()
+            FourierPipeline(cfm_file, chains, filter_modes[:2], filtered_file=run_file('all')).run()
+            single_time = time.perf_counter()-start
+
+            start = time.perf_counter()
+            for chain_idx, chain in enumerate(chains):
+                FourierPipeline(cfm_file, [chain], filter_modes[:2], filtered_file=run_file(str(chain_idx))).run()
+            separate_time = time.perf_counter()-start
+
+            columns, meta = hyst_file.load(run_file('all'))
+            for chain_idx in range(num_chains):
+                separate, meta = hyst_file.load(run_file(str(chain_idx)))
+                for mode in filter_modes[:2]:
+                    assert np.array_equal(separate[_column(mode, 0)], columns[_column(mode, chain_idx)])
+
+            print("{0:6d}    {1:15.2f}    {2:18.2f}".format(num_chains, single_time, separate_time))
+        print()
+
+        # Data this small is filtered in one process when the number of workers is chosen for it
+        assert choose_workers(num_sets*shots_per_set, shot_len) == 1
+
+        # Bias sets shared out to worker processes give the same results as filtering them in turn
+        chains = parse_chains('Low Pass:High Pass;Butterworth Low Pass', '2e4:1e3;1e4,4')
+        workers = max(2, os.cpu_count() or 1)
+        outputs = {}
+        print("workers    time (s)")
+        for num_workers in (1, workers):
+            fourier_file = os.path.join(directory, str(num_workers)+'_fourier.txt')
+            filtered_file = os.path.join(directory, str(num_workers)+'_filtered'+hyst_file.extension)
+
+            start = time.perf_counter()
+            FourierPipeline(cfm_file, chains, filter_modes, fourier_file, filtered_file, batch_size=16,
+                            workers=num_workers).run()
+            outputs[num_workers] = (fourier_file, filtered_file)
+            print("{0:7d}    {1:8.2f}".format(num_workers, time.perf_counter()-start))
+
+        # Streamed bias sets are written a batch at a time and shards start new batches, so blocks
+        # can be split and interleaved differently. The rows of each mode are compared instead.
+        # Streamed times are summed over different blocks so can differ by rounding
+        def rows(fileName):
+            with open(fileName, 'r') as f:
+                blocks = f.read().split("Meta: ")[1:]
+            return {mode: np.vstack([np.loadtxt(block.splitlines()[1:], ndmin=2) for block in blocks
+                                     if block.startswith(mode+"\n")]) for mode in filter_modes}
+        serial, parallel = rows(outputs[1][0]), rows(outputs[workers][0])
+        assert all(np.allclose(serial[mode], parallel[mode], rtol=1e-12, atol=0, equal_nan=True) for mode in filter_modes)
+        serial, meta = hyst_file.load(outputs[1][1])
+        parallel, meta = hyst_file.load(outputs[workers][1])
+        assert all(np.array_equal(serial[column], parallel[column]) for column in serial)
+
+        # Filtering the data again replaces its results rather than adding to them
+        with open(outputs[1][0], 'r') as f:
+            first = f.read()
+        FourierPipeline(cfm_file, chains, filter_modes, *outputs[1], batch_size=16).run()
+        with open(outputs[1][0], 'r') as f:
+            assert f.read() == first
+        again, meta = hyst_file.load(outputs[1][1])
+        assert len(meta['runs']) == 1 and all(np.array_equal(serial[column], again[column]) for column in serial)
+
+        # Runs keep their own state, so one pipeline can filter bias sets in several threads at once
+        pipeline = FourierPipeline(cfm_file, chains, filter_modes, batch_size=16)
+        def filter_part(sets):
+            results = []
+            pipeline.filter_sets(cfm_index.open_cfm(cfm_file), sets, None, results)
+            return results
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            parts = list(executor.map(filter_part, (cfm.sets()[:num_sets//2], cfm.sets()[num_sets//2:])))
+        for column in again:
+            assert np.array_equal(np.concatenate([filtered[column] for part in parts for filtered in part
+                                                  if column in filtered]), again[column])
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# Shot and bias set index for CFM data. Each row locates one shot: its bias set, the byte offset
+# and size of its samples, its length, dt and start time. Text CFM files get a sidecar index that
+# is written while capturing, or rebuilt in a single scan if it is missing or out of date. Binary
+# captures are indexed by their shot table. Readers use the index to read any shot or bias set
+# directly instead of parsing the whole file.
+
+import numpy as np
+
+import cfm_capture # Binary CFM captures
+import hyst_file # Appendable .npy files
+
+import json
+import mmap
+import os
+import re
+
+import time # Benchmark timing
+
+index_dtype = np.dtype([('set', '<i4'), ('offset', '<i8'), ('nbytes', '<i8'), ('length', '<i4'),
+                        ('dt', '<f8'), ('timestamp', '<u8'), ('probeOffset', '<f8'),
+                        ('botElectOffset', '<f8'), ('time', '<f8'), ('start', '<f8')])
+
+# Lines in text CFM files whose next line is a value the index needs
+_text_keys = {b'Probe Offset': 'probeOffset', b'Bottom Electrode Offset': 'botElectOffset',
+              b'Time': 'time', b'dt': 'dt', b'timestamp': 'timestamp'}
+
+# A wave's values end at the next key line. Scaled 16-bit values are never nan or inf so
+# every key starts with a letter and every value does not
+_key_line = re.compile(rb'^[A-Za-z_]', re.M)
+
+
+# Sidecar files of a text CFM file's index
+def _index_file(path):
+    return path+'.idx.npy'
+
+def _state_file(path):
+    return path+'.idx.json'
+
+
+# Size and modification time of the data an index describes
+def _state(path):
+    return {'size': os.path.getsize(path), 'mtime': os.path.getmtime(path)}
+
+
+# Delete a text CFM file's index
+def clear(path):
+    for fileName in (_index_file(path), _state_file(path)):
+        if os.path.exists(fileName):
+            os.remove(fileName)
+
+
+# Build the index of a text CFM file in one pass. Wave values are skipped over rather than parsed
+def scan(path):
+    rows = []
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=index_dtype)
+
+    bias = {'set': -1, 'probeOffset': 0.0, 'botElectOffset': 0.0, 'time': 0.0}
+    shot = {}
+    elapsed = [0.0] # Time taken by the shots before the next one in its bias set
+
+    def end_shot():
+        if 'offset' in shot:
+            row = dict(bias)
+            row.update(shot)
+            row['set'] = max(bias['set'], 0)
+            row['start'] = bias['time']+elapsed[0]
+            elapsed[0] += row['length']*row.get('dt', 0.0)
+            rows.append(tuple(row.get(field, 0) for field in index_dtype.names))
+        shot.clear()
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        key = None
+        while True:
+            line = data.readline()
+            if not line:
+                break
+            line = line.rstrip(b'\r\n')
+
+            if key is not None:
+                if key == 'timestamp':
+                    shot[key] = int(line)
+                elif key == 'dt':
+                    shot[key] = float(line)
+                else:
+                    bias[key] = float(line)
+                key = None
+
+            elif line == b'wave':
+                if 'offset' in shot:
+                    end_shot()
+                offset = data.tell()
+                end = _key_line.search(data, offset)
+                end = end.start() if end else len(data)
+                shot['offset'] = offset
+                shot['nbytes'] = end-offset
+                shot['length'] = data[offset:end].count(b'\n')
+                data.seek(end)
+
+            elif line in _text_keys:
+                key = _text_keys[line]
+                if key == 'probeOffset':
+                    # Each bias set starts with its offsets
+                    end_shot()
+                    bias['set'] += 1
+                    elapsed[0] = 0.0
+                elif key in shot:
+                    # A repeated header belongs to the next shot
+                    end_shot()
+
+        end_shot()
+
+    return np.array(rows, dtype=index_dtype)
+
+
+# Index of a text CFM file, rebuilding it if the file has changed since it was indexed
+def _text_index(path):
+    try:
+        with open(_state_file(path), 'r') as f:
+            state = json.load(f)
+        if state == _state(path):
+            return np.load(_index_file(path))
+    except (OSError, ValueError):
+        pass
+
+    index = scan(path)
+    clear(path)
+    column = hyst_file.ColumnFile(_index_file(path), index_dtype)
+    column.append(index)
+    column.close()
+    if os.path.exists(path):
+        with open(_state_file(path), 'w') as f:
+            json.dump(_state(path), f)
+    return index
+
+
+# Index of a binary capture. Offsets are byte offsets into its waves file
+def _capture_index(capture):
+    shots = capture.shots
+    index = np.zeros(len(shots), dtype=index_dtype)
+    for field in ('set', 'length', 'dt', 'timestamp', 'probeOffset', 'botElectOffset', 'time'):
+        index[field] = shots[field]
+    itemsize = capture.raw.dtype.itemsize
+    index['offset'] = capture.raw.offset+itemsize*shots['offset']
+    index['nbytes'] = itemsize*shots['length']
+
+    # Shots in a bias set follow on from each other
+    duration = shots['length']*shots['dt']
+    elapsed = np.cumsum(duration)-duration
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(shots['set']))+1)) if len(shots) else np.empty(0, np.intp)
+    elapsed -= np.repeat(elapsed[starts], np.diff(np.append(starts, len(shots))))
+    index['start'] = shots['time']+elapsed
+    return index
+
+
+# Index of any CFM data
+def load(path):
+    if cfm_capture.is_capture(path):
+        return _capture_index(cfm_capture.Capture(path))
+    return _text_index(path)
+
+
+# One row per bias set: its first shot, number of shots, offsets and time
+def bias_sets(index):
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(index['set']))+1)) if len(index) else np.empty(0, np.intp)
+    sets = np.zeros(len(starts), dtype=[('first', '<i8'), ('count', '<i8'), ('probeOffset', '<f8'),
+                                        ('botElectOffset', '<f8'), ('time', '<f8')])
+    sets['first'] = starts
+    sets['count'] = np.diff(np.append(starts, len(index)))
+    for field in ('probeOffset', 'botElectOffset', 'time'):
+        sets[field] = index[field][starts]
+    return sets
+
+
+class IndexWriter(object):
+    """Indexes a text CFM file as it is written. An existing index is brought up to date
+    first so shots appended to an old file continue its bias set numbering."""
+
+    def __init__(self, path):
+        self.path = path
+        index = _text_index(path)
+        if os.path.exists(_state_file(path)):
+            os.remove(_state_file(path)) # Out of date until closed
+
+        self._column = hyst_file.ColumnFile(_index_file(path), index_dtype)
+        self._set = int(index['set'][-1]) if len(index) else -1
+        self._bias = (0.0, 0.0, 0.0)
+        self._elapsed = 0.0
+
+    # Start a bias set. t is the time since the start of the measurement
+    def bias_set(self, probeOffset, botElectOffset, t):
+        self._set += 1
+        self._bias = (probeOffset, botElectOffset, t)
+        self._elapsed = 0.0
+
+    # Index a shot whose values were written from byte offset to offset+nbytes
+    def shot(self, shot_set, offset, nbytes):
+        length = len(shot_set['wave'])
+        dt = float(shot_set.get('dt', 0.0))
+        row = np.zeros(1, dtype=index_dtype)
+        row['set'] = self._set
+        row['offset'], row['nbytes'], row['length'] = offset, nbytes, length
+        row['dt'], row['timestamp'] = dt, int(shot_set.get('timestamp', 0))
+        row['probeOffset'], row['botElectOffset'], row['time'] = self._bias
+        row['start'] = self._bias[2]+self._elapsed
+        self._elapsed += length*dt
+        self._column.append(row)
+
+    # Record what the index describes once the data file is closed
+    def close(self):
+        self._column.close()
+        if os.path.exists(self.path):
+            with open(_state_file(self.path), 'w') as f:
+                json.dump(_state(self.path), f)
+
+
+class TextCFM(object):
+    """Read access to a text CFM file through its index, with the same interface as
+    cfm_capture.Capture."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = _text_index(path)
+
+    def __len__(self):
+        return len(self.index)
+
+    # Wave of shot i
+    def wave(self, i):
+        with open(self.path, 'rb') as f:
+            f.seek(self.index['offset'][i])
+            return np.array(f.read(self.index['nbytes'][i]).split(), dtype=np.float64)
+
+    # Indices of the shots in each bias set
+    def sets(self):
+        starts = np.flatnonzero(np.diff(self.index['set']))+1
+        return np.split(np.arange(len(self.index)), starts)
+
+    # Waves of several shots of equal length as rows of a 2D array
+    def waves(self, indices):
+        if len(indices) == 0:
+            return np.empty((0, 0))
+        return np.array([self.wave(i) for i in indices])
+
+
+# Open CFM data for reading. Both readers have an index attribute
+def open_cfm(path):
+    if cfm_capture.is_capture(path):
+        capture = cfm_capture.Capture(path)
+        capture.index = _capture_index(capture)
+        return capture
+    return TextCFM(path)
+
+
+# Compare reading one bias set through the index with scanning the file for it
+if __name__ == "__main__":
+
+    import shutil
+    import tempfile
+
+    shot_len = 2048
+    num_sets = 100
+    shots_per_set = 5
+
+    directory = tempfile.mkdtemp()
+    try:
+        text_file = os.path.join(directory, 'run.txt')
+        with open(text_file, 'w') as f:
+            f.write("Date: 18/10/2026\nCFM Location: run.txt\n")
+            for j in range(num_sets):
+                f.write("\nProbe Offset\n"+str(0.1*j)+"\nBottom Electrode Offset\n0.0\nTime\n"+str(0.5*j)+"\n")
+                for k in range(shots_per_set):
+                    f.write("timestamp\n"+str(1000*j+k)+"\nwave\n")
+                    for value in np.full(shot_len, j+k/10.0):
+                        f.write(str(value)+"\n")
+                    f.write("bwlimit\n1\ndt\n1e-06\nchannel\n0\ntrigchannel\n-1\n")
+
+        start = time.perf_counter()
+        cfm = open_cfm(text_file)
+        index_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        cfm = open_cfm(text_file)
+        cached_time = time.perf_counter()-start
+
+        assert len(cfm) == num_sets*shots_per_set
+        assert np.array_equal(bias_sets(cfm.index)['count'], np.full(num_sets, shots_per_set))
+        assert np.allclose(cfm.index['start'][:2], [0.0, shot_len*1e-6])
+
+        # Last bias set through the index
+        start = time.perf_counter()
+        waves = cfm.waves(cfm.sets()[-1])
+        direct_time = time.perf_counter()-start
+        assert np.allclose(waves[:, 0], num_sets-1+np.arange(shots_per_set)/10.0)
+
+        # Last bias set by scanning lines as the Fourier filter does
+        start = time.perf_counter()
+        shots, shot, append, bias_set = [], [], False, -1
+        with open(text_file, 'r') as data:
+            for line in data:
+                if line == 'bwlimit\n':
+                    if bias_set == num_sets-1:
+                        shots.append(shot)
+                    append = False
+                elif append:
+                    shot.append(float(line))
+                elif line == 'wave\n':
+                    append, shot = True, []
+                elif line == 'Probe Offset\n':
+                    bias_set += 1
+        scan_time = time.perf_counter()-start
+        assert np.allclose(np.array(shots), waves)
+
+        print("{0} bias sets x {1} shots x {2} samples".format(num_sets, shots_per_set, shot_len))
+        print("build index (s)    load index (s)    read set via index (s)    scan for set (s)")
+        print("{0:15.3f}    {1:14.4f}    {2:22.4f}    {3:16.3f}".format(index_time, cached_time, direct_time, scan_time))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# Long-lived device sessions shared by the GUIs. Rather than connecting to the data server and
+# pushing a whole configuration on every execute, a session is opened once and reused. Nodes that
+# cannot change while it is open are only read once, and settings are compared with a shadow
+# copy of what has been sent to the device so that only those that changed are sent again.
+# Settings made outside the session, e.g. in ziControl, are not seen. Forget the device to start
+# afresh.
+
+import fnmatch
+import threading
+
+import time # Benchmark timing
+
+import sim_daq # Simulated instrument for hardware-free runs
+
+# Nodes that do not change while a session is open, other than by setting them through it
+cached_nodes = ('/*/clockbase', '/*/sigins/*/range')
+
+_sessions = {} # Open sessions by device, API level and requirements
+_shadows = {} # Node shadows by device, shared by all of its sessions
+_lock = threading.Lock()
+
+
+class NodeShadow(object):
+    """What a device's nodes have been set to through its sessions, and the values of cached
+    nodes that have been read. Paths may contain wildcards."""
+
+    def __init__(self):
+        self.values = {}
+        self.cache = {}
+        self._lock = threading.RLock()
+
+    # Record a setting. Returns whether it changes the node, so needs to be sent
+    def changed(self, path, value):
+        key = path.lower()
+        with self._lock:
+            if key in self.values and self.values[key] == value:
+                return False
+            self.invalidate(key)
+            self.values[key] = value
+            return True
+
+    # Value of a node, reading it with get the first time if it is cached
+    def read(self, path, get):
+        key = path.lower()
+        if not any(fnmatch.fnmatchcase(key, node) for node in cached_nodes):
+            return get(path)
+        with self._lock:
+            if not key in self.cache:
+                self.cache[key] = get(path)
+            return self.cache[key]
+
+    # Forget what is known about nodes matching path
+    def invalidate(self, path='*'):
+        key = path.lower()
+        with self._lock:
+            for known in (self.values, self.cache):
+                for node in [node for node in known
+                             if fnmatch.fnmatchcase(node, key) or fnmatch.fnmatchcase(key, node)]:
+                    del known[node]
+
+
+class DeviceSession(object):
+    """API session whose settings writes are diffed against the device's node shadow and whose
+    reads of cached nodes are only made once. Everything else is passed through to the session."""
+
+    def __init__(self, daq, device, props, shadow):
+        self._daq = daq
+        self.device = device
+        self.props = props
+        self.shadow = shadow
+        self.sent = 0 # Settings sent to the device
+        self.skipped = 0 # Settings that were already in effect
+
+    def __getattr__(self, name):
+        return getattr(self._daq, name)
+
+    def set(self, settings, value=None):
+        if value is not None:
+            settings = [[settings, value]]
+        changed = [[path, val] for path, val in settings if self.shadow.changed(path, val)]
+        self.sent += len(changed)
+        self.skipped += len(settings)-len(changed)
+        if changed:
+            self._daq.set(changed)
+
+    def setInt(self, path, value):
+        if self._changed(path, int(value)):
+            self._daq.setInt(path, value)
+
+    def setDouble(self, path, value):
+        if self._changed(path, float(value)):
+            self._daq.setDouble(path, value)
+
+    def _changed(self, path, value):
+        changed = self.shadow.changed(path, value)
+        self.sent += changed
+        self.skipped += not changed
+        return changed
+
+    def getInt(self, path):
+        return self.shadow.read(path, self._daq.getInt)
+
+    def getDouble(self, path):
+        return self.shadow.read(path, self._daq.getDouble)
+
+    # Forget nodes that may have been changed outside the session, e.g. by a sweeper module
+    def invalidate(self, path='*'):
+        self.shadow.invalidate(path)
+
+
+# Drop-in replacement for sim_daq.api_session that reuses the session opened by an earlier call
+# with the same arguments
+def api_session(device_id, api_level, **kwargs):
+    key = (device_id.lower(), api_level, repr(sorted(kwargs.items())))
+    with _lock:
+        if not key in _sessions:
+            (daq, device, props) = sim_daq.api_session(device_id, api_level, **kwargs)
+            _sessions[key] = DeviceSession(daq, device, props, _shadows.setdefault(device, NodeShadow()))
+        session = _sessions[key]
+    return (session, session.device, session.props)
+
+
+# Close a device's sessions and forget its nodes, so the next session connects again. Used after
+# errors, when the connection or the shadow of the device's settings may no longer be good
+def forget(device_id):
+    with _lock:
+        for key in [key for key in _sessions if key[0] == device_id.lower()]:
+            del _sessions[key]
+        _shadows.pop(device_id.lower(), None)
+
+
+# Settings sent to a device and those skipped as already in effect, over all of its open sessions
+def counts(device_id):
+    with _lock:
+        sessions = [session for key, session in _sessions.items() if key[0] == device_id.lower()]
+    return sum(session.sent for session in sessions), sum(session.skipped for session in sessions)
+
+
+# Compare repeated executes of a hysteresis configuration through new sessions and through a
+# shared session, on a simulated device that takes 1 ms to apply each set
+if __name__ == "__main__":
+
+    import os
+
+    os.environ['ZI_SIMULATE'] = '1'
+    sim_daq.default_settings['set_latency'] = 1e-3
+
+    def execute(daq, device):
+        general_setting = [['/%s/demods/*/enable' % device, 0],
+                           ['/%s/demods/*/trigger' % device, 0],
+                           ['/%s/sigouts/*/enables/*' % device, 0],
+                           ['/%s/scopes/*/enable' % device, 0]]
+        daq.set(general_setting)
+        daq.sync()
+        exp_setting = [['/%s/demods/%d/enable' % (device, 0), 1],
+                       ['/%s/sigouts/%d/on' % (device, 0), 1],
+                       ['/%s/auxouts/%d/outputselect' % (device, 0), -1],
+                       ['/%s/auxouts/%d/outputselect' % (device, 1), -1],
+                       ['/%s/sigouts/%d/add' % (device, 0), 1]]
+        for setting in exp_setting:
+            daq.set([setting])
+        daq.sync()
+        for step in range(20):
+            float(daq.getInt('/%s/clockbase' % device))
+            daq.getDouble('/%s/sigins/%d/range' % (device, 0))
+
+    print("session     first execute (ms)    repeat execute (ms)    settings sent")
+    for name, connect in (("new", sim_daq.api_session), ("shared", api_session)):
+        times = []
+        for repeat in range(5):
+            start = time.perf_counter()
+            (daq, device, props) = connect('dev801', 1)
+            execute(daq, device)
+            times.append(time.perf_counter()-start)
+        sent = daq.sent if isinstance(daq, DeviceSession) else "all"
+        print("{0:6s}    {1:18.1f}    {2:19.1f}    {3:>13}".format(name, 1000*times[0], 1000*sum(times[1:])/4, sent))
+
+    # Settings through a wildcard are sent again once a node it covers has been changed
+    (daq, device, props) = api_session('dev801', 1)
+    sent = daq.sent
+    daq.set([['/dev801/demods/*/enable', 0]])
+    daq.set([['/dev801/demods/0/enable', 1]])
+    daq.set([['/dev801/demods/*/enable', 0]])
+    assert daq.sent-sent == 3
+    assert daq._daq.getInt('/dev801/demods/0/enable') == 0
+
+    # A forgotten device connects again and sends everything
+    forget('dev801')
+    (daq, device, props) = api_session('dev801', 1)
+    execute(daq, device)
+    assert daq.skipped == 0
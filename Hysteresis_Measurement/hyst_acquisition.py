@@ -0,0 +1,675 @@
+# -*- coding: utf-8 -*-
+
+# For communication with lock-in amplifier
+from __future__ import print_function
+import numpy as np
+import device_session # Long-lived device sessions
+
+import stream_acquisition # Continuous acquisition for whole runs
+import cfm_capture # Binary CFM captures
+import cfm_index # Shot index of text CFM files
+import run_average # Vectorised averaging over repeated values
+import hyst_schedule # Bias schedules of scan patterns
+import run_timing # Run duration prediction
+import settling # Demodulator settling detection
+import stall_poll # Stall handling for polled windows
+import run_checkpoint # Checkpoint logs for resuming runs
+
+import queue # Hands measurements to the GUI
+import threading
+
+import time # Data and time
+
+
+# Columns recorded for a demodulator other than the first, which is recorded as X, Y, R and Phase.
+# demod is the demodulator's number, starting at 1
+def demod_columns(demod):
+    return tuple(field+str(demod) for field in ('X', 'Y', 'R', 'Phase'))
+
+
+class HystAcquisition(threading.Thread):
+    """Takes a hysteresis measurement in a worker thread so that step timing is set by the
+    instrument rather than by the GUI. Measured samples, progress and the end of the run are
+    put on a bounded queue as (kind, value) pairs for the GUI to consume at its own rate.
+
+    options holds the GUI settings the measurement depends on, read before the run starts
+    as Tk variables must not be read from other threads."""
+
+    def __init__(self, device_id, hystParam, options, queue_size=100):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.device_id = device_id
+        self.hystParam = hystParam
+        self.options = options
+        self.queue = queue.Queue(queue_size)
+        self.streamAcq = None
+        self.cfmWriter = None # Binary CFM capture, if CFM is saved to one
+        self.cfmIndex = None # Index of a text CFM file, if CFM is saved to one
+        self.latencies = run_timing.Latencies() # Time taken by instrument calls and steps beyond their nominal times
+        self.stalls = stall_poll.StallStats() # Stalled polls of each step
+        self.demod_rate = None
+        self.extra_demods = [] # Indices of demodulators recorded alongside the first
+        self.checkpoint = None # Log of completed steps, if the run is checkpointed
+        self.schedule = None
+        
+        self._cancel = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+        
+    def run(self):
+        try:
+            self.measure()
+            
+            # Time the next run of this kind from this one
+            run_timing.record(run_timing.config_key(self.options['streaming'], self.options['doCFM'], self.options['settleTo']),
+                              self.latencies.summary())
+        except Exception as err:
+            # The next run reconnects rather than trusting the session's view of the device
+            device_session.forget(self.device_id)
+            self.put(('error', err))
+        if self.cfmWriter is not None:
+            self.cfmWriter.close()
+        if self.cfmIndex is not None:
+            self.cfmIndex.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        self.put(('done', self.cancelled()))
+        
+    # Stop after the current step
+    def cancel(self):
+        self._cancel.set()
+        self._resume.set()
+        
+    def cancelled(self):
+        return self._cancel.is_set()
+        
+    # Hold at 0 V before the next step until resumed
+    def pause(self):
+        self._resume.clear()
+        
+    def resume(self):
+        self._resume.set()
+        
+    def paused(self):
+        return not self._resume.is_set()
+        
+    # Waits while the GUI catches up if the queue is full
+    def put(self, item):
+        self.queue.put(item)
+        
+    # Report progress through the run, then wait here if paused. A streamed run drops the data
+    # streamed while it is paused
+    def progress(self, fraction):
+        self.put(('progress', fraction))
+        if self.paused() and self.streamAcq is not None:
+            self.streamAcq.hold()
+            self._resume.wait()
+            self.streamAcq.release()
+        self._resume.wait()
+        
+    # Hand the sample of the step at index in the schedule to the GUI, logging it first if the run
+    # is checkpointed
+    def record(self, sample, index):
+        if sample is not None:
+            if self.checkpoint is not None:
+                row = self.schedule[index]
+                self.checkpoint.append(sample, index, int(row['loop']), int(row['step']))
+            self.put(('sample', sample))
+        
+    # Record streamed steps, which are only returned once they are complete. Each is recorded as its
+    # own sample so that it is logged against its own step
+    def record_stream(self, steps, scale):
+        for step in steps:
+            self.record(self.stream_sample([step], scale), step['index'])
+        
+        
+    # Configure the instrument and take the measurements
+    def measure(self):
+        
+        start = time.perf_counter()
+        hystParam = self.hystParam
+        
+        # Measurement parameters
+        probeMaxDC = hystParam[0]
+        probeMinDC = hystParam[1]
+        botElectMaxDC = -hystParam[2]   # Apply in opposite direction to probe offset
+        botElectMinDC = -hystParam[3]   # Apply in opposite direction to probe offset
+        biasTime = hystParam[4]
+        biasInter = hystParam[5]
+        zeroVTime = hystParam[6]
+        zeroVInter = hystParam[7]
+        numSteps = int(hystParam[8])+1   # +1 to add 0th step
+        numLoops = int(hystParam[9])
+        probeAux = int(hystParam[10])-1   # -1 so indices start at 0
+        botElectAux = int(hystParam[11])-1   # -1 so indices start at 0
+        pattern = hystParam[12]
+        out_channel = hystParam[13]-1   # -1 so indices start at 0
+        demod_indices = [int(demod)-1 for demod in np.ravel(hystParam[14])]   # -1 so indices start at 0
+        demod_index = demod_indices[0]
+        self.extra_demods = demod_indices[1:]
+        if self.extra_demods and self.options['streaming'] == 1:
+            raise ValueError("Streamed runs record a single demodulator")
+        
+        # Offsets of every step, planned before the instrument is touched
+        schedule = hyst_schedule.build(probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps, numLoops, pattern)
+        self.schedule = schedule
+        
+        # Log completed steps. A resumed run hands over the steps already logged and carries on
+        # from the step after them
+        first_step = 0
+        if self.options['checkpoint']:
+            columns = run_checkpoint.sample_columns+sum((demod_columns(index+1) for index in self.extra_demods), ())
+            self.checkpoint = run_checkpoint.CheckpointLog(self.options['checkpoint'],
+                                                           run_checkpoint.identity(hystParam, self.options),
+                                                           self.options['resume'] == 1, columns)
+            for sample in self.checkpoint.samples:
+                self.put(('sample', sample))
+            first_step = self.checkpoint.completed
+    
+        apilevel = 1  # The API level supported
+        # Call a zhinst utility function that returns:
+        # - an API session `daq` in order to communicate with devices via the data server.
+        # - the device ID string that specifies the device branch in the server's node hierarchy.
+        # - the device's discovery properties.
+        err_msg = "This example only supports instruments with demodulators."
+        (daq, device, props) = device_session.api_session(self.device_id, apilevel,
+                                                               required_devtype='.*LI|.*IA|.*IS&HF2',
+                                                               required_err_msg=err_msg)
+        daq = run_timing.TimedSession(daq, self.latencies)
+    
+        # Create a base instrument configuration: disable all outputs, demods and scopes.
+        general_setting = [['/%s/demods/*/enable' % device, 0],
+                           ['/%s/demods/*/trigger' % device, 0],
+                           ['/%s/sigouts/*/enables/*' % device, 0],
+                           ['/%s/scopes/*/enable' % device, 0]]
+        if 'IA' in props['options']:
+            general_setting.append(['/%s/imps/*/enable' % device, 0])
+        daq.set(general_setting)
+        
+        # Perform a global synchronisation between the device and the data server:
+        # Ensure that the settings have taken effect on the device before setting
+        # the next configuration.
+        daq.sync()
+    
+        # Now configure the instrument for this experiment. The following channels
+        # and indices work on all device configurations. The values below may be
+        # changed if the instrument has multiple input/output channels and/or either
+        # the Multifrequency or Multidemodulator options installed.
+        exp_setting = [['/%s/demods/%d/enable'         % (device, index), 1] for index in demod_indices]
+        exp_setting += [['/%s/sigouts/%d/on'            % (device, out_channel), 1],
+                        ['/%s/auxouts/%d/outputselect' % (device, probeAux), -1],   # Manual output
+                        ['/%s/auxouts/%d/outputselect' % (device, botElectAux), -1]]   # Manual output
+        # Some other device-type dependent configuration may be required. For
+        # example, disable the signal inputs `diff` and the signal outputs `add` for
+        # HF2 instruments.
+        if props['devicetype'].startswith('HF2'):
+            exp_setting.append(['/%s/sigouts/%d/add'      % (device, out_channel), 1])
+        daq.set(exp_setting)
+    
+        # Wait for the demodulator filter to settle.
+        time_constant = 1e-6
+        time.sleep(10*time_constant)
+        
+        scale = 0 # Scaling factor for 16-bit integers returned by CFM scope
+        
+        # Subscribe to scope if performing CFM 
+        if self.options['doCFM'] == 1 and biasTime+zeroVTime > 0:
+            
+            scope_time = self.options['scopeTime']
+            scope_channel = self.options['cfmIn']
+            bwLim = self.options['bwLim']
+            
+            scope_settings = [['/%s/scopes/0/channel'         % (device), scope_channel],
+                              ['/%s/scopes/0/trigchannel'     % (device), -1],
+                              #['/%s/scopes/0/triglevel'       % (device), 0.0],
+                              #['/%s/scopes/0/trigholdoff'     % (device), 0.1],
+                              # Enable bandwidth limiting: avoid antialiasing effects due to
+                              # sub-sampling when the scope sample rate is less than the input
+                              # channel's sample rate.
+                              ['/%s/scopes/0/bwlimit'         % (device), bwLim],
+                              # Set the sampling rate.
+                              ['/%s/scopes/0/time'            % (device), scope_time],
+                              # Enable the scope
+                              ['/%s/scopes/0/enable' % device, 1]]
+            
+            daq.set(scope_settings)
+            
+            sigout_range = daq.getDouble('/%s/sigins/%d/range' % (device, scope_channel))
+            scale = sigout_range/(2**15)  # The scope's wave are 16-bit integers
+            
+            # Write metadata to file. Binary captures keep the raw 16-bit waves and are scaled when read
+            fileName = self.options['cfmFile']
+            if self.options['saveCFM'] == 1 and cfm_capture.is_capture(fileName):
+                self.cfmWriter = cfm_capture.CaptureWriter(fileName, scale, self.options['metadata'])
+            else:
+                save_cfm_to = open(fileName, "a")
+                save_cfm_to.write(self.options['metadata'])
+                save_cfm_to.close()
+                
+                # Index shots as they are written so they can be read without parsing the file
+                if self.options['saveCFM'] == 1:
+                    self.cfmIndex = cfm_index.IndexWriter(fileName)
+            
+            self.cfm_time0 = time.time()
+    
+        # Perform a global synchronisation between the device and the data server:
+        # Ensure that 1. the settings have taken effect on the device before issuing
+        # the poll() command and 2. clear the API's data buffers.
+        daq.sync()
+    
+        # Plan measurement buffer capacity for the whole run from the demodulator rate,
+        # with some headroom for polls that return slightly more samples than expected
+        demod_rate = daq.getDouble('/%s/demods/%d/rate' % (device, demod_index))
+        self.demod_rate = demod_rate
+        expected_len = int(1.1*(len(schedule)-first_step)*(biasTime+zeroVTime)*demod_rate)
+        self.put(('expected', expected_len))
+    
+        # Set polling parameters
+        poll_timeout = 500  # [ms]
+        poll_flags=0
+        poll_return_flat_dict=True
+        
+        # Subscribe once for the whole run if streaming
+        self.streamAcq = None
+        if self.options['streaming'] == 1:
+            self.streamAcq = stream_acquisition.StreamAcquisition(daq, device, demod_index, probeAux, botElectAux,
+                                                                  self.options['doCFM'] == 1 and biasTime+zeroVTime > 0,
+                                                                  poll_timeout, poll_flags)
+            self.streamAcq.start()
+        
+        # Predict the time left from previous runs of this kind, correcting it as steps are taken
+        step_time = biasTime+biasInter+zeroVTime+zeroVInter
+        clock = run_timing.RunClock(len(schedule)-first_step, step_time, run_timing.overheads(
+            run_timing.load(), run_timing.config_key(self.options['streaming'], self.options['doCFM'], self.options['settleTo'])))
+        self.latencies.add('setup', time.perf_counter()-start)
+        self.put(('eta', clock.remaining()))
+        
+        # Apply each step of the scan's schedule in turn
+        for index in range(first_step, len(schedule)):
+            step = schedule[index]
+            
+            # Steps skipped once cancelled are not timed
+            if self.cancelled():
+                break
+            
+            # Update progress
+            self.progress(float(step['progress']))
+            
+            # Cancelling while paused skips the step
+            if self.cancelled():
+                break
+            
+            # Record relevant measurements
+            step_start = time.perf_counter()
+            self.stalls.start_step()
+            if self.streamAcq is not None:
+                # Streamed runs are split into steps by device timestamps. They are returned once the next step has started
+                self.record_stream(self.streamAcq.step(float(step['probeOffset']), float(step['botElectOffset']), biasTime,
+                                                       zeroVTime, biasInter, zeroVInter, index), scale)
+            else:
+                sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, float(step['probeOffset']),
+                                             float(step['botElectOffset']), demod_index, biasTime, zeroVTime, biasInter,
+                                             zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
+                self.record(sample, index)
+            
+            elapsed = time.perf_counter()-step_start
+            self.latencies.add('step', elapsed-step_time)
+            self.latencies.add('stall', self.stalls.steps[-1][1])
+            clock.step(elapsed)
+            self.put(('eta', clock.remaining()))
+                
+        # Record the last streamed step, which ends with the stream
+        if self.streamAcq is not None:
+            self.record_stream(self.streamAcq.finish(), scale)
+            self.streamAcq.stop()
+                
+        # Disable the scope.
+        if self.options['doCFM'] == 1:
+            daq.setInt('/%s/scopes/0/enable' % device, 0)
+
+    def bias_zero_samp(self, daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
+                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags,
+                       poll_return_flat_dict, numLoops, scale):
+        
+        # Skip the remaining steps once cancelled
+        if self.cancelled():
+            return None
+        
+        # Apply Bias
+        daq.set([['/%s/auxouts/%d/offset' % (device, probeAux), probeOffset],
+                 ['/%s/auxouts/%d/offset' % (device, botElectAux), botElectOffset]])
+        tag = self.set_timestamp(daq, device, probeAux, botElectAux)
+        
+        path = '/%s/demods/%d/sample' % (device, demod_index) # Demodulator path
+        extra_paths = ['/%s/demods/%d/sample' % (device, index) for index in self.extra_demods]
+        
+        # Allow bias intermissionary settling time
+        if biasInter != 0.0:
+            self.settle(daq, path, biasInter)
+        
+        # Data from before the bias took effect is trimmed rather than synchronised away
+        if not self.options['unsync'] == 1 and tag is None:
+            daq.sync()
+                    
+        # Record data while bias is being applied
+        # Unsubscribe from all paths.
+        daq.unsubscribe('*')
+        
+        path2 = '/%s/scopes/0/wave' % (device) # CFM scope path
+        save_cfm_to = ""
+        
+        # Open file to append data if performing CFM
+        if self.options['doCFM'] == 1 and biasTime+zeroVTime > 0 and self.cfmWriter is None:
+            
+            # Complete cfm dataset will be save to hard disk
+            fileName = self.options['cfmFile']
+            save_cfm_to = open(fileName, "a")
+            
+            
+        if biasTime != 0:
+            
+            # Poll the bias window in sub-polls, re-polling only what a stall leaves missing
+            paths = [path]+extra_paths+([path2] if self.options['doCFM'] == 1 else [])
+            data = stall_poll.poll_window(daq, paths, biasTime, self.demod_rate, self.stalls, poll_timeout,
+                                          poll_flags, lambda polled: self.trim(polled, tag))
+                        
+            # Check that the dictionary returned is non-empty
+            assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
+                    
+            # The data returned is a dictionary of dictionaries that reflects the node's path.
+            # Note, the data could be empty if no data had arrived, e.g., if the demods
+            # were disabled or had demodulator rate 0.
+            assert path in data, "The data dictionary returned by poll has no key `%s`." % path
+            
+            sample = data[path]
+            assert len(sample['timestamp']) > 1, "The demodulator stalled for over %g s." % stall_poll.stall_limit
+            if self.options['doCFM'] == 1:
+                scope_sample = data.get(path2, [])
+                    
+    
+            # Check how many seconds of demodulator data were returned by poll.
+            # First, get the sampling rate of the device's ADCs, the device clockbase...
+            clockbase = float(daq.getInt('/%s/clockbase' % device))
+                        
+            # Convert timestamps from ticks to seconds via clockbase.
+            sample['t'] = (sample['timestamp'] - sample['timestamp'][0])/clockbase
+            sample['t'] += sample['t'][1]
+            
+            # Voltages
+            sample['ProbeV'] = np.empty(len(sample['t']))
+            sample['ProbeV'].fill(probeOffset)
+            sample['BotElectV'] = np.empty(len(sample['t']))
+            sample['BotElectV'].fill(botElectOffset)
+            sample['TotalV'] = sample['ProbeV']-sample['BotElectV']
+                        
+                        
+            # Calculate the demodulator's magnitude and phase and add them to the dict.
+            sample['R'] = np.abs(sample['x'] + 1j*sample['y'])
+            sample['Phase'] = np.angle(sample['x'] + 1j*sample['y'])
+            self.add_demods(sample, data, extra_paths)
+            
+            
+        if zeroVTime+zeroVInter > 0:
+            # Apply 0 V bias between steps
+            daq.set([['/%s/auxouts/%d/offset' % (device, probeAux), 0],
+                     ['/%s/auxouts/%d/offset' % (device, botElectAux), 0]])
+            tag = self.set_timestamp(daq, device, probeAux, botElectAux)
+                    
+                    
+        # Allow 0 V intermissionary settling time
+        if zeroVInter != 0.0:
+            self.settle(daq, path, zeroVInter)
+        
+        
+        if not self.options['unsync'] == 1 and tag is None:
+            daq.sync()
+        
+        if zeroVTime != 0.0:
+            
+            # Poll the 0 V window in sub-polls, re-polling only what a stall leaves missing
+            paths = [path]+extra_paths+([path2] if self.options['doCFM'] == 1 else [])
+            data = stall_poll.poll_window(daq, paths, zeroVTime, self.demod_rate, self.stalls, poll_timeout,
+                                          poll_flags, lambda polled: self.trim(polled, tag))
+                        
+            # Check that the dictionary returned is non-empty
+            assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
+                    
+            # The data returned is a dictionary of dictionaries that reflects the node's path.
+            # Note, the data could be empty if no data had arrived, e.g., if the demods
+            # were disabled or had demodulator rate 0.
+            assert path in data, "The data dictionary returned by poll has no key `%s`." % path
+                    
+            # Access the demodulator sample using the node's path
+            sample2 = data[path]
+            assert len(sample2['timestamp']) > 1, "The demodulator stalled for over %g s." % stall_poll.stall_limit
+            if self.options['doCFM'] == 1:
+                scope_sample2 = data.get(path2, [])
+                    
+    
+            # Check how many seconds of demodulator data were returned by poll.
+            # First, get the sampling rate of the device's ADCs, the device clockbase...
+            clockbase = float(daq.getInt('/%s/clockbase' % device))
+                        
+            # Convert timestamps from ticks to seconds via clockbase.
+            sample2['t'] = (sample2['timestamp'] - sample2['timestamp'][0])/clockbase
+            sample2['t'] += sample2['t'][1]
+    
+            # Voltages
+            sample2['ProbeV'] = np.empty(len(sample2['t']))
+            sample2['ProbeV'].fill(0)
+            sample2['BotElectV'] = np.empty(len(sample2['t']))
+            sample2['BotElectV'].fill(0)
+            sample2['TotalV'] = sample2['ProbeV']-sample2['BotElectV']
+                        
+            # Calculate the demodulator's magnitude and phase and add them to the dict.
+            sample2['R'] = np.abs(sample2['x'] + 1j*sample2['y'])
+            sample2['Phase'] = np.angle(sample2['x'] + 1j*sample2['y'])
+            self.add_demods(sample2, data, extra_paths)
+            
+        
+        # Amalgamate any CFM data and iterpolate times
+        if self.options['doCFM'] == 1:
+            
+            if biasTime != 0.0:
+                
+                # Combine shot trains, saving the scaled scope trains if requested
+                shot_sets = self.cfm_shots(save_cfm_to, probeOffset, botElectOffset, scope_sample, scale)
+            
+                # Compress shot train array to same size as other arrays
+                sample['CFM_V'] = self.cfm_samples(shot_sets, scope_sample, sample['timestamp'], clockbase)
+            
+            
+            if zeroVTime != 0.0:
+            
+                # Combine shot trains
+                shot_sets2 = self.cfm_shots(save_cfm_to, 0, 0, scope_sample2, scale)
+                
+                # Compress shot train array to same size as other arrays
+                sample2['CFM_V'] = self.cfm_samples(shot_sets2, scope_sample2, sample2['timestamp'], clockbase)
+                        
+                sample['CFM_V'] = np.append(sample['CFM_V'], sample2['CFM_V'])
+                
+                
+            if self.cfmWriter is None:
+                save_cfm_to.close()
+                
+        if biasTime != 0 and zeroVTime != 0.0:
+            
+            sample['x'] = np.append(sample['x'], sample2['x'])
+            sample['y'] = np.append(sample['y'], sample2['y'])
+            sample['R'] = np.append(sample['R'], sample2['R'])
+            sample['Phase'] = np.append(sample['Phase'], sample2['Phase'])
+            sample['t'] = np.append(sample['t'], sample2['t']+sample['t'][-1])
+            sample['ProbeV'] = np.append(sample['ProbeV'], sample2['ProbeV'])
+            sample['BotElectV'] = np.append(sample['BotElectV'], sample2['BotElectV'])
+            sample['TotalV'] = np.append(sample['TotalV'], sample2['TotalV'])
+            for index in self.extra_demods:
+                for column in demod_columns(index+1):
+                    sample[column] = np.append(sample[column], sample2[column])
+            
+        if biasTime != 0:
+            return sample
+        if zeroVTime != 0:
+            return sample2
+        
+    # Scale scope shot sets to voltages and combine them, saving them if requested
+    def cfm_shots(self, save_cfm_to, probeOffset, botElectOffset, scope_sample, scale):
+        
+        shot_sets = []
+        if self.cfmWriter is not None:
+            # Raw shots are appended as they are
+            self.cfmWriter.bias_set(probeOffset, botElectOffset, time.time()-self.cfm_time0)
+            self.cfmWriter.append(scope_sample)
+                
+        elif self.options['saveCFM'] == 1:
+            # Provide bias metadata
+            save_cfm_to.write("\nProbe Offset\n")
+            save_cfm_to.write(str(probeOffset)+"\n")
+            save_cfm_to.write("Bottom Electrode Offset\n")
+            save_cfm_to.write(str(botElectOffset)+"\n")
+            save_cfm_to.write("Time\n")
+            t = time.time()-self.cfm_time0
+            save_cfm_to.write(str(t)+"\n")
+            self.cfmIndex.bias_set(probeOffset, botElectOffset, t)
+            
+        for shot_set in scope_sample:
+            
+            # Extract and scale the voltages
+            scaled_shots = scale*shot_set['wave']
+            shot_sets.append(scaled_shots)
+            
+            if self.options['saveCFM'] == 1 and self.cfmWriter is None:
+                for key in shot_set:
+                    if key != 'wave':
+                        save_cfm_to.write(str(key)+"\n")
+                        save_cfm_to.write(str(shot_set[key])+"\n")
+                    else:
+                        save_cfm_to.write("wave\n")
+                        offset = save_cfm_to.tell()
+                        for scaled_shot in scaled_shots:
+                            save_cfm_to.write(str(scaled_shot)+"\n")
+                        self.cfmIndex.shot(shot_set, offset, save_cfm_to.tell()-offset)
+                            
+        if not shot_sets:
+            return np.empty((0))
+        return np.concatenate(shot_sets)
+    
+    
+    # Combine streamed steps into a sample like those taken by polling each bias separately
+    def stream_sample(self, steps, scale):
+        
+        segments = [step[name] for step in steps for name in ('bias', 'zero')
+                    if step[name] is not None and len(step[name]['t']) > 0]
+        if not segments:
+            return None
+        
+        sample = {}
+        sample['x'] = np.concatenate([segment['x'] for segment in segments])
+        sample['y'] = np.concatenate([segment['y'] for segment in segments])
+        sample['t'] = np.concatenate([segment['t'] for segment in segments])
+        
+        # Voltages
+        sample['ProbeV'] = np.concatenate([np.full(len(segment['t']), segment['probeOffset'], dtype=np.float64)
+                                           for segment in segments])
+        sample['BotElectV'] = np.concatenate([np.full(len(segment['t']), segment['botElectOffset'], dtype=np.float64)
+                                              for segment in segments])
+        sample['TotalV'] = sample['ProbeV']-sample['BotElectV']
+        
+        # Calculate the demodulator's magnitude and phase and add them to the dict.
+        sample['R'] = np.abs(sample['x'] + 1j*sample['y'])
+        sample['Phase'] = np.angle(sample['x'] + 1j*sample['y'])
+        
+        # Compress each segment's shot trains to the same size as its other arrays
+        if self.options['doCFM'] == 1:
+            
+            save_cfm_to = ""
+            if self.options['saveCFM'] == 1 and self.cfmWriter is None:
+                save_cfm_to = open(self.options['cfmFile'], "a")
+            
+            cfm = []
+            for segment in segments:
+                shot_sets = self.cfm_shots(save_cfm_to, segment['probeOffset'], segment['botElectOffset'],
+                                           segment['shots'], scale)
+                if len(shot_sets) > 0:
+                    cfm.append(self.cfm_samples(shot_sets, segment['shots'], segment['timestamp'],
+                                                self.streamAcq.clockbase))
+                else:
+                    cfm.append(np.full(len(segment['t']), np.nan))
+            sample['CFM_V'] = np.concatenate(cfm)
+            
+            if self.options['saveCFM'] == 1 and self.cfmWriter is None:
+                save_cfm_to.close()
+        
+        return sample
+    
+    
+    # Add the other demodulators' samples to sample, averaged over the times closest to each of the
+    # first demodulator's samples so that every column has one value per sample
+    def add_demods(self, sample, data, extra_paths):
+        for index, path in zip(self.extra_demods, extra_paths):
+            x = np.full(len(sample['timestamp']), np.nan)
+            y = np.full(len(sample['timestamp']), np.nan)
+            if path in data:
+                x = run_average.mean_by_time(data[path]['x'], data[path]['timestamp'], sample['timestamp'])
+                y = run_average.mean_by_time(data[path]['y'], data[path]['timestamp'], sample['timestamp'])
+            
+            columns = demod_columns(index+1)
+            sample[columns[0]] = x
+            sample[columns[1]] = y
+            sample[columns[2]] = np.abs(x + 1j*y)
+            sample[columns[3]] = np.angle(x + 1j*y)
+    
+    
+    # Device timestamp the offsets last set took effect at, read back from the offset nodes. None
+    # unless polled data is trimmed by time rather than synchronised after every change
+    def set_timestamp(self, daq, device, probeAux, botElectAux):
+        if self.options['trimByTime'] == 0:
+            return None
+        data = daq.get('/%s/auxouts/%d/offset,/%s/auxouts/%d/offset' % (device, probeAux, device, botElectAux), True)
+        return max(int(node['timestamp'][-1]) for node in data.values())
+    
+    
+    # Discard polled demodulator samples and scope shots from before the device timestamp tag
+    @staticmethod
+    def trim(data, tag):
+        if tag is None:
+            return data
+        for path, node in data.items():
+            if isinstance(node, list):
+                data[path] = [shot for shot in node if int(shot['timestamp']) >= tag]
+            else:
+                keep = node['timestamp'] >= tag
+                data[path] = {key: value[keep] if np.ndim(value) == 1 and len(value) == len(keep) else value
+                              for key, value in node.items()}
+        return data
+    
+    
+    # Wait for the sample to settle after an offset change. With a settling inaccuracy the wait
+    # ends once the demodulator has settled to it and is only an upper bound
+    def settle(self, daq, path, wait):
+        if self.options['settleTo'] is None:
+            time.sleep(wait)
+        else:
+            settling.wait(daq, path, wait, self.options['settleTo'])
+    
+    
+    # Change arr1 of sizelen1 to smaller size len2 by taking means of chinks
+    def mean_chunks(self, arr1, len1, len2):
+        return run_average.mean_chunks(arr1[:len1], len2)
+    
+    
+    # Device timestamps of every scope sample. A shot's timestamp is that of its last sample
+    @staticmethod
+    def scope_times(scope_sample, clockbase):
+        if len(scope_sample) == 0:
+            return np.empty((0))
+        return np.concatenate([float(shot_set['timestamp'])-shot_set['dt']*clockbase*np.arange(len(shot_set['wave'])-1, -1, -1)
+                               for shot_set in scope_sample])
+    
+    
+    # Compress CFM trains to one value per demodulator sample, either by splitting them evenly or
+    # by averaging the scope samples closest in time to each demodulator sample
+    def cfm_samples(self, shot_sets, scope_sample, timestamps, clockbase):
+        if self.options['cfmByTime'] == 1:
+            return run_average.mean_by_time(shot_sets, self.scope_times(scope_sample, clockbase), timestamps)
+        return self.mean_chunks(shot_sets, len(shot_sets), len(timestamps))
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Headless hysteresis runs. A job file lists jobs as settings by name, the names being those of
+# hyst_job.fields. Settings a job leaves out are taken from the file's common settings, then from
+# the default values file, as the GUI starts with them. Every job is checked by the GUI's rules
+# before any is run. The jobs are then run one after another through the acquisition worker and
+# each job's measurements are written to its Record To file: a run file if it ends in .hyst,
+# appended to as they are taken, otherwise text in the GUI's output format once the job ends.
+# Neither Tk nor matplotlib is imported, so runs start quickly. Automatic Fourier filtering of
+# CFM data is left to the GUI.
+#
+#   python hyst_batch.py jobs.json [--device dev801] [--check]
+#
+# where jobs.json is e.g.
+#
+#   {"device": "dev801",
+#    "settings": {"numSteps": 50, "pattern": "Min-Max-Min"},
+#    "jobs": [{"probeMaxDC": 2, "recordTo": "loop_2V.hyst"},
+#             {"probeMaxDC": 4, "recordTo": "loop_4V.txt"}]}
+#
+# A file holding a list is taken to be the jobs.
+
+import numpy as np
+
+import argparse
+import json
+import os
+import queue
+import sys
+
+import hyst_acquisition # Measurements are taken in a worker thread
+import hyst_file # Binary columnar run files
+import hyst_job # Settings of hysteresis jobs
+import run_average # Vectorised averaging over repeated values
+
+import time # Benchmark timing
+
+default_device = 'dev801'
+
+
+# Device and jobs of a job file
+def load(fileName, defaultFile=hyst_job.defaultFile):
+    with open(fileName, 'r') as f:
+        contents = json.load(f)
+    if isinstance(contents, list):
+        contents = {'jobs': contents}
+
+    base = hyst_job.make(contents.get('settings', {}), hyst_job.defaults(defaultFile))
+    return contents.get('device', default_device), [hyst_job.make(settings, base) for settings in contents['jobs']]
+
+
+# Problems with a job that stop it being run without the GUI
+def check(job):
+    errors = hyst_job.check(job)
+    if job['recordTo'] == "":
+        errors.append("Record To is needed to run without the GUI\n")
+    return errors
+
+
+# Output columns of a sample, with times continuing on from t0
+def columns(sample, keys, t0):
+    values = {'X': sample['x'], 'Y': sample['y'], 'R': sample['R'], 'Phase': sample['Phase'],
+              't': sample['t']+t0, 'ProbeV': sample['ProbeV'], 'BotElectV': sample['BotElectV'],
+              'TotalV': sample['ProbeV']-sample['BotElectV']}
+    return {key: values[key] if key in values else sample[key] for key in keys}
+
+
+# Text output in the format of the GUI's, averaged over repeated values if asked to be
+def write_text(fileName, job, keys, data):
+    if job['avgRepeatedx'] == 1 or job['avgRepeatedy'] == 1:
+        x_axis = job['plotx'] if job['avgRepeatedx'] == 1 else job['ploty']
+        data = run_average.avg_runs(data[:, keys.index(x_axis)], data)
+
+    with open(fileName, 'w') as f:
+        f.write(hyst_job.metadata(job))
+        f.write("".join(" "+heading for heading in keys)+"\n")
+        f.write("".join(" "+unit for unit in hyst_job.output_units(job, keys))+"\n")
+        np.savetxt(f, data, fmt='%.16g', delimiter='    ')
+
+
+# Run a checked job and write its measurements. report is passed progress messages and watch, if
+# given, the worker as the run goes on, e.g. to pause it. Returns the number of samples measured.
+# Interrupting stops the run at the end of the current step
+def run(device_id, job, report=print, watch=None):
+    keys = hyst_job.output_keys(job)
+    fileName = job['recordTo']
+    writer = None
+    if fileName.endswith(hyst_file.extension):
+        # A resumed run replays its checkpointed steps, so the run it carries on is written again
+        if hyst_job.resumes_run(job):
+            hyst_file.drop_last_run(fileName)
+        writer = hyst_file.RunWriter(fileName, keys, hyst_job.output_units(job, keys),
+                                     hyst_job.run_attributes(job, device_id))
+    recorded = []
+    t0 = 0.0
+    samples = 0
+    error = None
+    reported = -1
+
+    worker = hyst_acquisition.HystAcquisition(device_id, hyst_job.hyst_param(job), hyst_job.options(job))
+    worker.start()
+    try:
+        while True:
+            if watch is not None:
+                watch(worker)
+            try:
+                kind, value = worker.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if kind == 'sample':
+                sample = columns(value, keys, t0)
+                t0 = sample['t'][-1] if len(sample['t']) else t0
+                samples += len(sample['t'])
+                if writer is not None:
+                    writer.append(sample)
+                else:
+                    recorded.append(np.column_stack([sample[key] for key in keys]))
+            elif kind == 'progress' and int(10*value) > reported:
+                reported = int(10*value)
+                report("{0:.0f}% done".format(100*value))
+            elif kind == 'error':
+                error = value
+            elif kind == 'done':
+                break
+    except KeyboardInterrupt:
+        report("Stopping after the current step")
+        worker.cancel()
+        while worker.queue.get()[0] != 'done':
+            pass
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        elif recorded:
+            write_text(fileName, job, keys, np.concatenate(recorded))
+
+    if error is not None:
+        raise error
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run hysteresis jobs without the GUI")
+    parser.add_argument('jobs', help="JSON job file")
+    parser.add_argument('--device', help="Device to measure with. Overrides the job file's")
+    parser.add_argument('--check', action='store_true', help="Only check the jobs")
+    parser.add_argument('--defaults', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), hyst_job.defaultFile),
+                        help="Default values file")
+    args = parser.parse_args(argv)
+
+    device_id, jobs = load(args.jobs, args.defaults)
+    device_id = args.device or device_id
+
+    # Nothing is run unless every job can be
+    failed = False
+    for index, job in enumerate(jobs):
+        for error in check(job):
+            sys.stderr.write("Job {0}: {1}".format(index+1, error))
+            failed = True
+    if failed or args.check:
+        return 1 if failed else 0
+
+    for index, job in enumerate(jobs):
+        start = time.perf_counter()
+        report = lambda message: print("Job {0}/{1}: {2}".format(index+1, len(jobs), message))
+        try:
+            samples = run(device_id, job, report)
+        except KeyboardInterrupt:
+            return 130
+        except Exception as err:
+            report("failed: "+str(err))
+            failed = True
+            continue
+        report("{0} samples in {1:.1f} s to {2}".format(samples, time.perf_counter()-start, job['recordTo']))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# Binary columnar run files. A run file is a directory holding one .npy file per measurement
+# column and a meta.json with the column units and the typed parameters of each run appended
+# to it. Columns are appended to in place while a run is in progress, so they can be loaded
+# with np.load (or memory mapped) at any time without parsing text.
+
+import numpy as np
+
+import json
+import os
+import shutil
+import struct
+
+import time # Benchmark timing
+
+extension = '.hyst'
+meta_name = 'meta.json'
+format_version = 1
+
+# Every column file has a header of at least this size so its shape can be rewritten in place as it grows
+header_len = 128
+
+
+# Header size for an appendable .npy file of dtype. Room is left for the longest shape
+def _header_len(dtype):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), 2**63)
+    return max(header_len, 64*((len(header)+10+1+63)//64))
+
+
+# .npy version 1.0 header for a 1D array, padded to length bytes
+def _npy_header(dtype, length, size=header_len):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), length)
+    header = header.ljust(size-10-1)+'\n'
+    return b'\x93NUMPY\x01\x00'+struct.pack('<H', len(header))+header.encode('latin1')
+
+
+class ColumnFile(object):
+    """A 1D .npy file that can be appended to in place. Records can be any dtype, including
+    structured dtypes. Opening an existing file appends to it."""
+
+    def __init__(self, fileName, dtype):
+        self.dtype = np.dtype(dtype)
+        self.header_len = _header_len(self.dtype)
+
+        if os.path.exists(fileName):
+            existing = np.load(fileName, mmap_mode='r')
+            self.length = existing.shape[0]
+            self.header_len = existing.offset
+            del existing
+            self._f = open(fileName, 'r+b')
+        else:
+            self.length = 0
+            self._f = open(fileName, 'w+b')
+            self._f.write(_npy_header(self.dtype, 0, self.header_len))
+
+    # The data is written before the header is updated, so an interrupted append never
+    # leaves a header describing data that is not there
+    def append(self, values):
+        values = np.ascontiguousarray(np.ravel(values), dtype=self.dtype)
+        if len(values) == 0:
+            return
+
+        self._f.seek(self.header_len+self.length*self.dtype.itemsize)
+        self._f.write(values.tobytes())
+        self.length += len(values)
+
+        self._f.seek(0)
+        self._f.write(_npy_header(self.dtype, self.length, self.header_len))
+
+    # Drop the records from length on. The header is rewritten first, so it never describes data
+    # that is not there
+    def truncate(self, length):
+        self.length = min(self.length, length)
+        self._f.seek(0)
+        self._f.write(_npy_header(self.dtype, self.length, self.header_len))
+        self._f.truncate(self.header_len+self.length*self.dtype.itemsize)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def _column_file(path, column):
+    return os.path.join(path, column+'.npy')
+
+
+# Read a run file's metadata
+def load_meta(path):
+    with open(os.path.join(path, meta_name), 'r') as f:
+        return json.load(f)
+
+
+def _write_meta(path, meta):
+    fileName = os.path.join(path, meta_name)
+    with open(fileName+'.tmp', 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(fileName+'.tmp', fileName)
+
+
+# Load every column of a run file as arrays. Memory mapping avoids reading columns until used
+def load(path, mmap=False):
+    meta = load_meta(path)
+    columns = {}
+    for column in meta['columns']:
+        columns[column] = np.load(_column_file(path, column), mmap_mode='r' if mmap else None)
+    return columns, meta
+
+
+class RunWriter(object):
+    """Appends measurements to a run file. Opening an existing run file appends to it, recording
+    the new run's parameters along with where its data starts in each column."""
+
+    def __init__(self, path, columns, units=None, attributes=None, dtype=np.float64):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._files = {}
+
+        if os.path.exists(os.path.join(path, meta_name)):
+            self.meta = load_meta(path)
+            self.dtype = np.dtype(self.meta['dtype'])
+            for column in columns:
+                if not column in self.meta['columns']:
+                    self.meta['columns'].append(column)
+                    self.meta['units'][column] = units[list(columns).index(column)] if units else ''
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {'format': 'hyst', 'version': format_version, 'dtype': self.dtype.str,
+                         'columns': list(columns),
+                         'units': {column: (units[i] if units else '') for i, column in enumerate(columns)},
+                         'runs': []}
+
+        for column in self.meta['columns']:
+            self._files[column] = ColumnFile(_column_file(path, column), self.dtype)
+
+        self.meta['runs'].append({'start': {column: f.length for column, f in self._files.items()},
+                                  'attributes': attributes or {}})
+        self.write_meta()
+
+    def write_meta(self):
+        _write_meta(self.path, self.meta)
+
+    # Append a dictionary of columns
+    def append(self, columns):
+        for column in columns:
+            self._files[column].append(columns[column])
+
+    def flush(self):
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+# Remove the last run of a run file, cutting its columns back to where the run started. The run
+# is removed from the metadata first, so an interrupted drop leaves rows no run claims rather
+# than a run missing rows
+def drop_last_run(path):
+    meta = load_meta(path)
+    run = meta['runs'].pop()
+    _write_meta(path, meta)
+    for column in meta['columns']:
+        f = ColumnFile(_column_file(path, column), meta['dtype'])
+        f.truncate(run['start'].get(column, 0))
+        f.close()
+
+
+# Write a dictionary of columns to a new run file in one go, replacing any run file at path. The
+# file is written beside it first, so a failed save leaves the old one as it was
+def save(path, measurements, units=None, attributes=None):
+    tmp = path.rstrip('/\\')+'.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+
+    try:
+        writer = RunWriter(tmp, list(measurements), units, attributes)
+        try:
+            writer.append(measurements)
+        finally:
+            writer.close()
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.replace(tmp, path)
+
+
+# Compare writing and reading a run with the text format
+if __name__ == "__main__":
+
+    import tempfile
+
+    keys = ('TotalV', 'X', 'Y', 'R', 'Phase', 't', 'ProbeV', 'BotElectV', 'CFM_V')
+    num_samples = 10**6
+    measurements = {key: np.random.rand(num_samples) for key in keys}
+    data = np.column_stack([measurements[key] for key in keys])
+
+    directory = tempfile.mkdtemp()
+    try:
+        run_file = os.path.join(directory, 'run'+extension)
+        text_file = os.path.join(directory, 'run.txt')
+
+        start = time.perf_counter()
+        save(run_file, measurements, attributes={'numSteps': 10})
+        binary_write = time.perf_counter()-start
+
+        start = time.perf_counter()
+        np.savetxt(text_file, data, fmt='%.16g', delimiter='    ')
+        text_write = time.perf_counter()-start
+
+        start = time.perf_counter()
+        loaded, meta = load(run_file)
+        binary_read = time.perf_counter()-start
+
+        start = time.perf_counter()
+        np.loadtxt(text_file)
+        text_read = time.perf_counter()-start
+
+        assert all(np.array_equal(loaded[key], measurements[key]) for key in keys)
+
+        binary_size = sum(os.path.getsize(_column_file(run_file, key)) for key in keys)
+        print("{0} samples x {1} columns".format(num_samples, len(keys)))
+        print("         write (s)    read (s)    size (MB)")
+        print("binary   {0:9.2f}    {1:8.2f}    {2:9.1f}".format(binary_write, binary_read, binary_size/1e6))
+        print("text     {0:9.2f}    {1:8.2f}    {2:9.1f}".format(text_write, text_read, os.path.getsize(text_file)/1e6))
+
+        # Saving again replaces the run rather than adding another
+        save(run_file, {key: measurements[key][:4] for key in keys})
+        loaded, meta = load(run_file)
+        assert len(meta['runs']) == 1 and all(len(loaded[key]) == 4 for key in keys)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# Hysteresis jobs. A job is a dictionary of the settings held by the GUI's entry fields and check
+# boxes, by name. Entry fields are strings and check boxes 0 or 1, as in the GUI, so a job is
+# checked by the same rules whether it comes from the GUI or from a job file, and is turned into
+# the same measurement parameters, options, metadata and run file attributes. Nothing here needs
+# Tk or matplotlib.
+
+import hyst_acquisition # Columns of extra demodulators
+import hyst_file # Binary columnar run files
+import hyst_schedule # Bias schedules of scan patterns
+import run_checkpoint # Checkpoint logs for resuming runs
+
+import os
+import time # Data and time
+
+scanPatterns = ("Min-Max", "Min-Max-Min", "0-Max-0-Min-0")
+auxOuts = ('1', '2', '3', '4')
+probeOut = ('1', '2')
+demods = ('1', '2', '3', '4', '5', '6')
+cfmIns = ('1', '2')
+scopeTimes = ('210 MS, 10 micro s', '105 MS, 20 micro s', '53 MS, 39 micro s', '26 MS, 78 micro s', '13 MS, 160 micro s',
+              '6.6 MS, 310 micro s', '3.3 MS, 620 micro s', '1.6 MS, 1.2 ms', '820 kS, 2.5 ms', '410 kS, 5 ms',
+              '205 kS, 10 ms','103 kS, 20 ms', '51 kS, 40 ms','26 kS, 80 ms','13 kS, 160 ms', '6.4 kS, 320 ms')
+scopeTimes_times = (10.0e-3, 20.0e-3, 39.0e-3, 78.0e-3, 160.0e-3,
+                    310.0e-3, 620.0e-3, 1.2, 2.5, 5.0,
+                    10.0, 20.0, 40.0, 80.0, 160.0, 320.0) # scopeTimes times in ms
+
+# Measurement columns and their units
+plotSelection = ('TotalV', 'X', 'Y', 'R', 'Phase', 't', 'ProbeV', 'BotElectV', 'CFM_V')
+units = ('V', 'V', 'V', 'V', 'Rad', 's', 'V', 'V', 'V')
+
+defaultFile = 'hysteresis_default_values.txt'
+
+# Settings in the order of the lines of the default values file, with their labels and units in
+# the metadata. Settings without a label are not in the metadata
+fields = (('probeMaxDC', "Probe Max DC", " V"),
+          ('probeMinDC', "Probe Min DC", " V"),
+          ('botElectMaxDC', "Bottom Electrode Max DC", " V"),
+          ('botElectMinDC', "Bottom Electrode Min DC", " V"),
+          ('biasTime', "Bias Time", " ms"),
+          ('biasInter', "Bias Wait", " ms"),
+          ('zeroVTime', "0 V Time", " ms"),
+          ('zeroVInter', "0 V Wait", " ms"),
+          ('numSteps', "Number of Steps", ""),
+          ('numLoops', "Number of Loops", ""),
+          ('probeAux', "Probe Auxiliary Output", ""),
+          ('botElectAux', "Bottom Electrode Auxiliary Output", ""),
+          ('pattern', "Pattern", ""),
+          ('plotx', None, ""),
+          ('ploty', None, ""),
+          ('probeOut', "Probe Output", ""),
+          ('avgRepeatedx', "Average Repeated x", ""),
+          ('avgRepeatedy', "Average Repeated y", ""),
+          ('demod', "Demodulator", ""),
+          ('doCFM', "Do CFM", ""),
+          ('bwLim', "Bandwidth Limit", ""),
+          ('cfmIn', "CFM Input", ""),
+          ('scopeTime', "Scope Sampling Rate", ""),
+          ('saveCFM', "Save CFM", ""),
+          ('saveCFMTo', "CFM Location", ""),
+          ('unsync', "Unsynchronised", ""),
+          ('filterType', "Filter Type", ""),
+          ('fourier', "Auto Fourier", ""),
+          ('filterBy', "Filter By", ""),
+          ('fourierLoc', "Fourier Location", ""),
+          ('cutoff', "Cutoff", " Hz"),
+          ('streaming', "Streaming", ""),
+          ('recordTo', "Record To", ""),
+          ('cfmByTime', "Align CFM by Time", ""),
+          ('timeBudget', "Time Budget", " min"),
+          ('settleTo', "Settle To", ""),
+          ('trimByTime', "Trim by Time", ""),
+          ('checkpointTo', "Checkpoint To", ""),
+          ('resume', "Resume", ""))
+
+names = tuple(name for name, label, unit in fields)
+
+# Settings held by check boxes
+check_boxes = ('avgRepeatedx', 'avgRepeatedy', 'doCFM', 'bwLim', 'saveCFM', 'unsync', 'fourier', 'streaming',
+               'cfmByTime', 'trimByTime', 'resume')
+
+# Settings that are not run file attributes
+_unrecorded = ('plotx', 'ploty', 'recordTo')
+
+
+# Job of the default values in a default values file
+def defaults(fileName=defaultFile):
+    with open(fileName, 'r') as f:
+        lines = f.read().splitlines()
+    lines += [""]*(len(names)-len(lines))
+    return make(dict(zip(names, lines)))
+
+
+# Job of settings, which may be numbers, with the remaining settings taken from base. Entry
+# fields are made strings and check boxes 0 or 1
+def make(settings, base=None):
+    job = dict(base) if base is not None else {name: 0 if name in check_boxes else "" for name in names}
+    for name, value in settings.items():
+        if not name in names:
+            raise ValueError("Unknown setting "+str(name))
+        if name in check_boxes:
+            job[name] = int(value) if value != "" else 0
+        else:
+            job[name] = str(value) if value is not None else ""
+    return job
+
+
+# Demodulators entered, which may be separated by ';'
+def demod_numbers(job):
+    return [demod.strip() for demod in job['demod'].split(';')]
+
+
+# Columns of the demodulators entered after the first
+def demod_columns(job):
+    return tuple(column for demod in demod_numbers(job)[1:] if demod in demods
+                 for column in hyst_acquisition.demod_columns(int(demod)))
+
+
+# Columns that can be plotted. CFM data is only available if CFM is enabled
+def plot_options(job):
+    return plotSelection if job['doCFM'] == 1 else tuple(opt for opt in plotSelection if opt != 'CFM_V')
+
+
+# Columns to output and their units. CFM data is only output if CFM is enabled
+def output_keys(job):
+    return list(plot_options(job))+list(demod_columns(job))
+
+def output_units(job, keys):
+    column_units = dict(zip(plotSelection, units))
+    column_units.update(zip(demod_columns(job), ('V', 'V', 'V', 'Rad')*len(demod_columns(job))))
+    return [column_units[key] for key in keys]
+
+
+# Check that settings are correctly formatted and within physical bounds. Returns a line
+# describing each problem
+def check(job):
+    errors = []
+
+    def number(name, label, low=None, high=None, message=""):
+        try:
+            value = float(job[name])
+            if (low is not None and not low <= value) or (high is not None and not value <= high):
+                errors.append(label+message+"\n")
+            return value
+        except ValueError:
+            errors.append(label+" is not a float\n")
+
+    probeMaxDC = number('probeMaxDC', "Probe DC Max", -10, 10, " bounds are ±10 V")
+    probeMinDC = number('probeMinDC', "Probe DC Min", -10, 10, " bounds are ±10 V")
+    botElectMaxDC = number('botElectMaxDC', "Bottom Electrode DC Max", -10, 10, " bounds are ±10 V")
+    botElectMinDC = number('botElectMinDC', "Bottom Electrode DC Min", -10, 10, " bounds are ±10 V")
+    number('biasTime', "Configure Scan Bias Time", 0, message=" must be at least 0 ms")
+    number('biasInter', "Configure Scan Bias Intermission", 0, message=" must be at least 0 ms")
+    number('zeroVTime', "Configure Scan 0 V Time", 0, message=" must be at least 0 ms")
+    number('zeroVInter', "Configure Scan 0 V Intermission", 0, message=" must be at least 0 ms")
+
+    if job['settleTo'] != "":
+        try:
+            settleTo = float(job['settleTo'])
+            if not 0 < settleTo < 1:
+                errors.append("Configure Scan Settle To must be between 0 and 1\n")
+        except ValueError:
+            errors.append("Configure Scan Settle To is not a float\n")
+
+    if job['resume'] == 1 and job['checkpointTo'] == "":
+        errors.append("Resume needs a Checkpoint To log\n")
+
+    numSteps = number('numSteps', "Configure Scan Steps", 1, message=" must be at least 1")
+    numLoops = number('numLoops', "Configure Scan Loop number", 1, message=" must be at least 1")
+
+    if not job['probeAux'] in auxOuts:
+        errors.append("Probe Aux Out is not in "+str(auxOuts)+"\n")
+
+    if not job['botElectAux'] in auxOuts:
+        errors.append("Bottom Electrode Aux Out is not in "+str(auxOuts)+"\n")
+
+    if job['probeAux'] == job['botElectAux']:
+        errors.append("Probe and Bottom Electrode Aux Outs cannot be same\n")
+
+    if not job['pattern'] in scanPatterns:
+        errors.append("Pattern is not in "+str(scanPatterns)+"\n")
+
+    if not job['plotx'] in plotSelection+demod_columns(job):
+        errors.append("Horizontal Axis is not in "+str(plot_options(job))+"\n")
+
+    if not job['ploty'] in plotSelection+demod_columns(job):
+        errors.append("Vertical Axis is not in "+str(plot_options(job))+"\n")
+
+    if not job['probeOut'] in probeOut:
+        errors.append("Probe output is not in "+str(probeOut)+"\n")
+
+    if not job['cfmIn'] in cfmIns:
+        errors.append("CFM voltage input is not in "+str(cfmIns)+"\n")
+
+    if not job['scopeTime'] in scopeTimes:
+        errors.append("CFM sampling rate is not in "+str(scopeTimes)+"\n")
+
+    numbers = demod_numbers(job)
+    if not all(demod in demods for demod in numbers):
+        errors.append("Demodulators are not all in "+str(demods)+"\n")
+    elif len(set(numbers)) < len(numbers):
+        errors.append("Demodulators are repeated\n")
+    elif len(numbers) > 1 and job['streaming'] == 1:
+        errors.append("Streaming records a single demodulator\n")
+
+    # Check the offsets the scan will apply before the instrument is touched
+    if not errors:
+        schedule = hyst_schedule.build(probeMaxDC, probeMinDC, -botElectMaxDC, -botElectMinDC,
+                                       int(numSteps)+1, int(numLoops), job['pattern'])
+        errors += hyst_schedule.check(schedule)
+
+    return errors
+
+
+# Measurement parameters of a checked job, as passed to the acquisition
+def hyst_param(job):
+    hystParam = [None]*15
+    hystParam[0] = float(job['probeMaxDC'])
+    hystParam[1] = float(job['probeMinDC'])
+    hystParam[2] = float(job['botElectMaxDC'])
+    hystParam[3] = float(job['botElectMinDC'])
+    hystParam[4] = float(job['biasTime'])/1000.0   # Convert from ms to s
+    hystParam[5] = float(job['biasInter'])/1000.0   # Convert from ms to s
+    hystParam[6] = float(job['zeroVTime'])/1000.0   # Convert from ms to s
+    hystParam[7] = float(job['zeroVInter'])/1000.0   # Convert from ms to s
+    hystParam[8] = float(job['numSteps'])
+    hystParam[9] = float(job['numLoops'])
+    hystParam[10] = job['probeAux']
+    hystParam[11] = job['botElectAux']
+    hystParam[12] = job['pattern']
+    hystParam[13] = int(job['probeOut'])
+    hystParam[14] = tuple(int(demod) for demod in demod_numbers(job))
+    return hystParam
+
+
+# Settings the acquisition depends on besides the measurement parameters
+def options(job):
+    return {'doCFM': job['doCFM'],
+            'bwLim': job['bwLim'],
+            'cfmIn': int(job['cfmIn'])-1, # -1 to get channel index rather than name
+            'scopeTime': scopeTimes.index(job['scopeTime']) if job['scopeTime'] in scopeTimes else 0,
+            'saveCFM': job['saveCFM'],
+            'cfmFile': job['saveCFMTo'],
+            'unsync': job['unsync'],
+            'streaming': job['streaming'],
+            'cfmByTime': job['cfmByTime'],
+            'trimByTime': job['trimByTime'],
+            'settleTo': float(job['settleTo']) if job['settleTo'] != "" else None,
+            'checkpoint': job['checkpointTo'],
+            'resume': job['resume'],
+            'metadata': metadata(job)}
+
+
+# Metadata written at the top of text outputs and CFM files
+def metadata(job):
+    text = "Current date & time: " + time.strftime("%c")+"\n\n"
+    for name, label, unit in fields:
+        if label is not None:
+            text += label+": "+str(job[name])+unit+"\n"
+    return text+"\n"
+
+
+# Settings as typed values for run files
+def run_attributes(job, device):
+    attributes = {'date': time.strftime("%c"), 'device': device, 'parameters': {}, 'parameterUnits': {}}
+    for name, label, unit in fields:
+        if name in _unrecorded:
+            continue
+        value = job[name]
+
+        # Entry fields are strings. Store numbers as numbers
+        if isinstance(value, str):
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+
+        attributes['parameters'][name] = value
+        attributes['parameterUnits'][name] = unit.strip()
+
+    # Checkpointed runs record their log, so that a resumed run can tell the run it carries on
+    if job['checkpointTo'] != "":
+        attributes['checkpoint'] = {'log': job['checkpointTo'],
+                                    'identity': run_checkpoint.identity(hyst_param(job), options(job))}
+    return attributes
+
+
+# Whether a job resumes the last run in its run file. A resumed run replays the steps in its
+# checkpoint log, so that run is dropped before the job is recorded for each step to be written
+# once. It is the run being resumed if it was recorded with the same log and settings, and the
+# log is still of them
+def resumes_run(job):
+    if job['resume'] != 1 or job['checkpointTo'] == "" or not os.path.exists(job['checkpointTo']):
+        return False
+    if not os.path.exists(os.path.join(job['recordTo'], hyst_file.meta_name)):
+        return False
+
+    runs = hyst_file.load_meta(job['recordTo'])['runs']
+    checkpoint = run_attributes(job, None)['checkpoint']
+    if not runs or runs[-1]['attributes'].get('checkpoint') != checkpoint:
+        return False
+    try:
+        return run_checkpoint.read(job['checkpointTo'])[0] == checkpoint['identity']
+    except (OSError, ValueError, EOFError):
+        return False
+
+
+# Record a checkpointed job to a run file, cancel it part way and resume it into the same file,
+# as the batch runner and GUI do, then check that the run file holds each step once
+if __name__ == "__main__":
+
+    import shutil
+    import tempfile
+
+    import hyst_batch
+
+    os.environ['ZI_SIMULATE'] = '1'
+
+    directory = tempfile.mkdtemp()
+    try:
+        job = make({'probeMaxDC': 1, 'probeMinDC': -1, 'botElectMaxDC': 0, 'botElectMinDC': 0,
+                    'biasTime': 20, 'biasInter': 5, 'zeroVTime': 20, 'zeroVInter': 5, 'numSteps': 20,
+                    'numLoops': 1, 'pattern': 'Min-Max-Min', 'doCFM': 0, 'saveCFM': 0, 'streaming': 0,
+                    'recordTo': os.path.join(directory, 'run'+hyst_file.extension),
+                    'checkpointTo': os.path.join(directory, 'run.ckpt')},
+                   defaults(os.path.join(os.path.dirname(os.path.abspath(__file__)), defaultFile)))
+        assert not check(job)
+
+        def cancel_part_way(worker):
+            if worker.checkpoint is not None and worker.checkpoint.completed >= 10:
+                worker.cancel()
+
+        first = hyst_batch.run('dev801', job, report=lambda message: None, watch=cancel_part_way)
+        job['resume'] = 1
+        assert resumes_run(job)
+        resumed = hyst_batch.run('dev801', job, report=lambda message: None)
+
+        columns, meta = hyst_file.load(job['recordTo'])
+        print("first run (samples)    resumed run (samples)    run file (rows)    runs")
+        print("{0:19d}    {1:21d}    {2:15d}    {3:4d}".format(first, resumed, len(columns['t']), len(meta['runs'])))
+        assert len(meta['runs']) == 1 and len(columns['t']) == resumed
+
+        # A run recorded with other settings is not the one being resumed, so it is kept
+        job['resume'] = 0
+        job['numSteps'] = '10'
+        hyst_batch.run('dev801', job, report=lambda message: None)
+        job['numSteps'] = '20'
+        job['resume'] = 1
+        assert not resumes_run(job)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Bias schedules for hysteresis scans. The offsets of every step of every loop are generated up
+# front as one table, so a scan can be checked and timed before the instrument is touched and the
+# acquisition only has to work through the table. Each pattern is a generator of one loop's
+# offsets made from ramps between the DC limits.
+
+import numpy as np
+
+import time # Benchmark timing
+
+# One row per step. phase is the ramp of the pattern the step belongs to and progress the
+# fraction of the run completed when the step starts
+schedule_dtype = np.dtype([('loop', '<i4'), ('step', '<i4'), ('probeOffset', '<f8'),
+                           ('botElectOffset', '<f8'), ('phase', '<i4'), ('progress', '<f8')])
+
+# Physical limit of the auxiliary outputs
+aux_limit = 10.0 # [V]
+
+
+# count offsets from start towards end in steps of (end-start)/divisions, starting at step first.
+# Ramps of a single step have no increment
+def _ramp(start, end, divisions, first, count):
+    if count <= 0:
+        return np.empty(0)
+    incr = (end-start)/divisions if divisions != 0 else 0.0
+    return start+np.arange(first, first+count)*incr
+
+
+# Patterns. Each takes the DC limits and number of steps in a loop and returns the probe and
+# bottom electrode offsets and the phase of each step
+def _min_max(probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps):
+    probe = _ramp(probeMinDC, probeMaxDC, numSteps-1.0, 0, numSteps)
+    botElect = _ramp(botElectMinDC, botElectMaxDC, numSteps-1.0, 0, numSteps)
+    return probe, botElect, np.zeros(numSteps, dtype=np.int32)
+
+def _min_max_min(probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps):
+    up = int(numSteps/2)+numSteps%2
+    down = int(numSteps/2)
+    probe = np.concatenate((_ramp(probeMinDC, probeMaxDC, up-1.0, 0, up),
+                            _ramp(probeMaxDC, probeMinDC, down, 1, down)))
+    botElect = np.concatenate((_ramp(botElectMinDC, botElectMaxDC, up-1.0, 0, up),
+                               _ramp(botElectMaxDC, botElectMinDC, down, 1, down)))
+    return probe, botElect, np.repeat(np.arange(2, dtype=np.int32), (up, down))
+
+def _zero_max_zero_min_zero(probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps):
+    rise = int(numSteps/4)+(numSteps%4 > 0)
+    fall = int(numSteps/2)+(numSteps%4 > 1)
+    ret = int(numSteps/4)+(numSteps%4 > 2)
+    probe = np.concatenate((_ramp(0.0, probeMaxDC, rise-1.0, 0, rise),
+                            _ramp(probeMaxDC, probeMinDC, fall, 1, fall),
+                            _ramp(probeMinDC, 0.0, ret, 1, ret)))
+    botElect = np.concatenate((_ramp(0.0, botElectMaxDC, rise-1.0, 0, rise),
+                               _ramp(botElectMaxDC, botElectMinDC, fall, 1, fall),
+                               _ramp(botElectMinDC, 0.0, ret, 1, ret)))
+    return probe, botElect, np.repeat(np.arange(3, dtype=np.int32), (rise, fall, ret))
+
+patterns = {'Min-Max': _min_max,
+            'Min-Max-Min': _min_max_min,
+            '0-Max-0-Min-0': _zero_max_zero_min_zero}
+
+
+# Schedule of numLoops loops of a pattern. numSteps is the number of steps in a loop and the
+# bottom electrode limits are the offsets applied to it
+def build(probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps, numLoops, pattern):
+    if not pattern in patterns:
+        raise ValueError("Pattern is not in "+str(tuple(patterns)))
+
+    probe, botElect, phase = patterns[pattern](probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps)
+    steps = len(probe)
+
+    schedule = np.zeros(numLoops*steps, dtype=schedule_dtype)
+    schedule['loop'] = np.repeat(np.arange(numLoops), steps)
+    schedule['step'] = np.tile(np.arange(steps), numLoops)
+    schedule['probeOffset'] = np.tile(probe, numLoops)
+    schedule['botElectOffset'] = np.tile(botElect, numLoops)
+    schedule['phase'] = np.tile(phase, numLoops)
+    schedule['progress'] = (schedule['loop']+schedule['step']/numSteps)/numLoops
+    return schedule
+
+
+# Schedule of the measurement parameters passed to a hysteresis measurement. The bottom electrode
+# is biased in the opposite direction to the probe and a 0th step is added
+def from_param(hystParam):
+    return build(hystParam[0], hystParam[1], -hystParam[2], -hystParam[3], int(hystParam[8])+1,
+                 int(hystParam[9]), hystParam[12])
+
+
+# Problems with a schedule, as messages for the user
+def check(schedule, limit=aux_limit):
+    errors = []
+    if len(schedule) == 0:
+        errors.append("Scan has no steps\n")
+    for field, name in (('probeOffset', "Probe"), ('botElectOffset', "Bottom Electrode")):
+        if not np.all(np.isfinite(schedule[field])):
+            errors.append(name+" offsets are not all finite\n")
+        elif len(schedule) and np.max(np.abs(schedule[field])) > limit:
+            errors.append(name+" offsets exceed ±"+str(limit)+" V\n")
+    return errors
+
+
+# Time spent biasing, at 0 V and waiting for the sample to settle over a schedule, excluding
+# instrument overheads
+def nominal_duration(schedule, biasTime, biasInter, zeroVTime, zeroVInter):
+    return len(schedule)*(biasTime+biasInter+zeroVTime+zeroVInter)
+
+
+# Check that the schedules match the offsets applied by the nested loops the measurements used to
+# step through, and compare the time taken to plan a long run
+if __name__ == "__main__":
+
+    def loop_schedule(probeMaxDC, probeMinDC, botElectMaxDC, botElectMinDC, numSteps, numLoops, pattern):
+        rows = []
+        for i in range(numLoops):
+            if pattern == 'Min-Max':
+                probeVoltIncr = (probeMaxDC-probeMinDC)/(numSteps-1.0)
+                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(numSteps-1.0)
+                for j in range(numSteps):
+                    rows.append(((i+j/numSteps)/numLoops, probeMinDC+j*probeVoltIncr, botElectMinDC+j*botElectVoltIncr))
+
+            elif pattern == 'Min-Max-Min':
+                probeVoltIncr = (probeMaxDC-probeMinDC)/(int(numSteps/2)+numSteps%2-1.0)
+                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(int(numSteps/2)+numSteps%2-1.0)
+                for j in range(int(numSteps/2)+numSteps%2):
+                    rows.append(((i+j/numSteps)/numLoops, probeMinDC+j*probeVoltIncr, botElectMinDC+j*botElectVoltIncr))
+                probeVoltIncr = (probeMaxDC-probeMinDC)/(int(numSteps/2))
+                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(int(numSteps/2))
+                for j in range(1, int(numSteps/2)+1):
+                    temp = j-1+int(numSteps/2)+numSteps%2
+                    rows.append(((i+temp/numSteps)/numLoops, probeMaxDC-j*probeVoltIncr, botElectMaxDC-j*botElectVoltIncr))
+
+            elif pattern == '0-Max-0-Min-0':
+                addStep = 1 if numSteps%4 > 0 else 0
+                probeVoltIncr = probeMaxDC/(int(numSteps/4)+addStep-1.0)
+                botElectVoltIncr = botElectMaxDC/(int(numSteps/4)+addStep-1.0)
+                temp = 0
+                for j in range(int(numSteps/4)+addStep):
+                    rows.append(((i+j/numSteps)/numLoops, j*probeVoltIncr, j*botElectVoltIncr))
+                temp += int(numSteps/4)+addStep-1
+                addStep = 1 if numSteps%4 > 1 else 0
+                probeVoltIncr = (probeMaxDC-probeMinDC)/(int(numSteps/2)+addStep)
+                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(int(numSteps/2)+addStep)
+                for j in range(1, int(numSteps/2)+addStep+1):
+                    rows.append(((i+(j+temp)/numSteps)/numLoops, probeMaxDC-j*probeVoltIncr, botElectMaxDC-j*botElectVoltIncr))
+                temp += int(numSteps/2)+addStep
+                addStep = 1 if numSteps%4 > 2 else 0
+                probeVoltIncr = -probeMinDC/(int(numSteps/4)+addStep)
+                botElectVoltIncr = -botElectMinDC/(int(numSteps/4)+addStep)
+                for j in range(1, int(numSteps/4)+addStep+1):
+                    rows.append(((i+(j+temp)/numSteps)/numLoops, probeMinDC+j*probeVoltIncr, botElectMinDC+j*botElectVoltIncr))
+        return np.array(rows)
+
+    for pattern in patterns:
+        for numSteps in range(5, 40):
+            for numLoops in (1, 3):
+                schedule = build(2.5, -1.5, 0.5, -0.75, numSteps, numLoops, pattern)
+                looped = loop_schedule(2.5, -1.5, 0.5, -0.75, numSteps, numLoops, pattern)
+                assert np.array_equal(schedule['progress'], looped[:, 0])
+                assert np.array_equal(schedule['probeOffset'], looped[:, 1])
+                assert np.array_equal(schedule['botElectOffset'], looped[:, 2])
+                assert not check(schedule)
+
+    # Few steps used to divide by zero
+    for pattern in patterns:
+        for numSteps in (2, 3, 4):
+            assert not check(build(1.0, -1.0, 0.0, 0.0, numSteps, 1, pattern))
+
+    print("steps x loops    schedule (ms)    loops (ms)")
+    for numSteps, numLoops in ((101, 10), (1001, 100), (10001, 100)):
+        start = time.perf_counter()
+        schedule = build(10.0, -10.0, 0.0, 0.0, numSteps, numLoops, '0-Max-0-Min-0')
+        schedule_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        looped = loop_schedule(10.0, -10.0, 0.0, 0.0, numSteps, numLoops, '0-Max-0-Min-0')
+        loop_time = time.perf_counter()-start
+
+        print("{0:13s}    {1:13.2f}    {2:10.1f}".format(str(numSteps)+" x "+str(numLoops), 1000*schedule_time, 1000*loop_time))
@@ -8,7 +8,7 @@ Created on Thu Jul  6 10:57:40 2017
 # For communication with lock-in amplifier
 from __future__ import print_function
 import numpy as np
-import zhinst.utils
+import sim_daq # Simulated instrument for hardware-free runs
 
 # For graphical user interface
 import tkinter as tk
@@ -24,6 +24,18 @@ from matplotlib.figure import Figure
 
 import tooltip
 
+import measurement_store # Preallocated measurement buffers
+import run_average # Vectorised averaging over repeated values
+import hyst_acquisition # Measurements are taken in a worker thread
+import live_plot # Blitted live graph
+import hyst_file # Binary columnar run files
+import cfm_capture # Binary CFM captures
+import cfm_index # Shot index of CFM data
+import cfm_filter # Single pass Fourier filtering of CFM data
+import hyst_schedule # Bias schedules of scan patterns
+import run_timing # Run duration prediction
+import hyst_job # Settings of hysteresis jobs
+
 import webbrowser # To open link to help web page
 
 import os # To delete files
@@ -43,34 +55,39 @@ class HystGUI(tk.Frame):
         self.btnClr = "#73c6b6"
         self.hystGUI.configure(background=self.backClr)
         
-        self.scanPatterns = ("Min-Max", "Min-Max-Min", "0-Max-0-Min-0")
-        self.auxOuts = ('1', '2', '3', '4')
-        self.probeOut = ('1', '2')
-        self.demods = ('1', '2', '3', '4', '5', '6')
-        self.cfmIns = ('1', '2')
-        self.scopeTimes = ('210 MS, 10 micro s', '105 MS, 20 micro s', '53 MS, 39 micro s', '26 MS, 78 micro s', '13 MS, 160 micro s',
-                           '6.6 MS, 310 micro s', '3.3 MS, 620 micro s', '1.6 MS, 1.2 ms', '820 kS, 2.5 ms', '410 kS, 5 ms',
-                           '205 kS, 10 ms','103 kS, 20 ms', '51 kS, 40 ms','26 kS, 80 ms','13 kS, 160 ms', '6.4 kS, 320 ms')
-        self.scopeTimes_times = (10.0e-3, 20.0e-3, 39.0e-3, 78.0e-3, 160.0e-3,
-                                 310.0e-3, 620.0e-3, 1.2, 2.5, 5.0,
-                                 10.0, 20.0, 40.0, 80.0, 160.0, 320.0) # self.scopeTimes times in ms
-        self.fourierSelection = ('None', 'Low Pass', 'High Pass')
-        self.fourierOptions = ('Shot Set', 'Bias Set')
+        self.scanPatterns = hyst_job.scanPatterns
+        self.auxOuts = hyst_job.auxOuts
+        self.probeOut = hyst_job.probeOut
+        self.demods = hyst_job.demods
+        self.cfmIns = hyst_job.cfmIns
+        self.scopeTimes = hyst_job.scopeTimes
+        self.scopeTimes_times = hyst_job.scopeTimes_times
+        self.fourierSelection = ('None', 'Low Pass', 'High Pass', 'Band Pass', 'Notch', 'Butterworth Low Pass', 'Butterworth High Pass')
+        self.fourierOptions = ('Shot Set', 'Bias Set', 'Bias Set Stream')
         self.shot_len = 2048
                                  
         # Read default entry values from file
-        self.defaultFile = 'hysteresis_default_values.txt'
+        self.defaultFile = hyst_job.defaultFile
         hystDefaultVal = open(self.defaultFile, 'r')
         self.default = hystDefaultVal.read().splitlines()
         hystDefaultVal.close()
 
-        self.plotSelection = ('TotalV', 'X', 'Y', 'R', 'Phase', 't', 'ProbeV', 'BotElectV', 'CFM_V')
+        self.plotSelection = hyst_job.plotSelection
         self.plotOptions = self.plotSelection
-        self.units = ('V', 'V', 'V', 'V', 'Rad', 's', 'V', 'V', 'V')
+        self.units = hyst_job.units
                 
-        # Dictionary storing measurements
-        self.measurements = {'TotalV': np.empty((0)), 'X': np.empty((0)), 'Y': np.empty((0)), 'R': np.empty((0)), 'Phase': np.empty((0)),
-                             't': np.empty((0)), 'ProbeV': np.empty((0)), 'BotElectV': np.empty((0)), 'CFM_V': np.empty((0))} 
+        # Columnar store of measurements, accessed like a dictionary of arrays
+        self.measurements = measurement_store.MeasurementStore(self.plotSelection)
+        
+        # Measurement worker and the rate its results are displayed at
+        self.worker = None
+        self.progress = 0.0
+        self.eta = None # Predicted time left in the run [s]
+        self.demodColumns = () # Columns of the demodulators recorded alongside the first
+        self.runJob = None # Settings of the run being recorded, or last recorded
+        self.runOptions = None # Acquisition options of that run
+        self.filterWorker = None # Fourier filtering of the last run's CFM data
+        self.refreshTime = 100 # [ms]
 
         self.helpPageURL = 'https://jeffrey-ede.shinyapps.io/voltage_trains/'
 
@@ -176,6 +193,19 @@ class HystGUI(tk.Frame):
                                               command=self.restoreDefault, bg=self.btnClr)
         self.makeDefaultButton = tk.Button(self.hystGUI, text='Make Values Default',
                                            command=self.makeDefault, bg=self.btnClr)
+        self.pauseButton = tk.Button(self.hystGUI, text='Pause', command=self.pause_meas, bg=self.btnClr)
+        self.cancelButton = tk.Button(self.hystGUI, text='Cancel', command=self.cancel_meas, bg=self.btnClr)
+        self.estimateButton = tk.Button(self.hystGUI, text='Estimate Duration', command=self.estimate, bg=self.btnClr)
+        
+        # Time the run should fit into
+        self.timeBudgetLabel = tk.Label(self.hystGUI, text="Time Budget (min)", bg=self.backClr)
+        self.timeBudgetEntry = tk.Entry(self.hystGUI, validate="key")
+        self.timeBudgetEntry['validatecommand'] = (self.timeBudgetEntry.register(self.testValPos),'%P','%i','%d')
+        
+        # Settling inaccuracy; bias and 0 V waits end once the demodulator has settled to it
+        self.settleToLabel = tk.Label(self.hystGUI, text="Settle To", bg=self.backClr)
+        self.settleToEntry = tk.Entry(self.hystGUI, validate="key")
+        self.settleToEntry['validatecommand'] = (self.settleToEntry.register(self.testValPos),'%P','%i','%d')
 
         
         # Plot
@@ -198,6 +228,22 @@ class HystGUI(tk.Frame):
         self.saveButton = tk.Button(self.hystGUI, text='Save', command=self.output_data,
                                          bg=self.btnClr)
         
+        # Binary run file measurements are appended to as they are taken
+        self.recordToLabel = tk.Label(self.hystGUI, text="Record To", bg=self.backClr)
+        self.recordToEntry = tk.Entry(self.hystGUI)
+        self.recordToButton = tk.Button(self.hystGUI, text='Record Run To', command=self.record_save_loc,
+                                         bg=self.btnClr)
+        
+        # Checkpoint log completed steps are appended to, so that the run can be resumed
+        self.checkpointToLabel = tk.Label(self.hystGUI, text="Checkpoint To", bg=self.backClr)
+        self.checkpointToEntry = tk.Entry(self.hystGUI)
+        
+        # Choose whether to resume the run in the checkpoint log rather than starting afresh
+        self.resume = tk.IntVar()
+        self.resumeLabel = tk.Label(self.hystGUI, text="Resume", bg=self.backClr)
+        self.resumeEntry = tk.Checkbutton(self.hystGUI, text="", variable=self.resume,
+                                          onvalue=1, offvalue=0, bg=self.backClr)
+        
         # Probe out
         self.probeOutLabel = tk.Label(self.hystGUI, text="Probe Out", bg=self.backClr)
         self.probeOutUnit = tk.Label(self.hystGUI, text="", bg=self.backClr)
@@ -280,6 +326,24 @@ class HystGUI(tk.Frame):
         self.unsyncEntry = tk.Checkbutton(self.hystGUI, text="", variable=self.unsync,
                                          onvalue=1, offvalue=0, bg=self.cfmClr)
         
+        # Choose whether to stream the whole run from a single subscription
+        self.streaming = tk.IntVar()
+        self.streamingLabel = tk.Label(self.hystGUI, text="Streaming", bg=self.backClr)
+        self.streamingEntry = tk.Checkbutton(self.hystGUI, text="", variable=self.streaming,
+                                         onvalue=1, offvalue=0, bg=self.backClr)
+        
+        # Choose whether to trim polled data by device timestamps rather than resynchronising
+        self.trimByTime = tk.IntVar()
+        self.trimByTimeLabel = tk.Label(self.hystGUI, text="Trim by Time", bg=self.backClr)
+        self.trimByTimeEntry = tk.Checkbutton(self.hystGUI, text="", variable=self.trimByTime,
+                                         onvalue=1, offvalue=0, bg=self.backClr)
+        
+        # Choose whether to align CFM samples with demodulator samples by their timestamps
+        self.cfmByTime = tk.IntVar()
+        self.cfmByTimeLabel = tk.Label(self.hystGUI, text="Align by Time", bg=self.cfmClr)
+        self.cfmByTimeEntry = tk.Checkbutton(self.hystGUI, text="", variable=self.cfmByTime,
+                                         onvalue=1, offvalue=0, bg=self.cfmClr)
+        
         # Fourier filter
         self.fourierSectLabel = tk.Label(self.hystGUI, text="Filter", font=("bold", 10), bg=self.cfmClr)
         
@@ -314,7 +378,7 @@ class HystGUI(tk.Frame):
         self.cutoffLabel = tk.Label(self.hystGUI, text="Filter Param", bg=self.cfmClr)
         self.cutoffUnit = tk.Label(self.hystGUI, text="Hz", bg=self.cfmClr)
         self.cutoffEntry = tk.Entry(self.hystGUI, validate="key")
-        self.cutoffEntry['validatecommand'] = (self.cutoffEntry.register(self.testValPos),'%P','%i','%d')
+        self.cutoffEntry['validatecommand'] = (self.cutoffEntry.register(self.testFilterParam),'%P','%i','%d')
         
         # Open text files
         self.openCFMButton = tk.Button(self.hystGUI, text='Open CFM', command=self.openCFM, bg=self.btnClr)
@@ -335,7 +399,17 @@ class HystGUI(tk.Frame):
         tooltip.createToolTip(self.patternEntry, "Bias offsetting pattern. Tip: switch the min and max biases\nfor the probe and bottom electrode to flip the pattern.")
         tooltip.createToolTip(self.probeAuxEntry, "Auxillary output supplying probe bias offset\nAdd it to the signal output to the probe.")
         tooltip.createToolTip(self.botElectAuxEntry, "Auxillary output supplying bottom electrode bias offset.")
+        tooltip.createToolTip(self.demodEntry, "Demodulator to record. Separate several with ';', e.g. 1;3,\nto record them in the same run. Demodulators after the\nfirst are recorded as X3, Y3, R3 and Phase3, etc.")
         tooltip.createToolTip(self.executeButton, "Take hysteresis measurements.")
+        tooltip.createToolTip(self.pauseButton, "Pause or resume the measurement\nafter the current step.")
+        tooltip.createToolTip(self.cancelButton, "Stop the measurement after the current step.")
+        tooltip.createToolTip(self.estimateButton, "Predict how long the scan will take from the\ntimings of previous runs of the same kind.")
+        tooltip.createToolTip(self.timeBudgetEntry, "Time the scan should take. Shorter bias and\n0 V waits that fit it are suggested when the\nduration is estimated. Leave empty for none.")
+        tooltip.createToolTip(self.settleToEntry, "Relative inaccuracy the demodulator must settle to\nbefore measuring, e.g. 0.001. Bias and 0 V waits\nbecome upper bounds. Leave empty for fixed waits.")
+        tooltip.createToolTip(self.recordToEntry, "Binary run file ("+hyst_file.extension+") measurements are\nappended to as they are taken. Leave empty to not record.")
+        tooltip.createToolTip(self.recordToButton, "Opens save as dialogue.")
+        tooltip.createToolTip(self.checkpointToEntry, "Log file each completed step is appended to, so\na cancelled or crashed run can be resumed. Leave\nempty to not checkpoint.")
+        tooltip.createToolTip(self.resumeEntry, "Carry on from the step after the last one in the\ncheckpoint log. The scan settings must be those\nof the logged run. Otherwise the log is restarted.")
         tooltip.createToolTip(self.restoreDefaultButton, "Restore entry field values to their defaults.")
         tooltip.createToolTip(self.makeDefaultButton, "Make current entry field values default.")
         tooltip.createToolTip(self.plotxEntry, "Plot on horizontal axis of graph.")
@@ -352,16 +426,20 @@ class HystGUI(tk.Frame):
         tooltip.createToolTip(self.cfmInEntry, "Voltage input used as current proxy.")
         tooltip.createToolTip(self.scopeTimeEntry, "Scope sampling rate.")
         tooltip.createToolTip(self.saveCFMEntry, "Save all CFM data after each poll.")
-        tooltip.createToolTip(self.saveCFMToEntry, "Location to save CFM data to.")
+        tooltip.createToolTip(self.saveCFMToEntry, "Location to save CFM data to. A "+cfm_capture.extension+" location keeps the raw scope shots in a compact binary capture.")
         tooltip.createToolTip(self.saveCFMButton, "Opens save as dialogue.")
         tooltip.createToolTip(self.unsyncEntry, "Do not perform resynchronisations\nafter initial synchronisation.")
+        tooltip.createToolTip(self.streamingEntry, "Subscribe once and poll continuously, splitting\nthe data into steps by device timestamps.")
+        tooltip.createToolTip(self.cfmByTimeEntry, "Average the scope samples closest in time to each\ndemodulator sample, rather than splitting the CFM\ndata evenly. Keeps CFM aligned if the clocks drift.")
+        tooltip.createToolTip(self.trimByTimeEntry, "Read back the device timestamp each bias change\ntakes effect at and discard earlier data, rather\nthan resynchronising after every change.")
         tooltip.createToolTip(self.clearCFMButton, "Clear CFM save location(s).")
         tooltip.createToolTip(self.saveFourierButton, "Clear CFM save location(s).")
         tooltip.createToolTip(self.clearFourierButton, "Clear CFM save location(s).")
-        tooltip.createToolTip(self.filterTypeEntry, "Clear CFM save location(s).")
-        tooltip.createToolTip(self.fourierEntry, "Clear CFM save location(s).")
+        tooltip.createToolTip(self.filterTypeEntry, "Filter chains separated by ';'. Chain\nfilters together with ':'.")
+        tooltip.createToolTip(self.cutoffEntry, "Parameters of each filter, arranged like\nFilter Type. Band Pass: low, high. Notch:\ncentre, width, harmonics. Butterworth:\ncutoff, order.")
+        tooltip.createToolTip(self.fourierEntry, "Save the filtered CFM signals to a run\nfile beside the CFM data.")
         tooltip.createToolTip(self.fourierLocEntry, "Clear CFM save location(s).")
-        tooltip.createToolTip(self.filterByEntry, "Clear CFM save location(s).")
+        tooltip.createToolTip(self.filterByEntry, "Modes separated by ';'. Bias Set Stream filters\nbias sets in pieces with bounded memory.")
 
         ###################################################
         # Grid positions of labels, entry boxes, etc.
@@ -429,6 +507,13 @@ class HystGUI(tk.Frame):
         self.executeButton.grid(row=1, column=7, sticky=tk.E+tk.W)
         self.restoreDefaultButton.grid(row=2, column=7, sticky=tk.E+tk.W)
         self.makeDefaultButton.grid(row=3, column=7, sticky=tk.E+tk.W)
+        self.pauseButton.grid(row=8, column=7, sticky=tk.E+tk.W)
+        self.cancelButton.grid(row=9, column=7, sticky=tk.E+tk.W)
+        self.estimateButton.grid(row=5, column=7, sticky=tk.E+tk.W)
+        self.timeBudgetLabel.grid(row=10, column=7, sticky=tk.W)
+        self.timeBudgetEntry.grid(row=11, column=7, sticky=tk.E+tk.W)
+        self.settleToLabel.grid(row=6, column=3, sticky=tk.W)
+        self.settleToEntry.grid(row=6, column=4, sticky=tk.E+tk.W)
         
         # Plot
         p = 21
@@ -449,6 +534,17 @@ class HystGUI(tk.Frame):
         self.clearPlotButton.grid(row=p+1, column=7, sticky=tk.E+tk.W)
         self.saveButton.grid(row=p+2, column=7, sticky=tk.E+tk.W)
         
+        # Run file
+        self.recordToLabel.grid(row=p+3, column=0, sticky=tk.W)
+        self.recordToEntry.grid(row=p+3, column=1, sticky=tk.E+tk.W)
+        self.recordToButton.grid(row=p+3, column=7, sticky=tk.E+tk.W)
+        
+        # Checkpoint log
+        self.checkpointToLabel.grid(row=p+4, column=0, sticky=tk.W)
+        self.checkpointToEntry.grid(row=p+4, column=1, sticky=tk.E+tk.W)
+        self.resumeLabel.grid(row=p+4, column=3, sticky=tk.W)
+        self.resumeEntry.grid(row=p+4, column=4, sticky=tk.W)
+        
         # Probe out
         self.probeOutLabel.grid(row=3, column=3, sticky=tk.W)
         self.probeOutUnit.grid(row=3, column=5, sticky=tk.W)
@@ -544,6 +640,17 @@ class HystGUI(tk.Frame):
         self.unsyncLabel.grid(row=16, column=0, sticky=tk.W)
         self.unsyncEntry.grid(row=16, column=1, sticky=tk.W)
         
+        # Stream whole run
+        self.streamingLabel.grid(row=7, column=3, sticky=tk.W)
+        self.streamingEntry.grid(row=7, column=4, sticky=tk.W)
+        
+        # Align CFM by timestamps
+        self.cfmByTimeLabel.grid(row=12, column=3, sticky=tk.W)
+        self.cfmByTimeEntry.grid(row=12, column=4, sticky=tk.W)
+        
+        self.trimByTimeLabel.grid(row=4, column=3, sticky=tk.W)
+        self.trimByTimeEntry.grid(row=4, column=4, sticky=tk.W)
+        
         self.openCFMButton.grid(row=13, column=7, sticky=tk.E+tk.W)
         self.openFourierButton.grid(row=17, column=7, sticky=tk.E+tk.W)
         
@@ -592,6 +699,14 @@ class HystGUI(tk.Frame):
         self.filterByEntry.insert(0, self.default[28])
         self.fourierLocEntry.insert(0, self.default[29])
         self.cutoffEntry.insert(0, self.default[30])
+        self.streaming.set(self.default[31])
+        self.recordToEntry.insert(0, self.default[32])
+        self.cfmByTime.set(self.default[33])
+        self.timeBudgetEntry.insert(0, self.default[34])
+        self.settleToEntry.insert(0, self.default[35])
+        self.trimByTime.set(self.default[36])
+        self.checkpointToEntry.insert(0, self.default[37])
+        self.resume.set(self.default[38])
         
         # Only display available plot options: not CFM data if CFM mode is not enabled
         if self.default[19] == 1:
@@ -616,6 +731,16 @@ class HystGUI(tk.Frame):
                 return False
         return True
         
+    # Tests if entry input is a list of positive filter parameters
+    def testFilterParam(self, inStr, i, acttyp):
+        ind=int(i)
+        if acttyp == '1': #insert
+            if (not inStr[ind] in '0123456789+-.eE:;, '):
+                return False
+            if inStr[0] in '-':
+                return False
+        return True
+        
     # Tests if entry input is a positive integer
     def testValPosInteg(self, inStr, i, acttyp):
         ind=int(i)
@@ -639,145 +764,16 @@ class HystGUI(tk.Frame):
         
         
         # Check that entries are correctly formatted and within physical bounds
-        try:
-            probeMaxDCEntry = float(self.probeMaxDCEntry.get())
-            if not -10 <= probeMaxDCEntry <= 10:
-                errText.insert(tk.END, "Probe DC Max bounds are ±10 V\n")
-        except ValueError:
-            errText.insert(tk.END, "Probe DC Max is not a float\n")
-            
-        try:
-            probeMinDCEntry = float(self.probeMinDCEntry.get())
-            if not -10 <= probeMinDCEntry <= 10:
-                errText.insert(tk.END, "Probe DC Min bounds are ±10 V\n")
-        except ValueError:
-            errText.insert(tk.END, "Probe DC Min is not a float\n")
-            
-            
-        try:
-            botElectMaxDCEntry = float(self.botElectMaxDCEntry.get())
-            if not -10 <= botElectMaxDCEntry <= 10:
-                errText.insert(tk.END, "Bottom Electrode DC Max bounds are ±10 V\n")
-        except ValueError:
-            errText.insert(tk.END, "Bottom Electrode DC Max is not a float\n")
-            
-        try:
-            botElectMinDCEntry = float(self.botElectMinDCEntry.get())
-            if not -10 <= botElectMinDCEntry <= 10:
-                errText.insert(tk.END, "Bottom Electrode DC Min bounds are ±10 V\n")
-        except ValueError:
-            errText.insert(tk.END, "Bottom Electrode DC Min is not a float\n")
-            
-        try:
-            biasTimeEntry = float(self.biasTimeEntry.get())
-            if not 0 <= biasTimeEntry:
-                errText.insert(tk.END, "Configure Scan Bias Time must be at least 0 ms\n")
-        except ValueError:
-            errText.insert(tk.END, "Configure Scan Bias Time is not a float\n")
-            
-        try:
-            biasInterEntry = float(self.biasInterEntry.get())
-            if not 0 <= biasInterEntry:
-                errText.insert(tk.END, "Configure Scan Bias Intermission must be at least 0 ms\n")
-        except ValueError:
-            errText.insert(tk.END, "Configure Scan Bias Intermission is not a float\n")
-            
-        try:
-            zeroVTimeEntry = float(self.zeroVTimeEntry.get())
-            if not 0 <= zeroVTimeEntry:
-                errText.insert(tk.END, "Configure Scan 0 V Time must be at least 0 ms\n")
-        except ValueError:
-            errText.insert(tk.END, "Configure Scan 0 V Time is not a float\n")
-            
-        try:
-            zeroVInterEntry = float(self.zeroVInterEntry.get())
-            if not 0 <= zeroVInterEntry:
-                errText.insert(tk.END, "Configure Scan 0 V Intermission must be at least 0 ms\n")
-        except ValueError:
-            errText.insert(tk.END, "Configure Scan 0 V Intermission is not a float\n")
-            
-        try:
-            numStepsEntry = float(self.numStepsEntry.get())
-            if not 1 <= numStepsEntry:
-                errText.insert(tk.END, "Configure Scan Steps must be at least 1\n")
-        except ValueError:
-            errText.insert(tk.END, "Configure Scan Steps is not a float\n")
-            
-        try:
-            numLoopsEntry = float(self.numLoopsEntry.get())
-            if not 1 <= numLoopsEntry:
-                errText.insert(tk.END, "Configure Scan Loop number must be at least 1\n")
-        except ValueError:
-            errText.insert(tk.END, "Configure Scan Loop number is not a float\n")
-            
-        if not self.probeAuxEntry.get() in self.auxOuts:
-            errText.insert(tk.END, "Probe Aux Out is not in "+str(self.auxOuts)+"\n")
-            
-        if not self.botElectAuxEntry.get() in self.auxOuts:
-            errText.insert(tk.END, "Bottom Electrode Aux Out is not in "+str(self.auxOuts)+"\n")
-            
-        if self.probeAuxEntry.get() == self.botElectAuxEntry.get():
-            errText.insert(tk.END, "Probe and Bottom Electrode Aux Outs cannot be same\n")
-        
-        if not self.patternEntry.get() in self.scanPatterns:
-            errText.insert(tk.END, "Pattern is not in "+str(self.scanPatterns)+"\n")
-            
-        if not self.plotxEntry.get() in self.plotSelection:
-            errText.insert(tk.END, "Horizontal Axis is not in "+str(self.plotOptions)+"\n")
-            
-        if not self.plotyEntry.get() in self.plotSelection:
-            errText.insert(tk.END, "Vertical Axis is not in "+str(self.plotOptions)+"\n")
-            
-        out_channel = self.probeOutEntry.get()
-        if not out_channel in self.probeOut:
-            errText.insert(tk.END, "Probe output is not in "+str(self.probeOut)+"\n")
-            
-        if not self.cfmInEntry.get() in self.cfmIns:
-            errText.insert(tk.END, "CFM voltage input is not in "+str(self.cfmIns)+"\n")
-            
-        scopeTime = self.scopeTimeEntry.get()
-        if not scopeTime in self.scopeTimes:
-            errText.insert(tk.END, "CFM sampling rate is not in "+str(self.scopeTimes)+"\n")
-            
-#        if self.doCFM.get() == 1:
-#            time = ''
-#            for i, val in enumerate(self.scopeTimes):
-#                if val == self.scopeTimeEntry.get():
-#                    time = self.scopeTimes_times[i]
-#                    
-##            if biasTimeEntry < 100+time and biasTimeEntry !=0:
-##                errText.insert(tk.END, "Bias time must be at leat 100ms+sampling\ntime, preferably higher, to poll the scope\n")
-##                
-##            if zeroVTimeEntry< 100+time and zeroVTimeEntry != 0:
-##                errText.insert(tk.END, "0 V time must be at leat 100ms+sampling\ntime, preferably higher, to poll the scope\n")
-            
-        demod_index = self.demodEntry.get()
-        if not demod_index in self.demods:
-            errText.insert(tk.END, "Demodulator is not in "+str(self.demods)+"\n")
+        job = self.job()
+        for error in hyst_job.check(job):
+            errText.insert(tk.END, error)
             
         # Do not open error message window if all entries are valid
         if len(errText.get("1.0", "end-1c")) == 0:
             errDialogueBox.destroy()
             
             # Prepare measurement parameter array to be passed to hyst_meas
-            hystParam = [None]*15
-            hystParam[0] = probeMaxDCEntry
-            hystParam[1] = probeMinDCEntry
-            hystParam[2] = botElectMaxDCEntry
-            hystParam[3] = botElectMinDCEntry
-            hystParam[4] = biasTimeEntry/1000.0   # Convert from ms to s
-            hystParam[5] = biasInterEntry/1000.0   # Convert from ms to s
-            hystParam[6] = zeroVTimeEntry/1000.0   # Convert from ms to s
-            hystParam[7] = zeroVInterEntry/1000.0   # Convert from ms to s
-            hystParam[8] = numStepsEntry
-            hystParam[9] = numLoopsEntry
-            hystParam[10] = self.probeAuxEntry.get()
-            hystParam[11] = self.botElectAuxEntry.get()
-            hystParam[12] = self.patternEntry.get()
-            hystParam[13] = int(out_channel)
-            hystParam[14] = int(demod_index)
-            
-            self.hyst_meas(self.deviceID, hystParam)
+            self.hyst_meas(self.deviceID, hyst_job.hyst_param(job))
             
             
     # Restore default entry values
@@ -806,6 +802,10 @@ class HystGUI(tk.Frame):
         self.scopeTimeEntry.delete(0, tk.END)
         self.saveCFMToEntry.delete(0, tk.END)
         self.filterTypeEntry.delete(0, tk.END)
+        self.recordToEntry.delete(0, tk.END)
+        self.timeBudgetEntry.delete(0, tk.END)
+        self.settleToEntry.delete(0, tk.END)
+        self.checkpointToEntry.delete(0, tk.END)
         self.filterByEntry.delete(0, tk.END)
         self.fourierLocEntry.delete(0, tk.END)
         self.cutoffEntry.delete(0, tk.END)
@@ -842,6 +842,14 @@ class HystGUI(tk.Frame):
         self.filterByEntry.insert(0, self.default[28])
         self.fourierLocEntry.insert(0, self.default[29])
         self.cutoffEntry.insert(0, self.default[30])
+        self.streaming.set(self.default[31])
+        self.recordToEntry.insert(0, self.default[32])
+        self.cfmByTime.set(self.default[33])
+        self.timeBudgetEntry.insert(0, self.default[34])
+        self.settleToEntry.insert(0, self.default[35])
+        self.trimByTime.set(self.default[36])
+        self.checkpointToEntry.insert(0, self.default[37])
+        self.resume.set(self.default[38])
         
     # Make current values default
     def makeDefault(self):
@@ -877,6 +885,14 @@ class HystGUI(tk.Frame):
         self.default[28] = self.filterByEntry.get()
         self.default[29] = self.fourierLocEntry.get()
         self.default[30] = self.cutoffEntry.get()
+        self.default[31] = str(self.streaming.get())
+        self.default[32] = self.recordToEntry.get()
+        self.default[33] = str(self.cfmByTime.get())
+        self.default[34] = self.timeBudgetEntry.get()
+        self.default[35] = self.settleToEntry.get()
+        self.default[36] = str(self.trimByTime.get())
+        self.default[37] = self.checkpointToEntry.get()
+        self.default[38] = str(self.resume.get())
         
         defaults = open(self.defaultFile, 'w')
         for default in self.default:
@@ -886,114 +902,18 @@ class HystGUI(tk.Frame):
     
     def hyst_meas(self, device_id, hystParam):
         
-        # Measurement parameters
-        probeMaxDC = hystParam[0]
-        probeMinDC = hystParam[1]
-        botElectMaxDC = -hystParam[2]   # Apply in opposite direction to probe offset
-        botElectMinDC = -hystParam[3]   # Apply in opposite direction to probe offset
-        biasTime = hystParam[4]
-        biasInter = hystParam[5]
-        zeroVTime = hystParam[6]
-        zeroVInter = hystParam[7]
-        numSteps = int(hystParam[8])+1   # +1 to add 0th step
-        numLoops = int(hystParam[9])
-        probeAux = int(hystParam[10])-1   # -1 so indices start at 0
-        botElectAux = int(hystParam[11])-1   # -1 so indices start at 0
-        pattern = hystParam[12]
-        out_channel = hystParam[13]-1   # -1 so indices start at 0
-        demod_index = hystParam[14]-1   # -1 so indices start at 0
-    
-        apilevel = 1  # The API level supported
-        # Call a zhinst utility function that returns:
-        # - an API session `daq` in order to communicate with devices via the data server.
-        # - the device ID string that specifies the device branch in the server's node hierarchy.
-        # - the device's discovery properties.
-        err_msg = "This example only supports instruments with demodulators."
-        (daq, device, props) = zhinst.utils.create_api_session(device_id, apilevel,
-                                                               required_devtype='.*LI|.*IA|.*IS&HF2',
-                                                               required_err_msg=err_msg)
-    
-        # Create a base instrument configuration: disable all outputs, demods and scopes.
-        general_setting = [['/%s/demods/*/enable' % device, 0],
-                           ['/%s/demods/*/trigger' % device, 0],
-                           ['/%s/sigouts/*/enables/*' % device, 0],
-                           ['/%s/scopes/*/enable' % device, 0]]
-        if 'IA' in props['options']:
-            general_setting.append(['/%s/imps/*/enable' % device, 0])
-        daq.set(general_setting)
-        
-        # Perform a global synchronisation between the device and the data server:
-        # Ensure that the settings have taken effect on the device before setting
-        # the next configuration.
-        daq.sync()
-    
-        # Now configure the instrument for this experiment. The following channels
-        # and indices work on all device configurations. The values below may be
-        # changed if the instrument has multiple input/output channels and/or either
-        # the Multifrequency or Multidemodulator options installed.
-        exp_setting = [['/%s/demods/%d/enable'         % (device, demod_index), 1],
-                       ['/%s/sigouts/%d/on'            % (device, out_channel), 1],
-                       ['/%s/auxouts/%d/outputselect' % (device, probeAux), -1],   # Manual output
-                       ['/%s/auxouts/%d/outputselect' % (device, botElectAux), -1]]   # Manual output
-        # Some other device-type dependent configuration may be required. For
-        # example, disable the signal inputs `diff` and the signal outputs `add` for
-        # HF2 instruments.
-        if props['devicetype'].startswith('HF2'):
-            exp_setting.append(['/%s/sigouts/%d/add'      % (device, out_channel), 1])
-        daq.set(exp_setting)
-    
-        # Wait for the demodulator filter to settle.
-        time_constant = 1e-6
-        time.sleep(10*time_constant)
+        # Only one measurement can use the instrument at a time, and the CFM data is not written
+        # to while the last run's is being filtered
+        if self.worker is not None and self.worker.is_alive():
+            return
+        if self.filterWorker is not None and self.filterWorker.is_alive():
+            return
         
-        scale = 0 # Scaling factor for 16-bit integers returned by CFM scope
-        
-        # Subscribe to scope if performing CFM 
-        if self.doCFM.get() == 1 and biasTime+zeroVTime > 0:
-            
-            scope_time = 0
-            for time_idx, rate in enumerate(self.scopeTimes):
-                if self.scopeTimeEntry.get() == rate:
-                    scope_time = time_idx
-                
-            scope_channel = int(self.cfmInEntry.get())-1 # -1 to get channel index rather than name
-            bwLim = self.bwLim.get()
-            
-            scope_settings = [['/%s/scopes/0/channel'         % (device), scope_channel],
-                              ['/%s/scopes/0/trigchannel'     % (device), -1],
-                              #['/%s/scopes/0/triglevel'       % (device), 0.0],
-                              #['/%s/scopes/0/trigholdoff'     % (device), 0.1],
-                              # Enable bandwidth limiting: avoid antialiasing effects due to
-                              # sub-sampling when the scope sample rate is less than the input
-                              # channel's sample rate.
-                              ['/%s/scopes/0/bwlimit'         % (device), bwLim],
-                              # Set the sampling rate.
-                              ['/%s/scopes/0/time'            % (device), scope_time],
-                              # Enable the scope
-                              ['/%s/scopes/0/enable' % device, 1]]
-            
-            daq.set(scope_settings)
-            
-            sigout_range = daq.getDouble('/%s/sigins/%d/range' % (device, scope_channel))
-            scale = sigout_range/(2**15)  # The scope's wave are 16-bit integers
-            
-            # CWrite metadata to file
-            fileName = self.saveCFMToEntry.get()
-            save_cfm_to = open(fileName, "a")
-            save_cfm_to.write(self.metadata())
-            save_cfm_to.close()
-            
-            self.cfm_time0 = time.time()
-    
-        # Perform a global synchronisation between the device and the data server:
-        # Ensure that 1. the settings have taken effect on the device before issuing
-        # the poll() command and 2. clear the API's data buffers.
-        daq.sync()
-    
-        # Set polling parameters
-        poll_timeout = 500  # [ms]
-        poll_flags=0
-        poll_return_flat_dict=True
+        # Snapshot the settings used during the measurement. Tk variables must not be read from the worker,
+        # and samples are recorded by the settings they were taken with
+        self.runJob = self.job()
+        options = hyst_job.options(self.runJob)
+        self.runOptions = options
         
         # Prepare graph to dynamically display measurements as they are taken
         self.plot = tk.Tk()
@@ -1012,483 +932,185 @@ class HystGUI(tk.Frame):
         toolbar.update()
         self.canvas._tkcanvas.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
         
+        # Only the measurement line is redrawn as it grows
+        self.livePlot = live_plot.LivePlot(self.a, self.canvas)
+        
+        # Columns of the other demodulators start where the run does, after any runs without them
+        self.demodColumns = self.demod_columns()
+        for column in self.demodColumns:
+            if not column in self.measurements:
+                self.measurements[column] = []
+            self.measurements.append(column, np.full(self.measurements.size('t')-self.measurements.size(column), np.nan))
+        self.plotxEntry.configure(values=list(self.plotOptions)+list(self.demodColumns))
+        self.plotyEntry.configure(values=list(self.plotOptions)+list(self.demodColumns))
+        
+        # Append measurements to the run file as they are recorded
+        self.runWriter = None
+        if self.recordToEntry.get():
+            # A resumed run replays its checkpointed steps, so the run it carries on is written again
+            if hyst_job.resumes_run(self.job()):
+                hyst_file.drop_last_run(self.recordToEntry.get())
+            keys = self.output_keys()
+            self.runWriter = hyst_file.RunWriter(self.recordToEntry.get(), keys, self.output_units(keys),
+                                                 self.run_attributes())
+        
+        # Measure in the background and consume the results at the GUI's refresh rate
+        self.worker = hyst_acquisition.HystAcquisition(device_id, hystParam, options)
+        self.worker.start()
+        self.hystGUI.after(self.refreshTime, self.consume_meas)
+        
+        
+    # Record measurements queued by the worker and display its progress
+    def consume_meas(self):
+        
+        recorded = False
+        done = False
+        error = None
+        start = {key: self.measurements.size(key) for key in self.measurements}
+        while not self.worker.queue.empty():
+            kind, value = self.worker.queue.get()
+            
+            if kind == 'sample':
+                self.record_meas(value)
+                recorded = True
+            elif kind == 'progress':
+                self.progress = value
+            elif kind == 'eta':
+                self.eta = value
+            elif kind == 'expected':
+                # Plan measurement buffer capacity for the whole run, for the columns it records
+                for key in self.output_keys():
+                    self.measurements.reserve(self.measurements.size(key)+value, key)
+            elif kind == 'error':
+                error = value
+            elif kind == 'done':
+                done = True
+        
+        if recorded:
+            self.update_graph()
+            
+            if self.runWriter is not None:
+                self.runWriter.append({key: self.measurements[key][start[key]:] for key in self.output_keys()})
+        
+        if not done:
+            state = "Paused: " if self.worker.paused() else "Progress: "
+            self.executeButton['text'] = state+"{0:.2f}".format(self.progress*100)+"%"
+            if self.eta is not None:
+                self.executeButton['text'] += ", "+run_timing.format_duration(self.eta)+" left"
+            self.hystGUI.after(self.refreshTime, self.consume_meas)
+            return
+        
+        # Show the last measurements
+        self.livePlot.flush()
+        
+        if self.runWriter is not None:
+            self.runWriter.close()
         
-        for i in range(numLoops):
-            
-            if pattern == 'Min-Max':
-                
-                # Calculate bias to apply
-                probeVoltIncr = (probeMaxDC-probeMinDC)/(numSteps-1.0)
-                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(numSteps-1.0)
-
-                for j in range(numSteps):
-                    
-                    # Update progress
-                    self.executeButton['text'] = "Progress: "+"{0:.2f}".format(((i+j/numSteps)/numLoops)*100)+"%"
-                    self.hystGUI.update()
-                    
-                    # Calculate bias to apply cont.
-                    probeOffset = probeMinDC+j*probeVoltIncr
-                    botElectOffset = botElectMinDC+j*botElectVoltIncr
-                    
-                    # Record relevant measurements
-                    sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
-                    self.record_meas(sample)
-                    
-    
-            elif pattern == 'Min-Max-Min':
-                
-                # Calculate Min-Max bias to apply
-                probeVoltIncr = (probeMaxDC-probeMinDC)/(int(numSteps/2)+numSteps%2-1.0)
-                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(int(numSteps/2)+numSteps%2-1.0)
-                
-                for j in range(int(numSteps/2)+numSteps%2):
-                    
-                    # Update progress
-                    self.executeButton['text'] = "Progress: "+"{0:.2f}".format(((i+j/numSteps)/numLoops)*100)+"%"
-                    self.hystGUI.update()
-                    
-                    # Calculate bias to apply cont.
-                    probeOffset = probeMinDC+j*probeVoltIncr
-                    botElectOffset = botElectMinDC+j*botElectVoltIncr
-                    
-                    # Record relevant measurements
-                    sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
-                    self.record_meas(sample)
-                
-                # Calculate Max-Min bias to apply
-                probeVoltIncr = (probeMaxDC-probeMinDC)/(int(numSteps/2))
-                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(int(numSteps/2))
-                
-                for j in range(1, int(numSteps/2)+1):
-                    
-                    # Update progress
-                    temp = j-1+int(numSteps/2)+numSteps%2
-                    self.executeButton['text'] = "Progress: "+"{0:.2f}".format(((i+temp/numSteps)/numLoops)*100)+"%"
-                    self.hystGUI.update()
-                    
-                    # Calculate bias to apply cont.
-                    probeOffset = probeMaxDC-j*probeVoltIncr
-                    botElectOffset = botElectMaxDC-j*botElectVoltIncr
-                    
-                    # Record relevant measurements
-                    sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
-                    self.record_meas(sample)
-                    
-                    
-            elif pattern == '0-Max-0-Min-0':
-                
-                # Calculate 0-Max bias to apply
-                addStep = 0
-                if numSteps%4 > 0:
-                    addStep = 1
-                probeVoltIncr = probeMaxDC/(int(numSteps/4)+addStep-1.0)
-                botElectVoltIncr = botElectMaxDC/(int(numSteps/4)+addStep-1.0)
-                
-                temp = 0
-                
-                for j in range(int(numSteps/4)+addStep):
-                    
-                    # Update progress
-                    self.executeButton['text'] = "Progress: "+"{0:.2f}".format(((i+j/numSteps)/numLoops)*100)+"%"
-                    self.hystGUI.update()
-                    
-                    # Calculate bias to apply cont.
-                    probeOffset = j*probeVoltIncr
-                    botElectOffset = j*botElectVoltIncr
-                    
-                    # Record relevant measurements
-                    sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
-                    self.record_meas(sample)
-                    
-                temp += int(numSteps/4)+addStep-1
-                
-                # Calculate Max-Min bias to apply
-                if numSteps%4 > 1:
-                    addStep = 1
-                else:
-                    addStep = 0
-                probeVoltIncr = (probeMaxDC-probeMinDC)/(int(numSteps/2)+addStep)
-                botElectVoltIncr = (botElectMaxDC-botElectMinDC)/(int(numSteps/2)+addStep)
-                
-                for j in range(1, int(numSteps/2)+addStep+1):
-                    
-                    # Update progress
-                    self.executeButton['text'] = "Progress: "+"{0:.2f}".format(((i+(j+temp)/numSteps)/numLoops)*100)+"%"
-                    self.hystGUI.update()
-                    
-                    # Calculate bias to apply cont.
-                    probeOffset = probeMaxDC-j*probeVoltIncr
-                    botElectOffset = botElectMaxDC-j*botElectVoltIncr
-                    
-                    # Record relevant measurements
-                    sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
-                    self.record_meas(sample)
-                    
-                temp += int(numSteps/2)+addStep
-                
-                # Calculate 0-Min bias to apply
-                if numSteps%4 > 2:
-                    addStep = 1
-                else:
-                    addStep = 0
-                probeVoltIncr = -probeMinDC/(int(numSteps/4)+addStep)
-                botElectVoltIncr = -botElectMinDC/(int(numSteps/4)+addStep)
-                
-                for j in range(1, int(numSteps/4)+addStep+1):
-                    
-                    # Update progress
-                    self.executeButton['text'] = "Progress: "+"{0:.2f}".format(((i+(j+temp)/numSteps)/numLoops)*100)+"%"
-                    self.hystGUI.update()
-                    
-                    # Calculate bias to apply cont.
-                    probeOffset = probeMinDC+j*probeVoltIncr
-                    botElectOffset = botElectMinDC+j*botElectVoltIncr
-                    
-                    # Record relevant measurements
-                    sample = self.bias_zero_samp(daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags, poll_return_flat_dict, numLoops, scale)
-                    self.record_meas(sample)
-                
-                
-        # Disable the scope.
-        if self.doCFM.get() == 1:
-            daq.setInt('/%s/scopes/0/enable' % device, 0)
-                
         # Update progress
         self.executeButton['text'] = "Execute"
-        self.hystGUI.update()
+        self.pauseButton['text'] = "Pause"
+        self.progress = 0.0
+        self.eta = None
+        
+        if error is not None:
+            raise error
         
         # Fourier filter CFM data
-        if self.doCFM.get() == 1:
+        if self.runOptions['doCFM'] == 1:
             self.fourier_filter()
-                    
-                
-    def bias_zero_samp(self, daq, device, probeAux, botElectAux, probeOffset, botElectOffset, demod_index,
-                       biasTime, zeroVTime, biasInter, zeroVInter, poll_timeout, poll_flags,
-                       poll_return_flat_dict, numLoops, scale):
-        
-        # Apply Bias
-        daq.set([['/%s/auxouts/%d/offset' % (device, probeAux), probeOffset],
-                 ['/%s/auxouts/%d/offset' % (device, botElectAux), botElectOffset]])
-        
-        # Allow bias intermissionary settling time
-        if biasInter != 0.0:
-            time.sleep(biasInter)
-        
-        if not self.unsync.get() == 1:
-            daq.sync()
-                    
-        # Record data while bias is being applied
-        # Unsubscribe from all paths.
-        daq.unsubscribe('*')
-        
-        path = '/%s/demods/%d/sample' % (device, demod_index) # Demodulator path
-        path2 = '/%s/scopes/0/wave' % (device) # CFM scope path
-        save_cfm_to = ""
-        
-        # Open file to append data if performing CFM
-        if self.doCFM.get() == 1 and biasTime+zeroVTime > 0:
-            
-            # Complete cfm dataset will be save to hard disk
-            fileName = self.saveCFMToEntry.get()
-            save_cfm_to = open(fileName, "a")
-            
-            
-        if biasTime != 0:
             
-            daq.subscribe(path)
             
-            if self.doCFM.get() == 1:
-                daq.subscribe(path2)
-            
-            data = daq.poll(biasTime, poll_timeout, poll_flags, poll_return_flat_dict)   # *1000 for s -> ms
-            # Unsubscribe from all paths
-            daq.unsubscribe('*')
-                        
-            # Check that the dictionary returned is non-empty
-            assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
-                    
-            # The data returned is a dictionary of dictionaries that reflects the node's path.
-            # Note, the data could be empty if no data had arrived, e.g., if the demods
-            # were disabled or had demodulator rate 0.
-            assert path in data, "The data dictionary returned by poll has no key `%s`." % path
-            
-            # Initialise samples to avoid unbound local variable errors
-            sample = data[path]
-            if self.doCFM.get() == 1:
-                scope_sample = data[path2]
+    # Pause or resume the measurement at the end of the current step
+    def pause_meas(self):
+        if self.worker is None or not self.worker.is_alive():
+            return
+        
+        if self.worker.paused():
+            self.worker.resume()
+            self.pauseButton['text'] = "Pause"
+        else:
+            self.worker.pause()
+            self.pauseButton['text'] = "Resume"
             
-            tries = 1
-            limit = 10
-            while tries < limit and len(sample['timestamp'])<=1:
-                tries += 1
-                
-                if self.doCFM.get() == 1:
-                    daq.subscribe(path2)
-                    
-                daq.subscribe(path)
-                            
-                data = daq.poll(biasTime, poll_timeout, poll_flags, poll_return_flat_dict)   # *1000 for s -> ms
-                
-                # Unsubscribe from all paths
-                daq.unsubscribe('*')
-                            
-                # Check that the dictionary returned is non-empty
-                assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
-                        
-                # The data returned is a dictionary of dictionaries that reflects the node's path.
-                # Note, the data could be empty if no data had arrived, e.g., if the demods
-                # were disabled or had demodulator rate 0.
-                assert path in data, "The data dictionary returned by poll has no key `%s`." % path
-                        
-                # Access the demodulator sample using the node's path
-                sample = data[path]
-                if self.doCFM.get() == 1:
-                    scope_sample = data[path2]
-                    
-    
-            # Check how many seconds of demodulator data were returned by poll.
-            # First, get the sampling rate of the device's ADCs, the device clockbase...
-            clockbase = float(daq.getInt('/%s/clockbase' % device))
-                        
-            # Convert timestamps from ticks to seconds via clockbase.
-            sample['t'] = (sample['timestamp'] - sample['timestamp'][0])/clockbase
-            sample['t'] += sample['t'][1]
             
-            # Voltages
-            sample['ProbeV'] = np.empty(len(sample['t']))
-            sample['ProbeV'].fill(probeOffset)
-            sample['BotElectV'] = np.empty(len(sample['t']))
-            sample['BotElectV'].fill(botElectOffset)
-            sample['TotalV'] = sample['ProbeV']-sample['BotElectV']
-                        
-                        
-            # Calculate the demodulator's magnitude and phase and add them to the dict.
-            sample['R'] = np.abs(sample['x'] + 1j*sample['y'])
-            sample['Phase'] = np.angle(sample['x'] + 1j*sample['y'])
+    # Stop the measurement at the end of the current step
+    def cancel_meas(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.worker.cancel()
             
             
-        if zeroVTime+zeroVInter > 0:
-            # Apply 0 V bias between steps
-            daq.set([['/%s/auxouts/%d/offset' % (device, probeAux), 0],
-                     ['/%s/auxouts/%d/offset' % (device, botElectAux), 0]])
-                    
-                    
-        # Allow 0 V intermissionary settling time
-        if zeroVInter != 0.0:
-            time.sleep(zeroVInter)
+    # Predict how long the scan will take from the timings of previous runs and suggest
+    # shorter waits if it does not fit the time budget
+    def estimate(self):
         
+        # Estimate dialogue box
+        estimateDialogueBox = tk.Tk()
+        estimateDialogueBox.title("Duration Estimate")
+        estimateText = tk.Text(estimateDialogueBox, height=14, width=45)
+        estimateText.pack(side=tk.LEFT, fill=tk.Y)
         
-        if not self.unsync.get() == 1:
-            daq.sync()
+        try:
+            schedule = hyst_schedule.build(float(self.probeMaxDCEntry.get()), float(self.probeMinDCEntry.get()),
+                                           -float(self.botElectMaxDCEntry.get()), -float(self.botElectMinDCEntry.get()),
+                                           int(float(self.numStepsEntry.get()))+1, int(float(self.numLoopsEntry.get())),
+                                           self.patternEntry.get())
+            times = [float(entry.get())/1000.0 for entry in (self.biasTimeEntry, self.biasInterEntry,
+                                                            self.zeroVTimeEntry, self.zeroVInterEntry)]
+        except ValueError:
+            estimateText.insert(tk.END, "Configure Scan entries are not all valid\n")
+            return
         
-        if zeroVTime != 0.0:
-            
-            # Resubscribe and poll.                
-            daq.subscribe(path)
-            if self.doCFM.get() == 1:
-                daq.subscribe(path2)
-            data = daq.poll(zeroVTime, poll_timeout, poll_flags, poll_return_flat_dict)   # *1000 for s -> ms
-            # Unsubscribe from all paths
-            daq.unsubscribe('*')
-                        
-            # Check that the dictionary returned is non-empty
-            assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
-                    
-            # The data returned is a dictionary of dictionaries that reflects the node's path.
-            # Note, the data could be empty if no data had arrived, e.g., if the demods
-            # were disabled or had demodulator rate 0.
-            assert path in data, "The data dictionary returned by poll has no key `%s`." % path
-                    
-            # Access the demodulator sample using the node's path
-            sample2 = data[path]
-            if self.doCFM.get() == 1:
-                scope_sample2 = data[path2]
-            
-            # Make sure daq was successfully polled
-            # Sometimes it stalls after reading 1 element, otherwise it normally works
-            tries = 1
-            limit = 10
-            while tries < limit and len(sample2['timestamp'])<=1:
-                tries += 1
-                
-                # Resubscribe and poll.                
-                daq.subscribe(path)
-                data = daq.poll(zeroVTime, poll_timeout, poll_flags, poll_return_flat_dict)   # *1000 for s -> ms
-                
-                if self.doCFM.get() == 1:
-                    daq.subscribe(path2)
-                            
-                # Unsubscribe from all paths
-                daq.unsubscribe('*')
-                            
-                # Check that the dictionary returned is non-empty
-                assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
-                        
-                # The data returned is a dictionary of dictionaries that reflects the node's path.
-                # Note, the data could be empty if no data had arrived, e.g., if the demods
-                # were disabled or had demodulator rate 0.
-                assert path in data, "The data dictionary returned by poll has no key `%s`." % path
-                        
-                # Access the demodulator sample using the node's path
-                sample2 = data[path]
-                if self.doCFM.get() == 1:
-                    scope_sample2 = data[path2]
-                    
-    
-            # Check how many seconds of demodulator data were returned by poll.
-            # First, get the sampling rate of the device's ADCs, the device clockbase...
-            clockbase = float(daq.getInt('/%s/clockbase' % device))
-                        
-            # Convert timestamps from ticks to seconds via clockbase.
-            sample2['t'] = (sample2['timestamp'] - sample2['timestamp'][0])/clockbase
-            sample2['t'] += sample2['t'][1]
-    
-            # Voltages
-            sample2['ProbeV'] = np.empty(len(sample2['t']))
-            sample2['ProbeV'].fill(0)
-            sample2['BotElectV'] = np.empty(len(sample2['t']))
-            sample2['BotElectV'].fill(0)
-            sample2['TotalV'] = sample2['ProbeV']-sample2['BotElectV']
-                        
-            # Calculate the demodulator's magnitude and phase and add them to the dict.
-            sample2['R'] = np.abs(sample2['x'] + 1j*sample2['y'])
-            sample2['Phase'] = np.angle(sample2['x'] + 1j*sample2['y'])
-            
+        key = run_timing.config_key(self.streaming.get(), self.doCFM.get(), self.settleToEntry.get() or None)
+        overheads = run_timing.overheads(run_timing.load(), key)
+        predicted = run_timing.predict(len(schedule), *times, overheads)
         
-        # Amalgamate any CFM data and iterpolate times
-        if self.doCFM.get() == 1:
-            
-            if biasTime != 0.0:
-                
-                # Combine shot trains, saving the scaled scope trains if requested
-                shot_sets = np.empty((0))
-                if self.saveCFM.get() == 1:
-                    # Provide bias metadata
-                    save_cfm_to.write("\nProbe Offset\n")
-                    save_cfm_to.write(str(probeOffset)+"\n")
-                    save_cfm_to.write("Bottom Electrode Offset\n")
-                    save_cfm_to.write(str(botElectOffset)+"\n")
-                    save_cfm_to.write("Time\n")
-                    save_cfm_to.write(str(time.time()-self.cfm_time0)+"\n")
-                    
-                    for shot_set in scope_sample:
-                        for key in shot_set:
-                            if key != 'wave':
-                                
-                                save_cfm_to.write(str(key)+"\n")
-                                save_cfm_to.write(str(shot_set[key])+"\n")
-                                    
-                            else:
-                                
-                                save_cfm_to.write("wave\n")
-                                
-                                # Extract and scale the voltages
-                                scaled_shots = scale*shot_set['wave']
-                                for scaled_shot in scaled_shots:
-                                    save_cfm_to.write(str(scaled_shot)+"\n")                                        
-                                    
-                                shot_sets = np.append(shot_sets, scaled_shots)
-                                
-                else:
-                    
-                    for shot_set in scope_sample:
-                        scaled_shots = scale*shot_set['wave']
-                        shot_sets = np.append(shot_sets, scaled_shots)
-            
-                # Compress shot train array to same size as other arrays
-                sample['CFM_V'] = self.mean_chunks(shot_sets, len(shot_sets), len(sample['t']))
-            
-            
-            if zeroVTime != 0.0:
-            
-                # Combine shot trains
-                shot_sets2 = np.empty((0))
-                if self.saveCFM.get() == 1:
-                    # Provide bias metadata
-                    save_cfm_to.write("\nProbe Offset\n")
-                    save_cfm_to.write("0\n")
-                    save_cfm_to.write("Bottom Electrode Offset\n")
-                    save_cfm_to.write("0\n")
-                    save_cfm_to.write("Time\n")
-                    save_cfm_to.write(str(time.time()-self.cfm_time0)+"\n")
-                    
-                    for shot_set in scope_sample2:
-                        for key in shot_set:
-                            if key != 'wave':
-                                
-                                save_cfm_to.write(str(key)+"\n")
-                                save_cfm_to.write(str(shot_set[key])+"\n")
-                                
-                            else:
-                                
-                                save_cfm_to.write("wave\n")
-                                
-                                # Extract and scale the voltages
-                                scaled_shots = scale*shot_set['wave']
-                                for scaled_shot in scaled_shots:
-                                    save_cfm_to.write(str(scaled_shot)+"\n")
-                                    
-                                shot_sets2 = np.append(shot_sets2, scaled_shots)
-                        
-                else:
-                    
-                    for shot_set in scope_sample2:
-                        scaled_shots = scale*shot_set['wave']
-                        shot_sets2 = np.append(shot_sets2, scaled_shots)
-                
-                
-                # Compress shot train array to same size as other arrays
-                sample2['CFM_V'] = self.mean_chunks(shot_sets2, len(shot_sets2), len(sample2['t']))
-                        
-                sample['CFM_V'] = np.append(sample['CFM_V'], sample2['CFM_V'])
-                
-                
-            save_cfm_to.close()
-                
-        if biasTime != 0 and zeroVTime != 0.0:
+        estimateText.insert(tk.END, "Steps: "+str(len(schedule))+"\n")
+        estimateText.insert(tk.END, "Predicted duration: "+run_timing.format_duration(predicted)+"\n")
+        if overheads['runs'] == 0:
+            estimateText.insert(tk.END, "No previous "+key+" runs. Instrument\noverheads are not included\n")
+        else:
+            estimateText.insert(tk.END, "From "+str(overheads['runs'])+" previous "+key+" runs\n")
+            estimateText.insert(tk.END, "Setup: {0:.2f} s\n".format(overheads['setup']))
+            estimateText.insert(tk.END, "Overhead per step: {0:.1f} ms\n".format(1000*overheads['step']))
+            for name, seconds in sorted(overheads['calls'].items(), key=lambda call: -call[1]):
+                estimateText.insert(tk.END, "    "+name+": {0:.1f} ms\n".format(1000*seconds))
+        
+        if self.timeBudgetEntry.get() == "":
+            return
+        try:
+            budget = 60*float(self.timeBudgetEntry.get())
+        except ValueError:
+            estimateText.insert(tk.END, "Time Budget is not a float\n")
+            return
+        
+        waits = run_timing.fit_budget(budget, len(schedule), *times, overheads)
+        if waits is None:
+            estimateText.insert(tk.END, "Does not fit the time budget even\nwithout bias and 0 V waits\n")
+        elif predicted <= budget:
+            estimateText.insert(tk.END, "Fits the time budget\n")
+        else:
+            estimateText.insert(tk.END, "To fit the time budget, reduce\nBias Wait to {0:.1f} ms and\n0 V Wait to {1:.1f} ms\n".format(
+                1000*waits[0], 1000*waits[1]))
             
-            sample['x'] = np.append(sample['x'], sample2['x'])
-            sample['y'] = np.append(sample['y'], sample2['y'])
-            sample['R'] = np.append(sample['R'], sample2['R'])
-            sample['Phase'] = np.append(sample['Phase'], sample2['Phase'])
-            sample['t'] = np.append(sample['t'], sample2['t']+sample['t'][-1])
-            sample['ProbeV'] = np.append(sample['ProbeV'], sample2['ProbeV'])
-            sample['BotElectV'] = np.append(sample['BotElectV'], sample2['BotElectV'])
-            sample['TotalV'] = np.append(sample['TotalV'], sample2['TotalV'])
             
-        if biasTime != 0:
-            return sample
-        if zeroVTime != 0:
-            return sample2
-        
     # Record all relevant measurements in dictionary
     def record_meas(self, sample):
         
-        # Append sampled data to sample train
-        self.measurements['X'] = np.append(self.measurements['X'], sample['x'])
-        self.measurements['Y'] = np.append(self.measurements['Y'], sample['y'])
-        self.measurements['R'] = np.append(self.measurements['R'], sample['R'])
-        self.measurements['Phase'] = np.append(self.measurements['Phase'], sample['Phase'])
-        try:
-            self.measurements['t'] = np.append(self.measurements['t'], sample['t']+self.measurements['t'][-1])
-        except IndexError:
-            self.measurements['t'] = np.append(self.measurements['t'], sample['t'])
-        self.measurements['ProbeV'] = np.append(self.measurements['ProbeV'], sample['ProbeV'])
-        self.measurements['BotElectV'] = np.append(self.measurements['BotElectV'], sample['BotElectV'])
-        self.measurements['TotalV'] = np.append(self.measurements['TotalV'], sample['ProbeV']-sample['BotElectV'])
-        
-        if self.doCFM.get() == 1:
-            self.measurements['CFM_V'] =  np.append(self.measurements['CFM_V'], sample['CFM_V'])
+        # Append sampled data to sample train. Times continue on from the last recorded time
+        self.measurements.append('X', sample['x'])
+        self.measurements.append('Y', sample['y'])
+        self.measurements.append('R', sample['R'])
+        self.measurements.append('Phase', sample['Phase'])
+        self.measurements.append('t', sample['t']+self.measurements.last('t', 0.0))
+        self.measurements.append('ProbeV', sample['ProbeV'])
+        self.measurements.append('BotElectV', sample['BotElectV'])
+        self.measurements.append('TotalV', sample['ProbeV']-sample['BotElectV'])
         
-        # Update graph
-        self.update_graph()
+        if self.runOptions['doCFM'] == 1:
+            self.measurements.append('CFM_V', sample['CFM_V'])
+            
+        for column in self.demodColumns:
+            self.measurements.append(column, sample[column])
         
     # Live display of measurements as they are taken
     def update_graph(self):
@@ -1497,8 +1119,6 @@ class HystGUI(tk.Frame):
         
         self.plot.title(x1+"-"+y1+" Plot")
         
-        self.a.clear()
-        
         x, y = self.measurements[x1], self.measurements[y1]
         # Average over repeated values, if specified
         if self.avgRepeatedx.get() == 1:
@@ -1506,19 +1126,16 @@ class HystGUI(tk.Frame):
         if self.avgRepeatedy.get() == 1:
             x, y = self.avg_xrepeats(self.measurements[x1], self.measurements[y1])
         
-        # Update graph
-        self.a.plot(x, y)
-        
-        # Update canvas
-        self.canvas.draw()
+        # Update graph. Averaging can change earlier points, so they are only appended to without it
+        averaged = self.avgRepeatedx.get() == 1 or self.avgRepeatedy.get() == 1
+        self.livePlot.update(x, y, (x1, y1, self.avgRepeatedx.get(), self.avgRepeatedy.get()), not averaged)
 
         self.plot.update()
         
         
     # Clear measurements dictionary
     def clear_meas(self):
-        for key in self.measurements:
-            self.measurements[key] = np.empty((0))
+        self.measurements.clear()
         
         
     # Plot results of hysteresis measurement
@@ -1555,82 +1172,88 @@ class HystGUI(tk.Frame):
         
     # Average over repeated x values. Can average over y by passing x and y the other way around
     def avg_xrepeats(self, x, y):
+        return run_average.avg_xrepeats(x, y)
         
-        avgedx, avgedy = np.empty((0)), np.empty((0))
-        
-        total = 0
-        start, end = 0, 1   # Average between y[start] and y[end] so x and y have same lengths
-        prevx = x[0]
-
-        # If the next value of x is not the same as the previous, add it to the array
-        for i in range(1, len(x)):
-            # If x is same as previous
-            if x[i] == prevx:
-                end += 1
-                    
-                # Check if this is the last element of the array
-                if i == len(x)-1:
-                    avgedx = np.append(avgedx, prevx)
-                    
-                    for j in range(start, end):
-                        total += y[i]
-                    avgedy = np.append(avgedy, total/(end-start))
-                        
-                    
-            # If x is not the same as previous
-            else:
-                avgedx = np.append(avgedx, prevx)
-                prevx = x[i]
-                    
-                for j in range(start, end):
-                    total += y[j]
-                avgedy = np.append(avgedy, total/(end-start))
-                    
-                total = 0
-                start, end = i, i+1
-                    
-                # Check if this is the last element of the array
-                if i == len(x)-1:
-                    avgedx = np.append(avgedx, x[i])
-                    avgedy = np.append(avgedy, y[i])
-
-        return avgedx, avgedy
-        
+    
+    # Columns to output. CFM data is only output if the run recorded it, or before any run if CFM is enabled
+    def output_keys(self):
+        doCFM = self.doCFM.get() if self.runOptions is None else self.runOptions['doCFM']
+        return [key for key in self.plotSelection if not (key == 'CFM_V' and doCFM == 0)]+list(self.demodColumns)
+    
+    def output_units(self, keys):
+        units = dict(zip(self.plotSelection, self.units))
+        units.update(zip(self.demodColumns, ('V', 'V', 'V', 'Rad')*len(self.demodColumns)))
+        return [units[key] for key in keys]
+    
+    # Demodulators entered, which may be separated by ';'
+    def demod_numbers(self):
+        return hyst_job.demod_numbers(self.job())
+    
+    # Columns of the demodulators entered after the first
+    def demod_columns(self):
+        return hyst_job.demod_columns(self.job())
+    
+    # Settings of the entry fields and check boxes as a job
+    def job(self):
+        return {'probeMaxDC': self.probeMaxDCEntry.get(),
+                'probeMinDC': self.probeMinDCEntry.get(),
+                'botElectMaxDC': self.botElectMaxDCEntry.get(),
+                'botElectMinDC': self.botElectMinDCEntry.get(),
+                'biasTime': self.biasTimeEntry.get(),
+                'biasInter': self.biasInterEntry.get(),
+                'zeroVTime': self.zeroVTimeEntry.get(),
+                'zeroVInter': self.zeroVInterEntry.get(),
+                'numSteps': self.numStepsEntry.get(),
+                'numLoops': self.numLoopsEntry.get(),
+                'probeAux': self.probeAuxEntry.get(),
+                'botElectAux': self.botElectAuxEntry.get(),
+                'pattern': self.patternEntry.get(),
+                'plotx': self.plotxEntry.get(),
+                'ploty': self.plotyEntry.get(),
+                'probeOut': self.probeOutEntry.get(),
+                'avgRepeatedx': self.avgRepeatedx.get(),
+                'avgRepeatedy': self.avgRepeatedy.get(),
+                'demod': self.demodEntry.get(),
+                'doCFM': self.doCFM.get(),
+                'bwLim': self.bwLim.get(),
+                'cfmIn': self.cfmInEntry.get(),
+                'scopeTime': self.scopeTimeEntry.get(),
+                'saveCFM': self.saveCFM.get(),
+                'saveCFMTo': self.saveCFMToEntry.get(),
+                'unsync': self.unsync.get(),
+                'filterType': self.filterTypeEntry.get(),
+                'fourier': self.fourier.get(),
+                'filterBy': self.filterByEntry.get(),
+                'fourierLoc': self.fourierLocEntry.get(),
+                'cutoff': self.cutoffEntry.get(),
+                'streaming': self.streaming.get(),
+                'recordTo': self.recordToEntry.get(),
+                'cfmByTime': self.cfmByTime.get(),
+                'timeBudget': self.timeBudgetEntry.get(),
+                'settleTo': self.settleToEntry.get(),
+                'trimByTime': self.trimByTime.get(),
+                'checkpointTo': self.checkpointToEntry.get(),
+                'resume': self.resume.get()}
+    
     
     # Output data
     def output_data(self):        
         
+        keys = self.output_keys()
+        
         text = ""
         
-        if self.doCFM.get() == 0:
-            
-            index = -1
-            for i in range(len(self.plotSelection)):
-                if self.plotSelection[i] == 'CFM_V':
-                    index = i
-                    break
-            
-            for i in range(len(self.plotSelection)):
-                if not i == index:
-                    text += " "+self.plotSelection[i]
-            text += "\n"
-            
-            for i in range(len(self.units)):
-                if not i == index:
-                    text += " "+self.units[i]
-            text += "\n"
-            
-        else:
-            
-            for heading in self.plotSelection:
-                    text += " "+heading
-            text += "\n"
-            
-            for unit in self.units:
-                    text += " "+unit
-            text += "\n"
+        for heading in keys:
+                text += " "+heading
+        text += "\n"
+        
+        for unit in self.output_units(keys):
+                text += " "+unit
+        text += "\n"
 
-        # Average over repeating values and print to file
+        data = np.column_stack([self.measurements[key] for key in keys])
+        
+        # Average all columns over repeating values in one pass
         x_get = self.avgRepeatedx.get()
         if x_get == 1 or self.avgRepeatedy.get() == 1:
             
@@ -1639,83 +1262,49 @@ class HystGUI(tk.Frame):
                 x_axis = self.plotxEntry.get()
             else:
                 x_axis = self.plotyEntry.get()
-            
-            total = [0 for meas in self.measurements] # Sums of values to average over initially 0            
-            start, end = 0, 1   # Average between y[start] and y[end] so x and y have same lengths
-            prevx = self.measurements[x_axis][0]
-    
-            # If the next value of x is not the same as the previous, add data to the array
-            for i in range(1, len(self.measurements[x_axis])):
-                # If x is same as previous
-                if self.measurements[x_axis][i] == prevx:
-                    end += 1
-                        
-                    # Check if this is the last element of the array
-                    if i == len(self.measurements[x_axis])-1:
-                        # Add averages to output
-                        for k, key in enumerate(self.measurements):
-                            if key == 'CFM_V' and self.doCFM.get() == 0:
-                                continue
-                            if key == x_axis:
-                                text += str(prevx) + "    "
-                            else:
-                                for j in range(start, end):                              
-                                    total[k] += self.measurements[key][i]
-                                text += str(total[k]/(end-start)) + "    "
-                        text += "\n"
-                            
-                        
-                # If x is not the same as previous
-                else:
-                    for k, key in enumerate(self.measurements):
-                        if key == 'CFM_V' and self.doCFM.get() == 0:
-                            continue
-                        if key == x_axis:
-                            text += str(prevx) + "    "
-                            prevx = self.measurements[x_axis][i]
-                        else:
-                            for j in range(start, end):                              
-                                total[k] += self.measurements[key][j]
-                            text += str(total[k]/(end-start)) + "    "
-                    text += "\n"
-                        
-                    for l in range(len(total)):
-                        total[l] = 0
-                    start, end = i, i+1
-                        
-                    # Check if this is the last element of the array
-                    if i == len(self.measurements[x_axis])-1:
-                        for key in self.measurements:
-                            if key == 'CFM_V' and self.doCFM.get() == 0:
-                                continue
-                            text += str(self.measurements[key][i]) + "    "
-                        text += "\n"
-        
-        else:
-            # Print data to file without averaging repeats
-            for i in range(len(self.measurements['X'])):
-                for key in self.measurements:
-                    if key == 'CFM_V' and self.doCFM.get() == 0:
-                        continue
-                    text += str(self.measurements[key][i])+"    "
-                text += "\n"
+                
+            data = run_average.avg_runs(self.measurements[x_axis], data)
             
         # Get save location
-        f = tk.filedialog.asksaveasfile(mode='w', defaultextension=".txt")
-        if f is None: # asksaveasfile returns `None` if dialog closed with 'cancel'.
+        fileName = tk.filedialog.asksaveasfilename(defaultextension=".txt",
+                                                   filetypes=[("Text", ".txt"), ("Run file", hyst_file.extension)])
+        if not fileName: # asksaveasfilename returns an empty string if dialog closed with 'cancel'.
+            return
+        
+        # Binary columns with typed settings
+        if fileName.endswith(hyst_file.extension):
+            hyst_file.save(fileName, {key: data[:, i] for i, key in enumerate(keys)}, self.output_units(keys),
+                           self.run_attributes())
             return
+        
+        f = open(fileName, 'w')
     
         # Get metadata
         f.write(self.metadata())
         
         f.write(text)
+        np.savetxt(f, data, fmt='%.16g', delimiter='    ')
         f.close()
         
         
+    # Location of run file to record measurements to
+    def record_save_loc(self):
+        
+        f = tk.filedialog.asksaveasfilename(defaultextension=hyst_file.extension,
+                                            filetypes=[("Run file", hyst_file.extension)])
+        self.recordToEntry.delete(0, tk.END)
+        self.recordToEntry.insert(0, f)
+        
+        
+    # Settings as typed values for run files
+    def run_attributes(self):
+        return hyst_job.run_attributes(self.job(), self.deviceID)
+        
+        
     # Location to save CFM data to
     def cfm_save_loc(self):
         
-        f = tk.filedialog.asksaveasfilename()
+        f = tk.filedialog.asksaveasfilename(filetypes=[("Text", ".txt"), ("CFM capture", cfm_capture.extension)])
         f.replace("\\", "/")
         self.saveCFMToEntry.delete(0, tk.END)
         self.saveCFMToEntry.insert(0, f)
@@ -1725,8 +1314,12 @@ class HystGUI(tk.Frame):
     def clear_cfm_save_loc(self):
         
         fileName = self.saveCFMToEntry.get()
-        f = open(fileName, "w")
-        f.close()
+        if cfm_capture.is_capture(fileName):
+            cfm_capture.clear(fileName)
+        else:
+            f = open(fileName, "w")
+            f.close()
+            cfm_index.clear(fileName)
         
         
     # Interactive simulation to help user understand voltage train times
@@ -1792,6 +1385,14 @@ class HystGUI(tk.Frame):
         f.write(self.filterByEntry.get())
         f.write(self.fourierLocEntry.get())
         f.write(self.cutoffEntry.get())
+        f.write(str(self.streaming.get()))
+        f.write(self.recordToEntry.get())
+        f.write(str(self.cfmByTime.get()))
+        f.write(self.timeBudgetEntry.get())
+        f.write(self.settleToEntry.get())
+        f.write(str(self.trimByTime.get()))
+        f.write(self.checkpointToEntry.get())
+        f.write(str(self.resume.get()))
         
         f.close()
         
@@ -1829,6 +1430,10 @@ class HystGUI(tk.Frame):
         self.scopeTimeEntry.delete(0, tk.END)
         self.saveCFMToEntry.delete(0, tk.END)
         self.filterTypeEntry.delete(0, tk.END)
+        self.recordToEntry.delete(0, tk.END)
+        self.timeBudgetEntry.delete(0, tk.END)
+        self.settleToEntry.delete(0, tk.END)
+        self.checkpointToEntry.delete(0, tk.END)
         self.filterByEntry.insert(0, tk.END)
         self.fourierLocEntry.insert(0, tk.END)
         self.cutoffEntry.insert(0, tk.END)
@@ -1865,77 +1470,19 @@ class HystGUI(tk.Frame):
         self.filterByEntry.insert(0, new_setting[28])
         self.fourierLocEntry.insert(0, new_setting[29])
         self.cutoffEntry.insert(0, new_setting[30])
+        self.streaming.set(new_setting[31])
+        self.recordToEntry.insert(0, new_setting[32])
+        self.cfmByTime.set(new_setting[33])
+        self.timeBudgetEntry.insert(0, new_setting[34])
+        self.settleToEntry.insert(0, new_setting[35])
+        self.trimByTime.set(new_setting[36])
+        self.checkpointToEntry.insert(0, new_setting[37])
+        self.resume.set(new_setting[38])
         
         
-    # Change arr1 of sizelen1 to smaller size len2 by taking means of chinks
-    def mean_chunks(self, arr1, len1, len2):
-        
-        result = np.zeros(len2)
-        
-        # Larger array length is perfect multiple of smaller array size
-        box_size = int(len1/len2)
-        if len1%len2 == 0:
-            for i in range(len2):
-                result[i] = np.mean(arr1[(i*box_size):((i+1)*box_size)])
-         
-        # Larger array length is not a perfect multiple of smaller array size
-        else:
-            
-            over = int(len1%len2)
-            tot_over = 0
-            start, end = 0, box_size
-            for i in range(len2):
-                tot_over += over
-                
-                if tot_over >= len2:
-                    end += 1
-                    tot_over -= len2
-                    
-                result[i] = np.mean(arr1[start:end])
-                
-                start = end
-                end = end+box_size
-            
-        return result
-    
-        
     # Prepare metadata
     def metadata(self):
-        
-        metadata = "Current date & time: " + time.strftime("%c")+"\n\n"
-        
-        # Entry field values
-        metadata += "Probe Max DC: "+self.probeMaxDCEntry.get()+" V\n"
-        metadata += "Probe Min DC: "+self.probeMinDCEntry.get()+" V\n"
-        metadata += "Bottom Electrode Max DC: "+self.botElectMaxDCEntry.get()+" V\n"
-        metadata += "Bottom Electrode Min DC: "+self.botElectMinDCEntry.get()+" V\n"
-        metadata += "Bias Time: "+self.biasTimeEntry.get()+" ms\n"
-        metadata += "Bias Wait: "+self.biasInterEntry.get()+" ms\n"
-        metadata += "0 V Time: "+self.zeroVTimeEntry.get()+" ms\n"
-        metadata += "0 V Wait: "+self.zeroVInterEntry.get()+" ms\n"
-        metadata += "Number of Steps: "+self.numStepsEntry.get()+"\n"
-        metadata += "Number of Loops: "+self.numLoopsEntry.get()+"\n"
-        metadata += "Probe Auxiliary Output: "+self.probeAuxEntry.get()+"\n"
-        metadata += "Bottom Electrode Auxiliary Output: "+self.botElectAuxEntry.get()+"\n"
-        metadata += "Pattern: "+self.patternEntry.get()+"\n"
-        metadata += "Probe Output: "+self.probeOutEntry.get()+"\n"
-        metadata += "Average Repeated x: "+str(self.avgRepeatedx.get())+"\n"
-        metadata += "Average Repeated y: "+str(self.avgRepeatedy.get())+"\n"
-        metadata += "Demodulator: "+self.demodEntry.get()+"\n"
-        metadata += "Do CFM: "+str(self.doCFM.get())+"\n"
-        metadata += "Bandwidth Limit: "+str(self.bwLim.get())+"\n"
-        metadata += "CFM Input: "+self.cfmInEntry.get()+"\n"
-        metadata += "Scope Sampling Rate: "+self.scopeTimeEntry.get()+"\n"
-        metadata += "Save CFM: "+str(self.saveCFM.get())+"\n"
-        metadata += "CFM Location: "+self.saveCFMToEntry.get()+"\n"
-        metadata += "Unsynchronised: "+str(self.unsync.get())+"\n"
-        metadata += "Filter Type: "+self.filterTypeEntry.get()+"\n"
-        metadata += "Auto Fourier: "+str(self.fourier.get())+"\n"
-        metadata += "Filter By: "+self.filterByEntry.get()+"\n"
-        metadata += "Fourier Location: "+self.fourierLocEntry.get()+"\n"
-        metadata += "Cutoff: "+self.cutoffEntry.get()+"Hz\n\n"
-        
-        return metadata
+        return hyst_job.metadata(self.job())
         
       
     # Location to save Fourier data to
@@ -1958,770 +1505,45 @@ class HystGUI(tk.Frame):
     # FFT data, apply filter(s), then IFFT back
     def fourier_filter(self):
         
+        # The run's CFM data is filtered with the settings it was taken with, however they have been edited since
+        job = self.runJob
+        
         # Check that user wants their data filtered
-        if self.filterTypeEntry.get() != "":
-            
-            # Get filters to apply
-            filters = [filt.strip() for filt in self.filterTypeEntry.get().split(';') if filt != '']
-            
-            # Get filtering modes
-            modes = [mode.strip() for mode in self.filterByEntry.get().split(';') if mode != '']
-            
-            filt_param = [param.strip() for param in self.cutoffEntry.get().split(';') if param != '']
+        if job['filterType'] == "":
+            return
+        
+        # Every filter chain is applied to each transform in a single pass over the CFM data
+        chains = cfm_filter.parse_chains(job['filterType'], job['cutoff'])
+        modes = [mode.strip() for mode in job['filterBy'].split(';') if mode != '']
+        
+        # Automatic filtering saves the filtered signals to a run file beside the CFM data
+        filtered_file = None
+        if job['fourier'] == 1:
+            filtered_file = cfm_filter.filtered_path(self.runOptions['cfmFile'])
             
-            # Unfiltered fourier transform
-            if 'None' in filters:
-                
-                # Open Fourier data file for appending
-                with open(self.fourierLocEntry.get(), "a") as f:
-                    
-                    f.write(self.metadata())
-                    f.write("time\tSignal\tfrequency\tfft\tfiltered_signal\n")
-                    f.write("s\t-\tHz\t-\t-\n")
-                
-                    # FFT shots
-                    if 'Shot Set' in self.filterByEntry.get():
-                        
-                        with open(self.saveCFMToEntry.get(), "r") as data:
-                            
-                            append = False
-                            get_time = False
-                            get_start_time = False
-                            shot = np.zeros(self.shot_len)                                            
-                            i = 0
-                            start_time = 0
-                            shot_start = 0
-                            for line in data:
-                                    
-                                if line == 'bwlimit\n':                                        
-                                    append = False
-                                    
-                                elif append:
-                                    shot[i] = float(line)
-                                    i += 1
-                                    
-                                elif line == 'wave\n':
-                                    append = True
-                                    i = 0
-                                    
-                                elif get_time == True:
-                                    # Fourier transform shot
-                                    dt = float(line)
-                                    fft = np.fft.fft(shot)
-                                    freq = np.fft.fftfreq(self.shot_len, dt)
-                                    
-                                    
-                                    # Append results to fourier file
-                                    for i in range(self.shot_len):
-                                        
-                                        f.write(str(i*dt+shot_start+start_time)+"\t")
-                                        f.write(str(shot[i])+"\t")
-                                        f.write(str(freq[i])+"\t")
-                                        f.write(str(fft[i].real)+"\t")
-                                        f.write(str(fft[i].imag)+"\t")
-                                        f.write("-\n")
-                                        
-                                    # Increment start time for next shot
-                                    shot_start += self.shot_len*dt
-                                    
-                                    get_time = False
-                                    
-                                elif line == 'dt\n':
-                                    get_time = True
-                                    
-                                elif get_start_time == True:
-                                    start_time = float(line)                                                    
-                                    get_start_time = False
-                                    
-                                elif line == 'Time\n':
-                                    get_start_time = True
-                                        
-                    # FFT bias sets
-                    if 'Bias Set' in self.filterByEntry.get():
-                            
-                        with open(self.saveCFMToEntry.get(), "r") as data:
-                        
-                            append = False
-                            get_time = False
-                            first_scope = True
-                            shot = np.zeros(self.shot_len)
-                            shot_train = np.empty((0)) # Shots will be appended to the shot train
-                            i = 0
-                            dt = 0
-                            start_time = 0
-                            size = os.path.getsize(self.saveCFMToEntry.get()) # Use file size to detect if EOF has been reached
-                            for line in data:
-                                
-                                size -= len(line) # When size 0, EOF has been reached
-                                
-                                if line == 'bwlimit\n':    
-                                    # Append each shot to the shot train
-                                    shot_train = np.append(shot_train, shot)
-                                    append = False
-                                    
-                                elif append:
-                                    shot[i] = float(line)
-                                    i += 1
-                                    
-                                elif line == 'wave\n':
-                                    append = True
-                                    i = 0
-                                    
-                                elif get_time == True:
-                                    dt = float(line)                                                    
-                                    get_time = False
-                                    
-                                elif line == 'dt\n':
-                                    get_time = True
-                                    
-                                elif get_start_time == True:
-                                    start_time = float(line)                                                    
-                                    get_start_time = False
-                                    
-                                elif line == 'Time\n':
-                                    get_start_time = True
-                                    
-                                elif first_scope and line == "Probe Offset\n":
-                                    first_scope = False
-                                    
-                                elif line == "Probe Offset\n" or not size:
-                                    
-                                    fft = np.fft.fft(shot_train)
-                                    freq = np.fft.fftfreq(len(shot_train), dt)
-                                    
-                                    # Append results to fourier file
-                                    for i in range(len(shot_train)):
-                                        
-                                        f.write(str(i*dt+start_time)+"\t")
-                                        f.write(str(shot_train[i])+"\t")
-                                        f.write(str(freq[i])+"\t")
-                                        f.write(str(fft[i].real)+"\t")
-                                        f.write(str(fft[i].imag)+"\t")
-                                        f.write("-\n")
-                                    
-                                    # Clear the shot train for the next shots
-                                    if size:
-                                        shot_train = np.empty((0))
-                    
-                                                    
-            # Open Fourier data file for appending
-            if self.fourierLocEntry.get() != "":
-                
-                with open(self.fourierLocEntry.get(), "a") as f:
-                    
-                    f.write(self.metadata())
-                    f.write("time\tSignal\tfrequency\tfft\tfiltered_signal\n")
-                    f.write("s\t-\tHz\t-\t-\n")
-                    
-                    # Check if user also wants automatic Fourier filtering
-                    if self.fourier.get() == 1:
-                        
-                        # Filter each shot set
-                        if 'Shot Set' in modes:
-                            
-                            # Apply filters
-                            for param_idx, filt in enumerate(filters):
-                                
-                                # Update meta
-                                f.write("Meta: Shot Set, "+filt)
-                                
-                                temp2 = "temp2.txt"
-                                temp = "temp.txt"
-                                with open(self.saveCFMToEntry.get(), "r") as data:
-                                
-                                    # Copy original data, replacing values with filtered values,
-                                    # then replace original data file with it
-                                    with open(temp2, "w") as auto_filt:
-                                        # Create temp file to put calculations in
-                                        with open(temp, "w") as calcs:
-                                            
-                                            append = False
-                                            get_time = False
-                                            get_start_time = False
-                                            shot = np.zeros(self.shot_len)                                            
-                                            i = 0
-                                            start_time = 0
-                                            shot_start = 0
-                                            for line in data:
-                                                    
-                                                if line == 'bwlimit\n':                                        
-                                                    append = False
-                                                    
-                                                elif append:
-                                                    shot[i] = float(line)
-                                                    i += 1
-                                                    
-                                                elif line == 'wave\n':
-                                                    append = True
-                                                    i = 0
-                                                    
-                                                elif get_time == True:
-                                                    # Fourier transform shot
-                                                    dt = float(line)
-                                                    fft = np.fft.fft(shot)
-                                                    freq = np.fft.fftfreq(self.shot_len, dt)
-                                                    
-                                                    # Apply filter
-                                                    filt_sig = self.apply_filter(filt, filt_param[param_idx], fft, freq, self.shot_len, np.mean(shot)<0)
-                                                    
-                                                    # Append results to fourier file
-                                                    for i in range(self.shot_len):
-                                                        
-                                                        f.write(str(i*dt+shot_start+start_time)+"\t")
-                                                        f.write(str(shot[i])+"\t")
-                                                        f.write(str(freq[i])+"\t")
-                                                        f.write(str(fft[i].real)+"\t")
-                                                        f.write(str(fft[i].imag)+"\t")
-                                                        f.write(str(filt_sig[i])+"\t")
-                                                        
-                                                        # Add absolute filtered values to temp file as well
-                                                        calcs.write(str(filt_sig[i])+"\n")
-                                                        
-                                                    # Increment start time for next shot
-                                                    shot_start += self.shot_len*dt
-                                                        
-                                                    # Add blank line between each filtering instance
-                                                    f.write("\n")
-                                                    
-                                                    get_time = False
-                                                    
-                                                elif line == 'dt\n':
-                                                    get_time = True
-                                                    
-                                                elif get_start_time == True:
-                                                    start_time = float(line)                                                    
-                                                    get_start_time = False
-                                                    
-                                                elif line == 'Time\n':
-                                                    get_start_time = True
-                                                    
-                                                    
-                                        # Read calculations from file
-                                        with open(temp, "r") as calcs:
-                                            
-                                            # Copy metadata and replace non-metadata with filtered data
-                                            nonmeta = False
-                                            i = 0
-                                            data.seek(0) # Go back to start of data file
-                                            for line in data:
-                                                
-                                                if nonmeta:
-                                                    
-                                                    if i < self.shot_len:
-                                                        auto_filt.write(calcs.readline())
-                                                        i += 1
-                                                        
-                                                    else:
-                                                        i = 0
-                                                        nonmeta = False
-                                                        auto_filt.write(line)
-                                                        
-                                                # Following lines will be non-meta
-                                                elif line == 'wave':
-                                                    auto_filt.write(line)
-                                                    nonmeta = True
-                                                   
-                                                # Meta
-                                                else:
-                                                    auto_filt.write(line)
-                                                    
-                                        os.remove(temp)
-                                
-                                with open(self.saveCFMToEntry.get(), "w") as data:
-                                    with open(temp2, "r") as auto_filt:
-                                        for line in auto_filt:
-                                            data.write(line)
-                                    
-                                os.remove(temp2)
-                                
-                                
-                        # Filter each bias set
-                        if 'Bias Set' in modes:
-                            
-                            # Apply filters
-                            for param_idx, filt in enumerate(filters):
-                                
-                                # Update meta
-                                f.write("Meta: Bias Set, "+filt)
-                                
-                                temp2 = "temp2.txt"
-                                temp = "temp.txt"
-                                with open(self.saveCFMToEntry.get(), "r") as data:
-                                
-                                    # Copy original data, replacing values with filtered values,
-                                    # then replace original data file with it
-                                    with open(temp2, "w") as auto_filt:
-                                        # Create temp file to put calculations in
-                                        with open(temp, "w") as calcs:
-                                            
-                                            append = False
-                                            get_time = False
-                                            get_start_time = False
-                                            first_scope = True
-                                            shot = np.zeros(self.shot_len)
-                                            shot_train = np.empty((0)) # Shots will be appended to the shot train
-                                            i = 0
-                                            dt = 0
-                                            start_time = 0
-                                            size = os.path.getsize(self.saveCFMToEntry.get()) # Use file size to detect if EOF has been reached
-                                            for line in data:
-                                                
-                                                size -= len(line) # When size 0, EOF has been reached
-                                                
-                                                if line == 'bwlimit\n':
-                                                    # Append each shot to the shot train
-                                                    shot_train = np.append(shot_train, shot)
-                                                    append = False
-                                                    
-                                                elif append:
-                                                    shot[i] = float(line)
-                                                    i += 1
-                                                    
-                                                elif line == 'wave\n':
-                                                    append = True
-                                                    i = 0
-                                                    
-                                                elif get_time == True:
-                                                    dt = float(line)                                                    
-                                                    get_time = False
-                                                    
-                                                elif line == 'dt\n':
-                                                    get_time = True
-                                                    
-                                                elif get_start_time == True:
-                                                    start_time = float(line)                                                    
-                                                    get_start_time = False
-                                                    
-                                                elif line == 'Time\n':
-                                                    get_start_time = True
-                                                    
-                                                elif first_scope and line == "Probe Offset\n":
-                                                    first_scope = False
-                                                    
-                                                elif line == "Probe Offset\n" or not size:
-                                                    
-                                                    fft = np.fft.fft(shot_train)
-                                                    freq = np.fft.fftfreq(len(shot_train), dt)
-                                                    
-                                                    # Apply filter
-                                                    filt_sig = self.apply_filter(filt, filt_param[param_idx], fft, freq, len(shot_train), np.mean(shot_train)<0)
-                                                    
-                                                    # Append results to fourier file
-                                                    for i in range(self.shot_len):
-                                                        
-                                                        f.write(str(i*dt+start_time)+"\t")
-                                                        f.write(str(shot_train[i])+"\t")
-                                                        f.write(str(freq[i])+"\t")
-                                                        f.write(str(fft[i].real)+"\t")
-                                                        f.write(str(fft[i].imag)+"\t")
-                                                        f.write(str(filt_sig[i])+"\t")
-                                                        
-                                                        # Add absolute filtered values to temp file as well
-                                                        calcs.write(str(filt_sig[i])+"\n")
-                                                    
-                                                    # Add blank line between each filtering instance
-                                                    f.write("\n")
-                                                    
-                                                    # Clear the shot train for the next shots
-                                                    if size:
-                                                        shot_train = np.empty((0))
-                                                    
-                                        # Read calculations from file
-                                        with open(temp, "r") as calcs:
-                                            
-                                            # Copy metadata and replace non-metadata with filtered data
-                                            nonmeta = False
-                                            i = 0
-                                            data.seek(0) # Go back to start of data file
-                                            for line in data:
-                                                
-                                                if nonmeta:
-                                                    
-                                                    if i < self.shot_len:
-                                                        auto_filt.write(calcs.readline())
-                                                        i += 1
-                                                        
-                                                    else:
-                                                        i = 0
-                                                        nonmeta = False
-                                                        auto_filt.write(line)
-                                                        
-                                                # Following lines will be non-meta
-                                                elif line == 'wave':
-                                                    auto_filt.write(line)
-                                                    nonmeta = True
-                                                   
-                                                # Meta
-                                                else:
-                                                    auto_filt.write(line)
-                                                    
-                                        os.remove(temp)
-                                
-                                with open(self.saveCFMToEntry.get(), "w") as data:
-                                    with open(temp2, "r") as auto_filt:
-                                        for line in auto_filt:
-                                            data.write(line)
-                                    
-                                os.remove(temp2)
-                       
-                    # User does not want automatic Fourier analysis
-                    else:
-                        
-                        # Filter each shot set
-                        if 'Shot Set' in modes:
-                            
-                            # Apply filters
-                            for param_idx, filt in enumerate(filters):
-                                
-                                # Update meta
-                                f.write("Meta: Shot Set, "+filt)
-                                
-                                with open(self.saveCFMToEntry.get(), "r") as data:
-                                    
-                                    append = False
-                                    get_time = False
-                                    shot = np.zeros(self.shot_len)                                            
-                                    i = 0
-                                    start_time = 0
-                                    shot_start = 0
-                                    for line in data:
-                                            
-                                        if line == 'bwlimit\n':                                        
-                                            append = False
-                                            
-                                        elif append:
-                                            shot[i] = float(line)
-                                            i += 1
-                                            
-                                        elif line == 'wave\n':
-                                            append = True
-                                            i = 0
-                                            
-                                        elif get_time == True:
-                                            # Fourier transform shot
-                                            dt = float(line)
-                                            fft = np.fft.fft(shot)
-                                            freq = np.fft.fftfreq(self.shot_len, dt)
-                                            
-                                            # Apply filter
-                                            filt_sig = self.apply_filter(filt, filt_param[param_idx], fft, freq, len(shot_train), np.mean(shot)<0)
-                                            
-                                            # Append results to fourier file
-                                            for i in range(self.shot_len):
-                                                
-                                                f.write(str(i*dt+shot_start+start_time)+"\t")
-                                                f.write(str(shot[i])+"\t")
-                                                f.write(str(freq[i])+"\t")
-                                                f.write(str(fft[i].real)+"\t")
-                                                f.write(str(fft[i].imag)+"\t")
-                                                f.write(str(filt_sig[i].real)+"\t")
-                                                f.write(str(filt_sig[i].imag)+"\n")
-                                                
-                                            # Increment start time for next shot
-                                            shot_start += self.shot_len*dt
-                                                
-                                            # Add blank line between each filtering instance
-                                            f.write("\n")
-                                            
-                                            get_time = False
-                                            
-                                        elif line == 'dt\n':
-                                            get_time = True
-                                            
-                                        elif get_start_time == True:
-                                            start_time = float(line)                                                    
-                                            get_start_time = False
-                                            
-                                        elif line == 'Time\n':
-                                            get_start_time = True
-                                                
-                        
-                        # Filter each shot train
-                        if 'Bias Set' in modes:
-                            
-                            # Apply filters
-                            for param_idx, filt in enumerate(filters):
-                                
-                                # Update meta
-                                f.write("Meta: Bias Set, "+filt)
-                                
-                                with open(self.saveCFMToEntry.get(), "r") as data:
-                                    
-                                    append = False
-                                    get_time = False
-                                    first_scope = True
-                                    shot = np.zeros(self.shot_len)
-                                    shot_train = np.empty((0)) # Shots will be appended to the shot train
-                                    i = 0
-                                    dt = 0
-                                    start_time = 0
-                                    size = os.path.getsize(self.saveCFMToEntry.get()) # Use file size to detect if EOF has been reached
-                                    for line in data:
-                                        
-                                        size -= len(line) # When size 0, EOF has been reached
-                                        
-                                        if line == 'bwlimit\n':     
-                                            # Append each shot to the shot train
-                                            shot_train = np.append(shot_train, shot)
-                                            append = False
-                                            
-                                        elif append:
-                                            shot[i] = float(line)
-                                            i += 1
-                                            
-                                        elif line == 'wave\n':
-                                            append = True
-                                            i = 0
-                                            
-                                        elif get_time == True:
-                                            dt = float(line)                                                    
-                                            get_time = False
-                                            
-                                        elif line == 'dt\n':
-                                            get_time = True
-                                            
-                                        elif get_start_time == True:
-                                            start_time = float(line)                                                    
-                                            get_start_time = False
-                                            
-                                        elif line == 'Time\n':
-                                            get_start_time = True
-                                            
-                                        elif first_scope and line == "Probe Offset\n":
-                                            first_scope = False
-                                            
-                                        elif line == "Probe Offset\n" or not size:
-                                            
-                                            fft = np.fft.fft(shot_train)
-                                            freq = np.fft.fftfreq(len(shot_train), dt)
-                                            
-                                            # Apply filter
-                                            filt_sig = self.apply_filter(filt, filt_param[param_idx], fft, freq, len(shot_train), np.mean(shot_train)<0)
-                                            
-                                            # Append results to fourier file
-                                            for i in range(self.shot_len):
-                                                
-                                                f.write(str(i*dt+start_time)+"\t")
-                                                f.write(str(shot_train[i])+"\t")
-                                                f.write(str(freq[i])+"\t")
-                                                f.write(str(fft[i].real)+"\t")
-                                                f.write(str(fft[i].imag)+"\t")
-                                                f.write(str(filt_sig[i].real)+"\t")
-                                                f.write(str(filt_sig[i].imag)+"\n")
-                                            
-                                            # Add blank line between each filtering instance
-                                            f.write("\n")
-                                            
-                                            # Clear the shot train for the next shots
-                                            if size:
-                                                shot_train = np.empty((0))
-                                                        
-                   
-            # Check if user wants automatic Fourier filtering with no seperate output
-            elif self.fourier.get() == 1:
-                
-                # Filter each shot
-                if 'Shot Set' in modes:
-                    
-                    # Apply filters
-                    for param_idx, filt in enumerate(filters):
-                        
-                        # Update meta
-                        f.write("Meta: Shot Set, "+filt)
-                        
-                        temp2 = "temp2.txt"
-                        temp = "temp.txt"
-                        with open(self.saveCFMToEntry.get(), "r") as data:
-                        
-                            # Copy original data, replacing values with filtered values,
-                            # then replace original data file with it
-                            with open(temp2, "w") as auto_filt:
-                                # Create temp file to put calculations in
-                                with open(temp, "w") as calcs:
-                                    
-                                    append = False
-                                    get_time = False
-                                    shot = np.zeros(self.shot_len)                                            
-                                    i = 0
-                                    for line in data:
-                                            
-                                        if line == 'bwlimit\n':                                        
-                                            append = False
-                                            
-                                        elif append:
-                                            shot[i] = float(line)
-                                            i += 1
-                                            
-                                        elif line == 'wave\n':
-                                            append = True
-                                            i = 0
-                                            
-                                        elif get_time == True:
-                                            # Fourier transform shot
-                                            dt = float(line)
-                                            fft = np.fft.fft(shot)
-                                            freq = np.fft.fftfreq(self.shot_len, dt)
-                                            
-                                            # Apply filter
-                                            filt_sig = self.apply_filter(filt, filt_param[param_idx], fft, freq, len(shot), np.mean(shot)<0)
-                                            
-                                            # Append results to fourier file
-                                            for i in range(self.shot_len):                                                        
-                                                # Add absolute filtered values to temp file as well
-                                                calcs.write(str(filt_sig[i])+"\n")
-                                            
-                                            get_time = False
-                                            
-                                        elif line == 'dt\n':
-                                            get_time = True
-                                            
-                                            
-                                # Read calculations from file
-                                with open(temp, "r") as calcs:
-                                    
-                                    # Copy metadata and replace non-metadata with filtered data
-                                    nonmeta = False
-                                    i = 0
-                                    data.seek(0) # Go back to start of data file
-                                    for line in data:
-                                        
-                                        if nonmeta:
-                                            
-                                            if i < self.shot_len:
-                                                auto_filt.write(calcs.readline())
-                                                i += 1
-                                                
-                                            else:
-                                                i = 0
-                                                nonmeta = False
-                                                auto_filt.write(line)
-                                                
-                                        # Following lines will be non-meta
-                                        elif line == 'wave':
-                                            auto_filt.write(line)
-                                            nonmeta = True
-                                           
-                                        # Meta
-                                        else:
-                                            auto_filt.write(line)
-                                            
-                                os.remove(temp)
-                        
-                        with open(self.saveCFMToEntry.get(), "w") as data:
-                            with open(temp2, "r") as auto_filt:
-                                for line in auto_filt:
-                                    data.write(line)
-                            
-                        os.remove(temp2)
-                        
-                # Filter each bias set
-                if 'Bias Set' in modes:
-                    
-                    # Apply filters
-                    for param_idx, filt in enumerate(filters):
-                        
-                        # Update meta
-                        f.write("Meta: Shot Set, "+filt)
-                        
-                        temp2 = "temp2.txt"
-                        temp = "temp.txt"
-                        with open(self.saveCFMToEntry.get(), "r") as data:
-                        
-                            # Copy original data, replacing values with filtered values,
-                            # then replace original data file with it
-                            with open(temp2, "w") as auto_filt:
-                                # Create temp file to put calculations in
-                                with open(temp, "w") as calcs:
-                                    
-                                    append = False
-                                    get_time = False
-                                    first_scope = True
-                                    shot = np.zeros(self.shot_len)
-                                    shot_train = np.empty((0)) # Shots will be appended to the shot train
-                                    i = 0
-                                    dt = 0
-                                    size = os.path.getsize(self.saveCFMToEntry.get()) # Use file size to detect if EOF has been reached
-                                    for line in data:
-                                        
-                                        size -= len(line) # When size is 0, EOF has been reached
-                                        
-                                        if line == 'bwlimit\n':
-                                            # Append each shot to the shot train
-                                            shot_train = np.append(shot_train, shot)
-                                            append = False
-                                            
-                                        elif append:
-                                            shot[i] = float(line)
-                                            i += 1
-                                            
-                                        elif line == 'wave\n':
-                                            append = True
-                                            i = 0
-                                            
-                                        elif get_time == True:
-                                            dt = float(line)                                                    
-                                            get_time = False
-                                            
-                                        elif line == 'dt\n':
-                                            get_time = True
-                                            
-                                        elif first_scope and line == "Probe Offset\n":
-                                            first_scope = False
-                                            
-                                        elif line == "Probe Offset\n" or not size:
-                                            
-                                            fft = np.fft.fft(shot_train)
-                                            freq = np.fft.fftfreq(len(shot_train), dt)
-                                            
-                                            # Apply filter
-                                            filt_sig = self.apply_filter(filt, filt_param[param_idx], fft, freq, len(shot_train), np.mean(shot_train)<0)
-                                            
-                                            # Append results to fourier file
-                                            for i in range(self.shot_len):                                                        
-                                                # Add absolute filtered values to temp file as well
-                                                calcs.write(str(filt_sig[i])+"\n")
-                                            
-                                            # Clear the shot train for the next shots
-                                            if size:
-                                                shot_train = np.empty((0))
-                                            
-                                # Read calculations from file
-                                with open(temp, "r") as calcs:
-                                    
-                                    # Copy metadata and replace non-metadata with filtered data
-                                    nonmeta = False
-                                    i = 0
-                                    data.seek(0) # Go back to start of data file
-                                    for line in data:
-                                        
-                                        if nonmeta:
-                                            
-                                            if i < self.shot_len:
-                                                auto_filt.write(calcs.readline())
-                                                i += 1
-                                                
-                                            else:
-                                                i = 0
-                                                nonmeta = False
-                                                auto_filt.write(line)
-                                                
-                                        # Following lines will be non-meta
-                                        elif line == 'wave\n':
-                                            auto_filt.write(line)
-                                            nonmeta = True
-                                           
-                                        # Meta
-                                        else:
-                                            auto_filt.write(line)
-                                            
-                                os.remove(temp)
-                        
-                        with open(self.saveCFMToEntry.get(), "w") as data:
-                            with open(temp2, "r") as auto_filt:
-                                for line in auto_filt:
-                                    data.write(line)
-                            
-                        os.remove(temp2)
+        if job['fourierLoc'] == "" and filtered_file is None:
+            return
+        
+        # Bias sets are filtered in parallel processes once there is enough data for them to pay off
+        pipeline = cfm_filter.FourierPipeline(self.runOptions['cfmFile'], chains, modes, job['fourierLoc'],
+                                              filtered_file, self.runOptions['metadata'], workers='auto')
+        
+        # Filter in the background and report when it is done at the GUI's refresh rate
+        self.filterWorker = cfm_filter.FilterWorker(pipeline)
+        self.filterWorker.start()
+        self.executeButton['text'] = "Filtering"
+        self.hystGUI.after(self.refreshTime, self.consume_filter)
+        
+        
+    # Wait for the filter worker to finish, then raise the error it failed with, if any
+    def consume_filter(self):
+        if self.filterWorker.is_alive():
+            self.hystGUI.after(self.refreshTime, self.consume_filter)
+            return
+        
+        self.executeButton['text'] = "Execute"
+        if self.filterWorker.error is not None:
+            raise self.filterWorker.error
     
     
     # View CFM data in text editor
@@ -2732,44 +1554,6 @@ class HystGUI(tk.Frame):
     # View filter data in text editor
     def openFourier(self):
         os.startfile(self.fourierLocEntry.get())
-        
-        
-    # Convolute signal with filter in frequency domain
-    @staticmethod
-    def apply_filter(filt, filt_param, fft_orig, freq, size, neg = False):
-        
-        # Copy fft so we can convolute filters with it without affecting the original fft
-        fft = np.copy(fft_orig)
-        
-        # Get subfilters
-        sub_filts = [sub_filt.strip() for sub_filt in filt.split(':') if sub_filt != '' and sub_filt != 'None']
-        
-        # Get subfilter parameters
-        sub_filt_params = [sub_filt_param.strip() for sub_filt_param in filt_param.split(':') if sub_filt_param != '']
-        
-        # Convolute subfilters with signal. The lowest index filter is applied first
-        for param_idx, sub_filt in enumerate(sub_filts):
-            
-            if sub_filt == 'Low Pass':
-                
-                cutoff = float(sub_filt_params[param_idx])
-                for i in range(size):
-                    if freq[i] > cutoff:
-                        fft[i] = 0+0j
-                        
-            if sub_filt == 'High Pass':
-                
-                cutoff = float(sub_filt_params[param_idx])
-                for i in range(size):
-                    if freq[i] < cutoff:
-                        fft[i] = 0+0j
-                
-        # Transform filtered signal back to time domain and take absolute values
-        # negating them if specified
-        if neg:
-            return -np.absolute(np.fft.ifft(fft))
-        else:
-            return np.absolute(np.fft.ifft(fft))
     
 
 if __name__ == "__main__":
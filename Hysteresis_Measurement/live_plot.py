@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import time # Redraw throttling
+
+class LivePlot(object):
+    """Live line plot that keeps one Line2D and redraws only it over a cached background
+    (blitting). The axes, ticks and labels are only redrawn when the data leaves the
+    current limits, and redraws are throttled to at most fps per second."""
+
+    def __init__(self, ax, canvas, fps=20, margin=0.1):
+        self.ax = ax
+        self.canvas = canvas
+        self.interval = 1.0/fps
+        self.margin = margin # Fraction of the data span left free when the limits grow
+
+        self.line, = ax.plot([], [], animated=True)
+        self._background = None
+        self._key = None # Data the line shows. Changing it resets the limits
+        self._size = 0
+        self._extent = None # Data min x, max x, min y, max y
+        self._limits = None
+        self._last_draw = 0.0
+        self._pending = False
+
+        # Recache the background whenever the whole figure is redrawn, e.g. on resize or zoom
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    # Show new data. When appended is True, the first points are those last shown under the same key
+    # so only the new points need checking against the limits
+    def update(self, x, y, key=None, appended=True):
+        x, y = np.asarray(x), np.asarray(y)
+
+        if key != self._key or not appended or len(x) < self._size or self._extent is None:
+            self._key = key
+            self._extent = None
+            self._limits = None
+            new_x, new_y = x, y
+        else:
+            new_x, new_y = x[self._size:], y[self._size:]
+
+        self.line.set_data(x, y)
+        self._size = len(x)
+        self._grow_extent(new_x, new_y)
+
+        self._pending = True
+        if time.time()-self._last_draw >= self.interval:
+            self.flush()
+
+    # Draw anything the throttle held back
+    def flush(self):
+        if not self._pending:
+            return
+        self._pending = False
+        self._last_draw = time.time()
+
+        if self._set_limits() or self._background is None:
+            # Full redraw. The draw event recaches the background and draws the line
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self._background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+
+    def _grow_extent(self, x, y):
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not np.any(finite):
+            return
+        x, y = x[finite], y[finite]
+        extent = (np.min(x), np.max(x), np.min(y), np.max(y))
+        if self._extent is None:
+            self._extent = extent
+        else:
+            self._extent = (min(self._extent[0], extent[0]), max(self._extent[1], extent[1]),
+                            min(self._extent[2], extent[2]), max(self._extent[3], extent[3]))
+
+    # Widen the limits, with a margin, if the data no longer fits. Returns True if they changed
+    def _set_limits(self):
+        if self._extent is None:
+            return False
+
+        x0, x1, y0, y1 = self._extent
+        if self._limits is not None:
+            lx0, lx1, ly0, ly1 = self._limits
+            if lx0 <= x0 and x1 <= lx1 and ly0 <= y0 and y1 <= ly1:
+                return False
+
+        x_pad = self.margin*(x1-x0) if x1 > x0 else 0.5*max(abs(x0), 1.0)
+        y_pad = self.margin*(y1-y0) if y1 > y0 else 0.5*max(abs(y0), 1.0)
+        self._limits = (x0-x_pad, x1+x_pad, y0-y_pad, y1+y_pad)
+        self.ax.set_xlim(self._limits[0], self._limits[1])
+        self.ax.set_ylim(self._limits[2], self._limits[3])
+        return True
+
+
+# Compare per-step redraw cost with clearing and replotting the whole history
+if __name__ == "__main__":
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    step_len = 500 # Samples per bias step
+    num_steps = 200
+    report_every = 40
+
+    def figure():
+        f = Figure(figsize=(5, 4), dpi=100)
+        return f.add_subplot(111), FigureCanvasAgg(f)
+
+    a, canvas = figure()
+    live = LivePlot(*figure(), fps=1e9) # Draw every step for the comparison
+
+    x = np.repeat(np.sin(np.linspace(0, 4*np.pi, num_steps)), step_len)
+    y = np.tanh(3*x)+0.01*np.random.randn(len(x))
+
+    print("steps    points    live (ms/step)    replot (ms/step)")
+    live_time, replot_time = 0.0, 0.0
+    for step in range(1, num_steps+1):
+        n = step*step_len
+
+        start = time.perf_counter()
+        live.update(x[:n], y[:n])
+        live_time += time.perf_counter()-start
+
+        start = time.perf_counter()
+        a.clear()
+        a.plot(x[:n], y[:n])
+        canvas.draw()
+        replot_time += time.perf_counter()-start
+
+        if step % report_every == 0:
+            print("{0:5d}    {1:6d}    {2:14.2f}    {3:16.2f}".format(step, n,
+                  1000*live_time/report_every, 1000*replot_time/report_every))
+            live_time, replot_time = 0.0, 0.0
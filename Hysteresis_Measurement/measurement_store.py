@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import time # Benchmark timing
+
+class MeasurementStore(object):
+    """Columnar measurement buffers that grow geometrically instead of being
+    copied on every append. Indexing a column returns a view of its filled part."""
+
+    def __init__(self, keys, capacity=1024, dtype=np.float64):
+        self.columns = tuple(keys)
+        self.dtype = dtype
+        self._buffers = {}
+        self._sizes = {}
+        for key in self.columns:
+            self._buffers[key] = np.empty(capacity, dtype)
+            self._sizes[key] = 0
+
+    # Zero-copy view of the values recorded so far in a column
+    def __getitem__(self, key):
+        return self._buffers[key][:self._sizes[key]]
+
+    # Replace a column's contents
+    def __setitem__(self, key, values):
+        if not key in self._buffers:
+            self.columns += (key,)
+            self._buffers[key] = np.empty(0, self.dtype)
+        self._sizes[key] = 0
+        self.append(key, values)
+
+    # Iterate over column names in the order they were given, like a dictionary
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, key):
+        return key in self._buffers
+
+    def keys(self):
+        return self.columns
+
+    def values(self):
+        return [self[key] for key in self.columns]
+
+    def items(self):
+        return [(key, self[key]) for key in self.columns]
+
+    # Number of values recorded in a column
+    def size(self, key):
+        return self._sizes[key]
+
+    # Last value recorded in a column, or default if the column is empty
+    def last(self, key, default=None):
+        size = self._sizes[key]
+        if size == 0:
+            return default
+        return self._buffers[key][size-1]
+
+    # Make sure a column (or all columns) can hold at least capacity values without reallocating
+    def reserve(self, capacity, key=None):
+        keys = self.columns if key is None else (key,)
+        for key in keys:
+            if len(self._buffers[key]) < capacity:
+                grown = np.empty(int(capacity), self.dtype)
+                grown[:self._sizes[key]] = self._buffers[key][:self._sizes[key]]
+                self._buffers[key] = grown
+
+    # Append values to the end of a column, doubling its capacity when it is full
+    def append(self, key, values):
+        values = np.ravel(values)
+        size = self._sizes[key]
+        needed = size+len(values)
+
+        if needed > len(self._buffers[key]):
+            self.reserve(max(needed, 2*len(self._buffers[key]), 1024), key)
+
+        self._buffers[key][size:needed] = values
+        self._sizes[key] = needed
+
+    # Append a dictionary of columns
+    def extend(self, columns):
+        for key in columns:
+            self.append(key, columns[key])
+
+    # Forget recorded values but keep the allocated buffers for the next run
+    def clear(self):
+        for key in self.columns:
+            self._sizes[key] = 0
+
+    # Independent copy of the recorded values as a dictionary of arrays
+    def copy(self):
+        return {key: np.copy(self[key]) for key in self.columns}
+
+
+# Compare per-append cost of the store with np.append as a run grows
+if __name__ == "__main__":
+
+    keys = ('TotalV', 'X', 'Y', 'R', 'Phase', 't', 'ProbeV', 'BotElectV', 'CFM_V')
+    step_len = 2000 # Samples per bias step
+    num_steps = 1000
+    report_every = 100
+
+    sample = {key: np.random.rand(step_len) for key in keys}
+
+    store = MeasurementStore(keys)
+    appended = {key: np.empty((0)) for key in keys}
+
+    print("steps    samples    store (ms/step)    np.append (ms/step)")
+    store_time, append_time = 0.0, 0.0
+    for step in range(1, num_steps+1):
+
+        start = time.perf_counter()
+        store.extend(sample)
+        store_time += time.perf_counter()-start
+
+        start = time.perf_counter()
+        for key in keys:
+            appended[key] = np.append(appended[key], sample[key])
+        append_time += time.perf_counter()-start
+
+        if step % report_every == 0:
+            print("{0:5d}    {1:7d}    {2:15.4f}    {3:19.4f}".format(step, step*step_len,
+                  1000*store_time/report_every, 1000*append_time/report_every))
+            store_time, append_time = 0.0, 0.0
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import time # Benchmark timing
+
+# Index of the first element of each run of consecutive equal keys
+def run_starts(key):
+    key = np.asarray(key)
+    if len(key) == 0:
+        return np.empty(0, np.intp)
+    return np.concatenate(([0], np.flatnonzero(key[1:] != key[:-1])+1))
+
+
+# Mean of each column of data over runs of consecutive equal keys. data can be one column or
+# a 2D array of columns, which are all reduced in a single pass
+def avg_runs(key, data, starts=None):
+    data = np.asarray(data, dtype=np.float64)
+    if starts is None:
+        starts = run_starts(key)
+    if len(starts) == 0:
+        return data[:0]
+
+    counts = np.diff(np.append(starts, len(data)))
+    sums = np.add.reduceat(data, starts, axis=0)
+    if data.ndim > 1:
+        counts = counts[:, np.newaxis]
+    return sums/counts
+
+
+# Average y over repeated x values. Can average over y by passing x and y the other way around
+def avg_xrepeats(x, y):
+    x = np.asarray(x)
+    starts = run_starts(x)
+    return x[starts], avg_runs(x, y, starts)
+
+
+# Average every named column of a measurements dictionary over repeats of the key column.
+# Returns a 2D array with one row per run and one column per name
+def avg_columns(measurements, key, names):
+    data = np.column_stack([measurements[name] for name in names])
+    return avg_runs(measurements[key], data)
+
+
+# First index of each of num_chunks consecutive chunks of length values. Chunk lengths differ by
+# at most one, with the longer chunks spread evenly
+def chunk_starts(length, num_chunks):
+    return (np.arange(num_chunks)*length)//num_chunks
+
+
+# Means of num_chunks consecutive chunks of values. Chunks without any values are nan
+def mean_chunks(values, num_chunks):
+    values = np.asarray(values, dtype=np.float64)
+    starts = chunk_starts(len(values), num_chunks)
+    counts = np.diff(np.append(starts, len(values)))
+
+    means = np.full(num_chunks, np.nan)
+    filled = counts > 0
+    if np.any(filled):
+        means[filled] = np.add.reduceat(values, starts[filled])/counts[filled]
+    return means
+
+
+# Means of values over the times closest to each sample time. Values more than half a sample
+# period before the first or after the last sample are left out, and samples without any values
+# are nan. Times are in any units, e.g. device clock ticks, as long as both are in the same one
+def mean_by_time(values, times, sample_times):
+    values = np.asarray(values, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    sample_times = np.asarray(sample_times, dtype=np.float64)
+
+    means = np.full(len(sample_times), np.nan)
+    if len(sample_times) == 0 or len(values) == 0:
+        return means
+
+    period = np.median(np.diff(sample_times)) if len(sample_times) > 1 else np.inf
+    inside = (times >= sample_times[0]-period/2) & (times < sample_times[-1]+period/2)
+    samples = np.searchsorted((sample_times[1:]+sample_times[:-1])/2, times[inside], side='right')
+
+    counts = np.bincount(samples, minlength=len(sample_times))
+    sums = np.bincount(samples, weights=values[inside], minlength=len(sample_times))
+    filled = counts > 0
+    means[filled] = sums[filled]/counts[filled]
+    return means
+
+
+# Compare with averaging each run in a Python loop, as the GUIs used to. Then compare compressing
+# CFM trains with the loop the GUIs used, and check that aligning them by time follows a scope
+# clock that drifts from the demodulator's
+if __name__ == "__main__":
+
+    num_columns = 9
+    repeats = 50 # Samples per bias step
+
+    def loop_avg(x, data):
+        avged = []
+        start = 0
+        for i in range(1, len(x)+1):
+            if i == len(x) or x[i] != x[start]:
+                avged.append([np.mean(data[start:i, k]) for k in range(data.shape[1])])
+                start = i
+        return np.array(avged)
+
+    print("samples    vectorised (ms)    loop (ms)")
+    for num_samples in (10**4, 10**5, 10**6):
+        x = np.repeat(np.arange(num_samples//repeats, dtype=np.float64), repeats)
+        data = np.random.rand(num_samples, num_columns)
+
+        start = time.perf_counter()
+        fast = avg_runs(x, data)
+        fast_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        slow = loop_avg(x, data)
+        slow_time = time.perf_counter()-start
+
+        assert np.allclose(fast, slow)
+        print("{0:7d}    {1:15.2f}    {2:9.1f}".format(num_samples, 1000*fast_time, 1000*slow_time))
+
+    # Error accumulator loop over output chunks
+    def loop_chunks(arr1, len1, len2):
+        result = np.zeros(len2)
+        box_size = int(len1/len2)
+        over = int(len1%len2)
+        tot_over = 0
+        start, end = 0, box_size
+        for i in range(len2):
+            tot_over += over
+            if tot_over >= len2:
+                end += 1
+                tot_over -= len2
+            result[i] = np.mean(arr1[start:end])
+            start = end
+            end = end+box_size
+        return result
+
+    print()
+    print("scope samples    demod samples    vectorised (ms)    loop (ms)")
+    for num_values, num_chunks in ((2048*10, 1800), (2048*100, 18000), (2048*1000, 180000)):
+        values = np.random.rand(num_values)
+
+        start = time.perf_counter()
+        fast = mean_chunks(values, num_chunks)
+        fast_time = time.perf_counter()-start
+
+        start = time.perf_counter()
+        slow = loop_chunks(values, num_values, num_chunks)
+        slow_time = time.perf_counter()-start
+
+        assert np.allclose(fast, slow)
+        print("{0:13d}    {1:13d}    {2:15.2f}    {3:9.1f}".format(num_values, num_chunks, 1000*fast_time, 1000*slow_time))
+
+    # A 1 s ramp sampled by a demodulator and by a scope whose clock runs 1% fast, with a gap
+    # between shots. Index ratio chunks drift from the ramp while time aligned means follow it
+    sample_times = np.arange(1800)/1800.0
+    times = np.concatenate([shot*0.1+np.arange(8000)*1.01e-5 for shot in range(10)])
+    by_time = mean_by_time(times, times, sample_times)
+    by_index = mean_chunks(times, len(sample_times))
+    filled = ~np.isnan(by_time)
+    print()
+    print("max alignment error (s): by time {0:.2e}, by index {1:.2e}".format(
+        np.max(np.abs(by_time[filled]-sample_times[filled])), np.max(np.abs(by_index-sample_times))))
+    assert np.max(np.abs(by_time[filled]-sample_times[filled])) <= 0.5/1800
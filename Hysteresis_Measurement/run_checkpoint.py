@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# Checkpoint logs of hysteresis runs. Each completed step is appended to a log file along with
+# its place in the schedule, so a run that is cancelled or crashes can be resumed from the step
+# after the last one logged. A log starts with the settings of its run, so only the same run can
+# be resumed from it. Every record ends with a checksum and the file is synced to disk every few
+# steps. A record torn by a crash fails its checksum and is dropped when the log is reopened.
+
+import numpy as np
+
+import json
+import os
+import struct
+import zlib
+
+import time # Benchmark timing
+
+magic = b'HYSTCKPT'
+format_version = 1
+
+# Steps appended between syncs to disk. Only steps since the last sync can be lost
+sync_steps = 1
+
+# Columns of a step's sample that are logged, other than those of extra demodulators
+sample_columns = ('x', 'y', 'R', 'Phase', 't', 'ProbeV', 'BotElectV', 'TotalV', 'CFM_V')
+
+_length = struct.Struct('<I')
+_crc = struct.Struct('<I')
+_record = struct.Struct('<4sqiiIH') # b'STEP', schedule index, loop, step, samples, length of column names
+
+
+# Settings of a run that its steps depend on, as they are stored in a log
+def identity(hystParam, options):
+    run = {'hystParam': list(hystParam), 'streaming': options['streaming'], 'doCFM': options['doCFM'],
+           'trimByTime': options['trimByTime'], 'settleTo': options['settleTo']}
+    return json.loads(json.dumps(run, default=float))
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+# Read a log. Returns the settings of its run, the logged steps as (index, loop, step, sample)
+# and where the last intact record ends
+def read(fileName):
+    with open(fileName, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(fileName+" is not a checkpoint log")
+        length = _length.unpack(_read_exactly(f, _length.size))[0]
+        header = _read_exactly(f, length)
+        if _crc.unpack(_read_exactly(f, _crc.size))[0] != zlib.crc32(header):
+            raise ValueError(fileName+" has a damaged header")
+        run = json.loads(header.decode('utf-8'))
+        if run['version'] > format_version:
+            raise ValueError(fileName+" is from a newer version")
+
+        steps = []
+        end = f.tell()
+        while True:
+            try:
+                head = _read_exactly(f, _record.size)
+                kind, index, loop, step, samples, names_len = _record.unpack(head)
+                if kind != b'STEP':
+                    break
+                names = _read_exactly(f, names_len)
+                data = _read_exactly(f, 8*samples*len(names.split(b',')))
+                if _crc.unpack(_read_exactly(f, _crc.size))[0] != zlib.crc32(head+names+data):
+                    break
+            except EOFError:
+                break
+
+            values = np.frombuffer(data, dtype='<f8').reshape(-1, samples)
+            sample = {name: values[i].copy() for i, name in enumerate(names.decode('utf-8').split(','))}
+            steps.append((index, loop, step, sample))
+            end = f.tell()
+
+    return run['identity'], steps, end
+
+
+class CheckpointLog(object):
+    """Log of the steps of a run. Resuming reopens an existing log of the same run after its last
+    intact record and makes its steps available as samples. Otherwise the log is started afresh.
+    Only the columns of samples that are in columns are logged."""
+
+    def __init__(self, fileName, identity, resume=False, columns=sample_columns, every=sync_steps):
+        self.fileName = fileName
+        self.columns = columns
+        self.every = every
+        self.samples = [] # Samples of the steps logged before resuming
+        self._unsynced = 0
+
+        if resume and os.path.exists(fileName):
+            logged, steps, end = read(fileName)
+            if logged != identity:
+                raise ValueError("The checkpoint in "+fileName+" is of a run with different settings")
+            self.samples = [sample for index, loop, step, sample in steps]
+            self.completed = steps[-1][0]+1 if steps else 0
+            self._f = open(fileName, 'r+b')
+            self._f.truncate(end)
+            self._f.seek(end)
+        else:
+            self.completed = 0
+            header = json.dumps({'version': format_version, 'identity': identity}).encode('utf-8')
+            self._f = open(fileName, 'wb')
+            self._f.write(magic+_length.pack(len(header))+header+_crc.pack(zlib.crc32(header)))
+            self.sync()
+
+    # Append the sample of the step at index in the schedule, at loop and step. Steps are appended in
+    # schedule order, though those without data may be missing
+    def append(self, sample, index, loop, step):
+        names = [name for name in self.columns if name in sample]
+        data = np.ascontiguousarray([sample[name] for name in names], dtype='<f8')
+        names = ','.join(names).encode('utf-8')
+        record = _record.pack(b'STEP', index, loop, step, data.shape[1], len(names))+names+data.tobytes()
+        self._f.write(record+_crc.pack(zlib.crc32(record)))
+        self.completed = index+1 # Schedule index of the next step
+
+        self._unsynced += 1
+        if self._unsynced >= self.every:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._f.close()
+
+
+# Time logging steps against the time their windows are polled for, then check that a log torn
+# mid-record resumes from its last intact step
+if __name__ == "__main__":
+
+    import tempfile
+
+    demod_rate = 1716.6 # Default HF2 demodulator rate [Hz]
+    run = identity((1.0, -1.0, 0.0, 0.0, 0.05, 0.0, 0.05, 0.0, 50, 1, 1, 2, 'Min-Max', 1, (1,)),
+                   {'streaming': 0, 'doCFM': 0, 'trimByTime': 0, 'settleTo': None})
+
+    def step_sample(window):
+        samples = int(window*demod_rate)
+        sample = {name: np.random.rand(samples) for name in sample_columns if name != 'CFM_V'}
+        sample['timestamp'] = np.arange(samples, dtype=np.uint64)
+        return sample
+
+    directory = tempfile.mkdtemp()
+    fileName = os.path.join(directory, 'run.ckpt')
+    try:
+        print("window (ms)    sync every    log per step (ms)    of poll time (%)")
+        for window in (0.02, 0.1, 1.0):
+            sample = step_sample(window)
+            for every in (1, 10):
+                log = CheckpointLog(fileName, run, every=every)
+                start = time.perf_counter()
+                for step in range(100):
+                    log.append(sample, step, 0, step)
+                log.close()
+                per_step = (time.perf_counter()-start)/100
+                print("{0:11.0f}    {1:10d}    {2:17.3f}    {3:16.2f}".format(1000*window, every, 1000*per_step, 100*per_step/window))
+
+        # Tear the last record, as a crash while it is written would
+        log = CheckpointLog(fileName, run)
+        for step in range(5):
+            log.append(step_sample(0.02), step, 0, step)
+        log.close()
+        with open(fileName, 'r+b') as f:
+            f.truncate(os.path.getsize(fileName)-10)
+
+        log = CheckpointLog(fileName, run, resume=True)
+        assert log.completed == 4 and len(log.samples) == 4
+        assert not 'timestamp' in log.samples[0]
+        log.append(step_sample(0.02), 4, 0, 4)
+
+        # Steps without data leave gaps, and the run resumes after the last step logged
+        log.append(step_sample(0.02), 7, 0, 7)
+        log.close()
+        assert len(read(fileName)[1]) == 6
+        log = CheckpointLog(fileName, run, resume=True)
+        assert log.completed == 8
+        log.close()
+
+        # Other runs cannot be resumed from the log
+        try:
+            CheckpointLog(fileName, identity((2.0,)+tuple(run['hystParam'][1:]), run), resume=True)
+            raise AssertionError("Resumed a different run")
+        except ValueError:
+            pass
+    finally:
+        if os.path.exists(fileName):
+            os.remove(fileName)
+        os.rmdir(directory)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# Run duration prediction. Every instrument call a measurement makes is timed, along with the
+# time each step takes beyond its bias, 0 V and intermission times. The mean overheads of each
+# run are kept in a history file, so the next run with the same kind of acquisition can be
+# timed before it starts. While a run is going, the prediction is corrected by the steps taken.
+
+import json
+import os
+import time
+
+timings_file = 'hysteresis_timings.json'
+history_len = 10 # Runs kept for each kind of acquisition
+
+# Instrument calls whose latency is recorded
+timed_calls = ('set', 'sync', 'subscribe', 'unsubscribe', 'poll', 'get', 'getInt', 'getDouble')
+
+# Overheads broken down per step: the calls and time spent in stalled polls
+breakdown = timed_calls+('stall',)
+
+# Weight of the predicted step overhead in the live estimate, in steps
+prior_steps = 3
+
+
+# Kind of acquisition a run's timings apply to. Waits for polled samples to settle end early when
+# there is a settling inaccuracy
+def config_key(streaming, doCFM, settleTo=None):
+    return (("streaming" if streaming == 1 else "polled")+("+cfm" if doCFM == 1 else "")+
+            ("+settling" if settleTo is not None and streaming != 1 else ""))
+
+
+class Latencies(object):
+    """Total time taken by each kind of operation during a run and how many there were. Only
+    time beyond what an operation was asked to take, e.g. the length of a poll, is counted."""
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.0)+seconds
+        self.counts[name] = self.counts.get(name, 0)+1
+
+    def mean(self, name, default=0.0):
+        return self.totals[name]/self.counts[name] if self.counts.get(name) else default
+
+    # Mean overheads of a run: its setup, each step and each kind of call per step
+    def summary(self):
+        steps = self.counts.get('step', 0)
+        summary = {'setup': self.totals.get('setup', 0.0), 'step': self.mean('step'), 'steps': steps}
+        summary['calls'] = {name: self.totals[name]/steps for name in self.totals
+                            if name in breakdown and steps > 0}
+        return summary
+
+
+class TimedSession(object):
+    """Wraps an API session so that the latency of its calls is added to latencies. Everything
+    else is passed through to the session."""
+
+    def __init__(self, daq, latencies):
+        self._daq = daq
+        self.latencies = latencies
+
+    def __getattr__(self, name):
+        attr = getattr(self._daq, name)
+        if not name in timed_calls:
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter()-start
+                if name == 'poll':
+                    elapsed -= args[0] # The time polled for is part of the step
+                self.latencies.add(name, elapsed)
+        return timed
+
+
+# Timings of previous runs, by kind of acquisition
+def load(fileName=timings_file):
+    try:
+        with open(fileName, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Add a run's timings to the history
+def record(key, summary, fileName=timings_file):
+    if summary['steps'] == 0:
+        return
+    history = load(fileName)
+    history[key] = (history.get(key, [])+[summary])[-history_len:]
+    with open(fileName+'.tmp', 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(fileName+'.tmp', fileName)
+
+
+# Mean overheads of the previous runs of a kind of acquisition. Runs are weighted by their steps.
+# Without any previous runs there are no overheads and predictions are the nominal times
+def overheads(history, key):
+    runs = history.get(key, [])
+    steps = sum(run['steps'] for run in runs)
+    if steps == 0:
+        return {'setup': 0.0, 'step': 0.0, 'calls': {}, 'runs': 0}
+
+    calls = {}
+    for run in runs:
+        for name, seconds in run['calls'].items():
+            calls[name] = calls.get(name, 0.0)+seconds*run['steps']/steps
+    return {'setup': sum(run['setup'] for run in runs)/len(runs),
+            'step': sum(run['step']*run['steps'] for run in runs)/steps,
+            'calls': calls, 'runs': len(runs)}
+
+
+# Predicted duration of a run of num_steps steps
+def predict(num_steps, biasTime, biasInter, zeroVTime, zeroVInter, overheads):
+    return overheads['setup']+num_steps*(biasTime+biasInter+zeroVTime+zeroVInter+overheads['step'])
+
+
+# Bias and 0 V intermissions that fit a run into budget seconds. Both are shortened by the same
+# fraction, as little as possible. None if the run cannot fit even without intermissions
+def fit_budget(budget, num_steps, biasTime, biasInter, zeroVTime, zeroVInter, overheads):
+    predicted = predict(num_steps, biasTime, biasInter, zeroVTime, zeroVInter, overheads)
+    if predicted <= budget:
+        return biasInter, zeroVInter
+
+    waits = num_steps*(biasInter+zeroVInter)
+    if waits == 0 or predicted-waits > budget:
+        return None
+    fraction = (budget-(predicted-waits))/waits
+    return biasInter*fraction, zeroVInter*fraction
+
+
+# Hours, minutes and seconds
+def format_duration(seconds):
+    seconds = int(round(max(seconds, 0)))
+    return "{0}:{1:02d}:{2:02d}".format(seconds//3600, seconds//60%60, seconds%60)
+
+
+class RunClock(object):
+    """Live estimate of the time left in a run. Steps are predicted to take their nominal time
+    plus the overhead of previous runs until the run's own steps show otherwise."""
+
+    def __init__(self, num_steps, step_time, overheads):
+        self.num_steps = num_steps
+        self.step_time = step_time
+        self.overhead = overheads['step']
+        self.prior = prior_steps if overheads['runs'] > 0 else 0
+        self.taken = 0
+        self.total = 0.0
+
+    # Time a step took
+    def step(self, seconds):
+        self.taken += 1
+        self.total += seconds
+
+    # Seconds left
+    def remaining(self):
+        if self.taken+self.prior == 0:
+            step = self.step_time+self.overhead
+        else:
+            step = (self.total+self.prior*(self.step_time+self.overhead))/(self.taken+self.prior)
+        return (self.num_steps-self.taken)*step
+
+
+# Predict a simulated run from the timings of a previous one, then time it
+if __name__ == "__main__":
+
+    import shutil
+    import tempfile
+
+    import numpy as np
+
+    import sim_daq # Simulated instrument
+
+    num_steps = 20
+    biasTime, biasInter, zeroVTime, zeroVInter = 0.02, 0.005, 0.02, 0.005
+
+    def simulated_run(latencies):
+        start = time.perf_counter()
+        daq = TimedSession(sim_daq.SimulatedDAQ(), latencies)
+        daq.sync()
+        latencies.add('setup', time.perf_counter()-start)
+        clock = RunClock(num_steps, biasTime+biasInter+zeroVTime+zeroVInter, overheads(history, 'polled'))
+        for step in range(num_steps):
+            step_start = time.perf_counter()
+            daq.set([['/dev801/auxouts/0/offset', 0.1*step]])
+            time.sleep(biasInter)
+            daq.sync()
+            daq.subscribe('/dev801/demods/0/sample')
+            daq.poll(biasTime, 500, 0, True)
+            daq.unsubscribe('*')
+            daq.set([['/dev801/auxouts/0/offset', 0.0]])
+            time.sleep(zeroVInter)
+            daq.sync()
+            daq.subscribe('/dev801/demods/0/sample')
+            daq.poll(zeroVTime, 500, 0, True)
+            daq.unsubscribe('*')
+            elapsed = time.perf_counter()-step_start
+            latencies.add('step', elapsed-(biasTime+biasInter+zeroVTime+zeroVInter))
+            clock.step(elapsed)
+        return time.perf_counter()-start
+
+    directory = tempfile.mkdtemp()
+    try:
+        fileName = os.path.join(directory, timings_file)
+        history = load(fileName)
+
+        latencies = Latencies()
+        first = simulated_run(latencies)
+        record('polled', latencies.summary(), fileName)
+
+        history = load(fileName)
+        nominal = predict(num_steps, biasTime, biasInter, zeroVTime, zeroVInter, overheads({}, 'polled'))
+        predicted = predict(num_steps, biasTime, biasInter, zeroVTime, zeroVInter, overheads(history, 'polled'))
+        second = simulated_run(Latencies())
+
+        print("{0} steps".format(num_steps))
+        print("nominal (s)    predicted (s)    actual (s)")
+        print("{0:11.3f}    {1:13.3f}    {2:10.3f}".format(nominal, predicted, second))
+        print()
+        print("call           latency per step (ms)")
+        for name, seconds in sorted(overheads(history, 'polled')['calls'].items()):
+            print("{0:11s}    {1:21.3f}".format(name, 1000*seconds))
+
+        # Intermissions that fit the run into 90% of its predicted time
+        budget = 0.9*predicted
+        inters = fit_budget(budget, num_steps, biasTime, biasInter, zeroVTime, zeroVInter, overheads(history, 'polled'))
+        assert inters is not None
+        assert np.isclose(predict(num_steps, biasTime, inters[0], zeroVTime, inters[1], overheads(history, 'polled')), budget)
+        assert fit_budget(0.1*predicted, num_steps, biasTime, biasInter, zeroVTime, zeroVInter,
+                          overheads(history, 'polled')) is None
+        print()
+        print("budget {0}: bias wait {1:.2f} ms, 0 V wait {2:.2f} ms".format(format_duration(budget), 1000*inters[0], 1000*inters[1]))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Settling detection. After an offset change the demodulator output relaxes towards its new value.
+# Rather than waiting a fixed time, the demodulator is watched in short windows and the sample
+# is taken to have settled once the mean of a window is within an inaccuracy of the last, as the
+# sweeper's sweep/settling/inaccuracy does. X and Y are compared together, so both R and Phase
+# must have settled.
+
+import numpy as np
+
+import time # Benchmark timing
+
+window = 0.01 # Length of each window of demodulator samples polled [s]
+min_samples = 8 # Samples a window needs for its mean to be compared
+noise_sigmas = 3.0 # Changes within this many standard errors are noise
+
+
+class SettlingMonitor(object):
+    """Decides when the demodulator has settled after an offset change. Windows of samples are
+    added as they are polled. The sample has settled once the mean of a window differs from the
+    last by no more than inaccuracy relative to its magnitude, or by no more than the noise."""
+
+    def __init__(self, inaccuracy):
+        self.inaccuracy = inaccuracy
+        self._last = None # Mean and variance of the mean of the last window
+        self._pending = np.empty(0, dtype=np.complex128) # Samples too few to be a window
+
+    # Add polled samples. Returns whether the sample has settled
+    def add(self, x, y):
+        self._pending = np.concatenate((self._pending, np.asarray(x)+1j*np.asarray(y)))
+        if len(self._pending) < min_samples:
+            return False
+
+        samples, self._pending = self._pending, self._pending[:0]
+        mean = np.mean(samples)
+        var = np.var(samples)/len(samples)
+
+        settled = False
+        if self._last is not None:
+            last_mean, last_var = self._last
+            change = np.abs(mean-last_mean)
+            settled = change <= max(self.inaccuracy*np.abs(mean), noise_sigmas*np.sqrt(var+last_var))
+        self._last = (mean, var)
+        return settled
+
+
+# Wait for the sample to settle after an offset change by polling the demodulator at path.
+# Returns the time waited, which is never more than limit
+def wait(daq, path, limit, inaccuracy, poll_timeout=500):
+    start = time.perf_counter()
+    monitor = SettlingMonitor(inaccuracy)
+    daq.subscribe(path)
+    try:
+        while True:
+            remaining = limit-(time.perf_counter()-start)
+            if remaining <= 0:
+                break
+            data = daq.poll(min(window, remaining), poll_timeout, 0, True)
+            if path in data and monitor.add(data[path]['x'], data[path]['y']):
+                break
+    finally:
+        daq.unsubscribe(path)
+    return time.perf_counter()-start
+
+
+# Compare the time spent waiting for a simulated sample to settle with a fixed wait, and check
+# that the demodulator has settled to the inaccuracy once the wait is over
+if __name__ == "__main__":
+
+    import sim_daq # Simulated instrument
+
+    limit = 0.2 # Conservative fixed wait [s]
+    inaccuracy = 0.01
+    path = '/dev801/demods/0/sample'
+
+    daq = sim_daq.SimulatedDAQ(settle_tc=5e-3, noise=1e-5, seed=0)
+    daq.set([['/dev801/demods/0/enable', 1], ['/dev801/auxouts/0/outputselect', -1]])
+
+    print("settling tc (ms)    adaptive wait (ms)    fixed wait (ms)    error after wait")
+    for settle_tc in (2e-3, 5e-3, 20e-3):
+        daq.settle_tc = settle_tc
+        waited = []
+        errors = []
+        for offset in (0.5, -0.5, 1.0, 0.0):
+            daq.set([['/dev801/auxouts/0/offset', offset]])
+            waited.append(wait(daq, path, limit, inaccuracy))
+
+            # Compare the settled demodulator with where it ends up
+            daq.subscribe(path)
+            data = daq.poll(0.01, 500, 0, True)
+            time.sleep(limit)
+            settled = daq.poll(0.01, 500, 0, True)
+            daq.unsubscribe(path)
+            now = np.mean(data[path]['x']+1j*data[path]['y'])
+            final = np.mean(settled[path]['x']+1j*settled[path]['y'])
+            errors.append(np.abs(now-final)/np.abs(final))
+
+        print("{0:16.0f}    {1:18.1f}    {2:15.1f}    {3:16.4f}".format(
+            1000*settle_tc, 1000*np.mean(waited), 1000*limit, np.max(errors)))
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import numpy as np
+
+import bisect # Setting changes by time
+import fnmatch # Wildcard node paths
+import os # Environment switch for simulation
+import re
+import threading
+import time
+
+# Settings used for simulated instruments created by create_api_session. Change these
+# before connecting to simulate different demodulator rates, scope rates and latencies
+default_settings = {'clockbase': 210e6,   # Device clock [Hz]
+                    'demod_rate': 1.8e3,   # Demodulator sample rate [Sa/s]
+                    'scope_shot_rate': 10.0,   # Scope shots returned per second of polling
+                    'set_latency': 0.0,   # Time taken by set(...) [s]
+                    'sync_latency': 0.005,   # Round trip time of sync() [s]
+                    'poll_latency': 0.002,   # Overhead of poll(...) on top of its duration [s]
+                    'settle_tc': 5e-3,   # Time constant of the sample's response to a bias change [s]
+                    'stall_chance': 0.0,   # Probability that a demodulator poll stalls after 1 sample
+                    'noise': 1e-4,   # Demodulator noise [V]
+                    'seed': None}
+
+# Simulated instruments are kept for the lifetime of the process so that, like a real
+# device, their settings persist between sessions
+_devices = {}
+
+
+# Use the simulator in place of the data server if ZI_SIMULATE is set in the environment
+def simulating():
+    return os.environ.get('ZI_SIMULATE', '0') not in ('', '0')
+
+
+# Drop-in replacement for zhinst.utils.create_api_session that picks the real or simulated instrument
+def api_session(device_id, api_level, **kwargs):
+    if simulating():
+        return create_api_session(device_id, api_level, **kwargs)
+
+    import zhinst.utils
+    return zhinst.utils.create_api_session(device_id, api_level, **kwargs)
+
+
+# Drop-in replacement for zhinst.utils.default_output_mixer_channel. Simulated instruments are
+# HF2s, whose output mixer channels follow their 6 input channels
+def default_output_mixer_channel(props, output_channel=0):
+    if simulating():
+        return 6+output_channel
+
+    import zhinst.utils
+    return zhinst.utils.default_output_mixer_channel(props, output_channel)
+
+
+# Same signature and return values as zhinst.utils.create_api_session
+def create_api_session(device_id, api_level, required_devtype=None, required_options=None,
+                       required_err_msg='', **kwargs):
+
+    device = device_id.lower()
+    if not device in _devices:
+        settings = dict(default_settings)
+        settings.update(kwargs)
+        _devices[device] = SimulatedDAQ(device, **settings)
+
+    daq = _devices[device]
+    return (daq, device, daq.props)
+
+
+class SimulatedDAQ(object):
+    """In-process stand-in for a ziDAQServer session connected to an HF2LI. Demodulator
+    samples and scope shots are generated from a simple ferroelectric response to the
+    auxiliary output offsets, at the configured rates and with the configured latencies."""
+
+    shot_len = 2048 # HF2 scope shots have a fixed length
+
+    def __init__(self, device='dev801', clockbase=210e6, demod_rate=1.8e3, scope_shot_rate=10.0,
+                 set_latency=0.0, sync_latency=0.005, poll_latency=0.002, settle_tc=5e-3,
+                 stall_chance=0.0, noise=1e-4, seed=None, probe_aux=0, bot_elect_aux=1):
+
+        self.device = device
+        self.clockbase = clockbase
+        self.scope_shot_rate = scope_shot_rate
+        self.set_latency = set_latency
+        self.sync_latency = sync_latency
+        self.poll_latency = poll_latency
+        self.settle_tc = settle_tc
+        self.stall_chance = stall_chance
+        self.noise = noise
+        self.probe_aux = probe_aux
+        self.bot_elect_aux = bot_elect_aux
+        self.random = np.random.RandomState(seed)
+        self.props = {'deviceid': device, 'devicetype': 'HF2LI', 'options': ['MF', 'PLL', 'MOD'],
+                      'connected': True}
+
+        # Sample model: polarisation switches at +-coercive V and is read out by the demodulator
+        self.coercive = 2.0
+        self.switch_width = 0.3
+        self.piezo_amp = 1e-3
+        self.electrostatic = 2e-4
+        self.leakage = 5e-3
+        self.polarisation = -1.0
+
+        self._lock = threading.RLock()
+        self._t0 = time.time()
+
+        # Node tree
+        d = '/'+device
+        self.nodes = {d+'/clockbase': int(clockbase)}
+        for i in range(6):
+            self.nodes[d+'/demods/%d/enable' % i] = 0
+            self.nodes[d+'/demods/%d/trigger' % i] = 0
+            self.nodes[d+'/demods/%d/rate' % i] = demod_rate
+            self.nodes[d+'/demods/%d/timeconstant' % i] = 1e-3
+            self.nodes[d+'/demods/%d/order' % i] = 4
+            self.nodes[d+'/demods/%d/oscselect' % i] = 0
+            self.nodes[d+'/demods/%d/harmonic' % i] = 1
+            self.nodes[d+'/demods/%d/adcselect' % i] = 0
+            self.nodes[d+'/oscs/%d/freq' % i] = 300e3
+        for i in range(4):
+            self.nodes[d+'/auxouts/%d/offset' % i] = 0.0
+            self.nodes[d+'/auxouts/%d/outputselect' % i] = -1
+        for i in range(2):
+            self.nodes[d+'/sigins/%d/range' % i] = 1.0
+            self.nodes[d+'/sigins/%d/ac' % i] = 0
+            self.nodes[d+'/sigins/%d/diff' % i] = 0
+            self.nodes[d+'/sigouts/%d/on' % i] = 0
+            self.nodes[d+'/sigouts/%d/add' % i] = 0
+            self.nodes[d+'/sigouts/%d/range' % i] = 1.0
+            for j in range(8):
+                self.nodes[d+'/sigouts/%d/enables/%d' % (i, j)] = 0
+                self.nodes[d+'/sigouts/%d/amplitudes/%d' % (i, j)] = 0.0
+        self.nodes[d+'/scopes/0/enable'] = 0
+        self.nodes[d+'/scopes/0/channel'] = 0
+        self.nodes[d+'/scopes/0/trigchannel'] = -1
+        self.nodes[d+'/scopes/0/bwlimit'] = 0
+        self.nodes[d+'/scopes/0/time'] = 0
+
+        # History of setting changes as (timestamp, value) lists, used both for the
+        # sample's response and for subscriptions to setting nodes
+        self._history = {}
+
+        # Response of the sample after each bias change: timestamps, demod x, demod y, current.
+        # Grown as needed, with changes before any data still to be polled trimmed away
+        self._resp_ts = np.zeros(1024, dtype=np.int64)
+        self._resp = np.zeros((1024, 3))
+        self._resp_len = 1
+        self._resp[0] = self._response(0.0)
+
+        # Subscribed paths and the timestamp up to which their data has been returned
+        self._subscribed = {}
+
+    # Device time in clockbase ticks
+    def _now(self):
+        return int((time.time()-self._t0)*self.clockbase)
+
+    # Bias across the sample
+    def _bias(self):
+        d = '/'+self.device
+        return (self.nodes[d+'/auxouts/%d/offset' % self.probe_aux] -
+                self.nodes[d+'/auxouts/%d/offset' % self.bot_elect_aux])
+
+    # Update polarisation for a new bias and return the demodulator and current response
+    def _response(self, bias):
+        upper = np.tanh((bias+self.coercive)/self.switch_width)
+        lower = np.tanh((bias-self.coercive)/self.switch_width)
+        self.polarisation = min(max(self.polarisation, lower), upper)
+        return (self.piezo_amp*self.polarisation+self.electrostatic*bias,
+                0.05*self.piezo_amp*self.polarisation,
+                self.leakage*bias)
+
+    # Node paths matching a path that may contain wildcards
+    def _match(self, path):
+        path = path.lower()
+        if '*' in path:
+            return [node for node in self.nodes if fnmatch.fnmatchcase(node, path)]
+        return [path]
+
+    # Accepts set(path, value) or set([[path, value], ...]) like ziDAQServer
+    def set(self, settings, value=None):
+        if value is not None:
+            settings = [[settings, value]]
+
+        with self._lock:
+            timestamp = self._now()
+            bias = self._bias()
+            for path, val in settings:
+                for node in self._match(path):
+                    self.nodes[node] = val
+                    self._history.setdefault(node, []).append((timestamp, val))
+
+            # Record how the sample responds if the bias changed
+            if self._bias() != bias:
+                self._add_response(timestamp, self._response(self._bias()))
+
+        if self.set_latency:
+            time.sleep(self.set_latency)
+
+    def setInt(self, path, value):
+        self.set(path, int(value))
+
+    def setDouble(self, path, value):
+        self.set(path, float(value))
+
+    def getInt(self, path):
+        return int(self.nodes[path.lower()])
+
+    def getDouble(self, path):
+        return float(self.nodes[path.lower()])
+
+    # Read nodes with the timestamp of their last change
+    def get(self, paths, flat=False):
+        data = {}
+        with self._lock:
+            for path in paths.split(','):
+                for node in self._match(path.strip()):
+                    history = self._history.get(node, [(0, self.nodes[node])])
+                    data[node] = {'timestamp': np.array([history[-1][0]], dtype=np.uint64),
+                                  'value': np.array([history[-1][1]])}
+        return data if flat else self._nest(data)
+
+    # Wait for settings to take effect and discard data buffered by the API
+    def sync(self):
+        time.sleep(self.sync_latency)
+        with self._lock:
+            now = self._now()
+            for path in self._subscribed:
+                self._subscribed[path] = now
+
+    def subscribe(self, path):
+        with self._lock:
+            for node in self._match(path) if '*' in path else [path.lower()]:
+                if not node in self._subscribed:
+                    self._subscribed[node] = self._now()
+
+    def unsubscribe(self, path):
+        with self._lock:
+            for node in [node for node in self._subscribed if fnmatch.fnmatchcase(node, path.lower())]:
+                del self._subscribed[node]
+
+    # Record for duration seconds then return all data since subscribing or the last poll
+    def poll(self, duration, timeout=500, flags=0, flat=False):
+        time.sleep(duration+self.poll_latency)
+
+        data = {}
+        with self._lock:
+            end = self._now()
+            for path, start in self._subscribed.items():
+                chunk = self._generate(path, start, end)
+                if chunk is not None:
+                    data[path] = chunk
+                self._subscribed[path] = end
+            self._trim_responses()
+
+        return data if flat else self._nest(data)
+
+    # Data for a subscribed path between two device timestamps
+    def _generate(self, path, start, end):
+
+        demod = re.match(r'/[^/]+/demods/(\d+)/sample$', path)
+        if demod:
+            index = int(demod.group(1))
+            if not self.nodes['/%s/demods/%d/enable' % (self.device, index)]:
+                return None
+            return self._demod_sample(index, start, end)
+
+        if path == '/%s/scopes/0/wave' % self.device:
+            if not self.nodes['/%s/scopes/0/enable' % self.device]:
+                return None
+            return self._scope_shots(start, end)
+
+        # Setting nodes return their changes. Changes are in time order and (ts,) sorts before (ts, val)
+        history = self._history.get(path, [])
+        changes = history[bisect.bisect_left(history, (start,)):bisect.bisect_left(history, (end,))]
+        if not changes:
+            return None
+        return {'timestamp': np.array([ts for ts, val in changes], dtype=np.uint64),
+                'value': np.array([val for ts, val in changes])}
+
+    # Record the response to a bias change, doubling the history's capacity when it is full
+    def _add_response(self, timestamp, response):
+        if self._resp_len == len(self._resp_ts):
+            self._resp_ts = np.concatenate((self._resp_ts, np.zeros_like(self._resp_ts)))
+            self._resp = np.concatenate((self._resp, np.zeros_like(self._resp)))
+        self._resp_ts[self._resp_len] = timestamp
+        self._resp[self._resp_len] = response
+        self._resp_len += 1
+
+    # Forget bias changes before the oldest data still to be polled, keeping the change before it
+    # for the response to relax from. Only done once they are half the history, so each change is
+    # moved at most once on average
+    def _trim_responses(self):
+        oldest = min(self._subscribed.values()) if self._subscribed else self._now()
+        first = np.searchsorted(self._resp_ts[:self._resp_len], oldest, side='right')-2
+        if first > self._resp_len//2:
+            kept = self._resp_len-first
+            self._resp_ts[:kept] = self._resp_ts[first:self._resp_len]
+            self._resp[:kept] = self._resp[first:self._resp_len]
+            self._resp_len = kept
+
+    # Settled response at each timestamp, relaxing exponentially after every bias change
+    def _response_at(self, timestamps, component):
+        resp_ts = self._resp_ts[:self._resp_len]
+        target = self._resp[:self._resp_len, component]
+        idx = np.maximum(np.searchsorted(resp_ts, timestamps, side='right')-1, 0)
+        prev = target[np.maximum(idx-1, 0)]
+        elapsed = (timestamps-resp_ts[idx].astype(np.float64))/self.clockbase
+        return target[idx]+(prev-target[idx])*np.exp(-elapsed/self.settle_tc)
+
+    def _demod_sample(self, index, start, end):
+        rate = self.nodes['/%s/demods/%d/rate' % (self.device, index)]
+        ticks_per_sample = self.clockbase/rate
+
+        first = int(np.ceil(start/ticks_per_sample))
+        last = int(np.ceil(end/ticks_per_sample))
+        if self.stall_chance and self.random.rand() < self.stall_chance:
+            last = min(last, first+1)
+        timestamps = (np.arange(first, last)*ticks_per_sample).astype(np.uint64)
+
+        n = len(timestamps)
+        x = self._response_at(timestamps, 0)+self.noise*self.random.randn(n)
+        y = self._response_at(timestamps, 1)+self.noise*self.random.randn(n)
+        freq = self.nodes['/%s/oscs/%d/freq' % (self.device, self.nodes['/%s/demods/%d/oscselect' % (self.device, index)])]
+
+        return {'timestamp': timestamps, 'x': x, 'y': y,
+                'frequency': np.full(n, freq), 'phase': np.zeros(n),
+                'auxin0': np.zeros(n), 'auxin1': np.zeros(n), 'dio': np.zeros(n, dtype=np.uint32)}
+
+    # Key order matches what the CFM text parser expects: the wave is followed by bwlimit then dt
+    def _scope_shots(self, start, end):
+        d = '/'+self.device
+        dt = 2**self.nodes[d+'/scopes/0/time']/self.clockbase
+        shot_ticks = int(self.shot_len*dt*self.clockbase)
+        interval = max(int(self.clockbase/self.scope_shot_rate), shot_ticks)
+        sigin_range = self.nodes[d+'/sigins/%d/range' % (self.nodes[d+'/scopes/0/channel'] % 2)]
+
+        shots = []
+        for shot_start in range((start//interval+1)*interval, end-shot_ticks, interval):
+            timestamps = shot_start+np.arange(self.shot_len)*dt*self.clockbase
+            current = self._response_at(timestamps, 2)+self.noise*self.random.randn(self.shot_len)
+            wave = np.clip(np.round(current/sigin_range*2**15), -2**15, 2**15-1).astype(np.int16)
+            shots.append({'timestamp': shot_start+shot_ticks, 'wave': wave,
+                          'bwlimit': self.nodes[d+'/scopes/0/bwlimit'], 'dt': dt,
+                          'channel': self.nodes[d+'/scopes/0/channel'],
+                          'trigchannel': self.nodes[d+'/scopes/0/trigchannel']})
+        return shots
+
+    # Nested dictionaries reflecting node paths, as returned by poll without flat
+    @staticmethod
+    def _nest(data):
+        nested = {}
+        for path, value in data.items():
+            branch = nested
+            parts = path.strip('/').split('/')
+            for part in parts[:-1]:
+                branch = branch.setdefault(part, {})
+            branch[parts[-1]] = value
+        return nested
+
+    # Sweeper module
+    def sweep(self):
+        return SimulatedSweeper(self)
+
+
+class SimulatedSweeper(object):
+    """Stand-in for the ziDAQSweeper module. Sweeps are computed up front and reported
+    as finished once the time the real sweep would take has elapsed."""
+
+    def __init__(self, daq):
+        self.daq = daq
+        self.params = {'sweep/start': 1e3, 'sweep/stop': 1e6, 'sweep/samplecount': 100,
+                       'sweep/xmapping': 0, 'sweep/loopcount': 1, 'sweep/scan': 0,
+                       'sweep/settling/time': 0.0, 'sweep/settling/inaccuracy': 1e-3,
+                       'sweep/averaging/tc': 10, 'sweep/averaging/sample': 10,
+                       'sweep/gridnode': 'oscs/0/freq', 'sweep/device': daq.device}
+        self.paths = []
+        self.resonance = 300e3
+        self.q_factor = 100.0
+        self._start = None
+        self._duration = 0.0
+        self._data = {}
+
+    def set(self, path, value=None):
+        if value is None:
+            for setting in path:
+                self.params[setting[0]] = setting[1]
+        else:
+            self.params[path] = value
+
+    def get(self, path):
+        return {path: self.params[path]}
+
+    def subscribe(self, path):
+        self.paths.append(path.lower())
+
+    def unsubscribe(self, path):
+        self.paths = [p for p in self.paths if not fnmatch.fnmatchcase(p, path.lower())]
+
+    def execute(self):
+        p = self.params
+        num_points = int(p['sweep/samplecount'])
+        if int(p['sweep/xmapping']) == 1:
+            grid = np.logspace(np.log10(p['sweep/start']), np.log10(p['sweep/stop']), num_points)
+        else:
+            grid = np.linspace(p['sweep/start'], p['sweep/stop'], num_points)
+
+        # Time per point: settle then average, using the demodulator time constant
+        tc = self.daq.nodes['/%s/demods/0/timeconstant' % self.daq.device]
+        settle = max(p['sweep/settling/time'], -np.log(p['sweep/settling/inaccuracy'])*tc)
+        demod_rate = self.daq.nodes['/%s/demods/0/rate' % self.daq.device]
+        average = max(p['sweep/averaging/tc']*tc, p['sweep/averaging/sample']/demod_rate)
+        self._duration = int(p['sweep/loopcount'])*num_points*(settle+average)
+
+        self._data = {}
+        for path in self.paths:
+            loops = []
+            for loop in range(int(p['sweep/loopcount'])):
+                loops.append([self._sweep_sample(grid, tc, settle)])
+            self._data[path] = loops
+
+        self._start = time.time()
+
+    # Lorentzian resonance with the demodulator result keys of a real sweep
+    def _sweep_sample(self, grid, tc, settle):
+        n = len(grid)
+        noise = self.daq.noise*self.daq.random.randn(n)
+        response = 1.0/(1.0+2j*self.q_factor*(grid-self.resonance)/self.resonance)
+        x = self.daq.piezo_amp*response.real+noise
+        y = self.daq.piezo_amp*response.imag+noise
+        r = np.abs(x+1j*y)
+        phase = np.angle(x+1j*y)
+        zeros = np.zeros(n)
+        return {'grid': grid, 'x': x, 'y': y, 'r': r, 'phase': phase, 'frequency': grid,
+                'xstddev': np.full(n, self.daq.noise), 'ystddev': np.full(n, self.daq.noise),
+                'rstddev': np.full(n, self.daq.noise), 'phasestddev': self.daq.noise/np.maximum(r, 1e-12),
+                'frequencystddev': zeros, 'xpwr': x**2, 'ypwr': y**2, 'rpwr': r**2, 'phasepwr': phase**2,
+                'frequencypwr': grid**2, 'auxin0': zeros, 'auxin1': zeros, 'auxin0pwr': zeros,
+                'auxin1pwr': zeros, 'auxin0stddev': zeros, 'auxin1stddev': zeros,
+                'bandwidth': np.full(n, 1.0/(2*np.pi*tc)), 'tc': np.full(n, tc), 'tcmeas': np.full(n, tc),
+                'settling': np.full(n, settle), 'count': np.full(n, 10), 'settimestamp': zeros,
+                'nexttimestamp': zeros}
+
+    def progress(self):
+        if self._start is None or self._duration == 0:
+            return np.array([1.0])
+        return np.array([min(1.0, (time.time()-self._start)/self._duration)])
+
+    def finished(self):
+        return self._start is None or self.progress()[0] >= 1.0
+
+    def finish(self):
+        self._duration = 0.0
+
+    def read(self, flat=False):
+        return self._data if flat else SimulatedDAQ._nest(self._data)
+
+    def clear(self):
+        self._data = {}
+        self._start = None
+
+
+# Hardware-free throughput check: bias steps of a hysteresis train against the simulator
+if __name__ == "__main__":
+
+    (daq, device, props) = create_api_session('dev801', 1)
+    daq.set([['/%s/demods/0/enable' % device, 1], ['/%s/scopes/0/enable' % device, 1]])
+    daq.sync()
+
+    path = '/%s/demods/0/sample' % device
+    biases = np.concatenate((np.linspace(-5, 5, 11), np.linspace(5, -5, 11)))
+    start = time.time()
+    num_samples = 0
+    for bias in biases:
+        daq.set([['/%s/auxouts/0/offset' % device, bias], ['/%s/auxouts/1/offset' % device, 0]])
+        daq.sync()
+        daq.subscribe(path)
+        data = daq.poll(0.05, 500, 0, True)
+        daq.unsubscribe('*')
+        num_samples += len(data[path]['timestamp'])
+        print("Bias {0:+5.1f} V: X = {1:+.2e} V".format(bias, np.mean(data[path]['x'])))
+
+    elapsed = time.time()-start
+    print("{0} steps, {1} samples in {2:.2f} s ({3:.1f} ms/step overhead)".format(len(biases), num_samples,
+          elapsed, 1000*(elapsed/len(biases)-0.05)))
+
+    # Polls should cost the same however many bias changes came before them
+    daq.subscribe(path)
+    print("bias changes    poll (ms)")
+    changes = 0
+    for num_changes in (1000, 10000, 50000):
+        while changes < num_changes:
+            daq.set('/%s/auxouts/0/offset' % device, float(changes % 7))
+            changes += 1
+            if changes % 50 == 0:
+                daq.poll(0)
+        start = time.perf_counter()
+        for i in range(100):
+            daq.poll(0)
+        print("{0:12d}    {1:9.3f}".format(num_changes, 1000*(time.perf_counter()-start)/100-1000*daq.poll_latency))
+    daq.unsubscribe('*')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Stall handling for polled measurement windows. A window is polled in short sub-polls so that a
+# stalled demodulator is noticed early. Data that has arrived is kept and only the remainder of
+# the window is polled again. A window is given up on once its stalled sub-polls have taken a fixed
+# time, so stalls cost a step at most that much longer than planned.
+
+import numpy as np
+
+import time # Benchmark timing
+
+sub_poll = 0.05 # Longest sub-poll [s]
+stall_fraction = 0.1 # Sub-polls returning less than this fraction of their samples are stalled
+stall_limit = 0.5 # Time spent in stalled sub-polls before a window is given up on [s]
+
+
+class StallStats(object):
+    """Stalled sub-polls and the time spent in them for each step of a run."""
+
+    def __init__(self):
+        self.steps = []
+
+    def start_step(self):
+        self.steps.append([0, 0.0])
+
+    def add(self, seconds):
+        if not self.steps:
+            self.start_step()
+        self.steps[-1][0] += 1
+        self.steps[-1][1] += seconds
+
+    def summary(self):
+        stalls = [stalls for stalls, seconds in self.steps]
+        times = [seconds for stalls, seconds in self.steps]
+        return {'steps': len(self.steps), 'stalledSteps': sum(1 for count in stalls if count > 0),
+                'stalls': sum(stalls), 'stallTime': sum(times), 'worstStep': max(times, default=0.0)}
+
+
+# Append polled data to data: demodulator samples are concatenated and scope shots extended
+def _merge(data, polled):
+    for path, node in polled.items():
+        if not path in data:
+            data[path] = node
+        elif isinstance(node, list):
+            data[path] = data[path]+node
+        else:
+            data[path] = {key: np.concatenate((data[path][key], value)) if np.ndim(value) == 1 else value
+                          for key, value in node.items()}
+
+
+# Poll paths for duration seconds of demodulator samples at rate, the first path being the
+# demodulator. trim, if given, is applied to each sub-poll. Returns the data of all the sub-polls
+# in a flat dictionary
+def poll_window(daq, paths, duration, rate, stats, poll_timeout=500, poll_flags=0, trim=None):
+    for path in paths:
+        daq.subscribe(path)
+
+    data = {}
+    collected = 0
+    stalled = 0.0
+    try:
+        while True:
+            remaining = duration-collected/rate
+            if remaining < 0.5/rate:
+                break
+
+            length = min(sub_poll, remaining)
+            start = time.perf_counter()
+            polled = daq.poll(length, poll_timeout, poll_flags, True)
+            if trim is not None:
+                polled = trim(polled)
+            _merge(data, polled)
+
+            samples = len(polled[paths[0]]['timestamp']) if paths[0] in polled else 0
+            collected += samples
+            if samples < stall_fraction*length*rate:
+                stalled += time.perf_counter()-start
+                stats.add(time.perf_counter()-start)
+                if stalled >= stall_limit:
+                    break
+    finally:
+        daq.unsubscribe('*')
+
+    return data
+
+
+# Compare windows polled with the fixed retries of whole windows this replaces on a simulated
+# demodulator that stalls
+if __name__ == "__main__":
+
+    import sim_daq # Simulated instrument
+
+    duration = 0.2
+    path = '/dev801/demods/0/sample'
+    daq = sim_daq.SimulatedDAQ(seed=0)
+    daq.set([['/dev801/demods/0/enable', 1]])
+    rate = daq.getDouble('/dev801/demods/0/rate')
+
+    def retried_window():
+        tries = 0
+        sample = {'timestamp': []}
+        while tries < 10 and len(sample['timestamp']) <= 1:
+            tries += 1
+            daq.subscribe(path)
+            sample = daq.poll(duration, 500, 0, True)[path]
+            daq.unsubscribe('*')
+        return sample
+
+    print("stall chance    retried: mean (ms)  worst (ms)  samples    sub-polled: mean (ms)  worst (ms)  samples")
+    for stall_chance in (0.0, 0.2, 0.5, 0.8):
+        daq.stall_chance = stall_chance
+        results = []
+        for window in (retried_window, lambda: poll_window(daq, [path], duration, rate, StallStats())[path]):
+            times = []
+            samples = []
+            for repeat in range(20):
+                start = time.perf_counter()
+                sample = window()
+                times.append(time.perf_counter()-start)
+                samples.append(len(sample['timestamp']))
+            results += [1000*np.mean(times), 1000*np.max(times), np.mean(samples)]
+        print("{0:12.1f}    {1:18.1f}  {2:10.1f}  {3:7.0f}    {4:21.1f}  {5:10.1f}  {6:7.0f}".format(stall_chance, *results))
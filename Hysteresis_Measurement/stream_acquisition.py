@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import warnings
+
+class StreamAcquisition(object):
+    """Continuous acquisition for a whole hysteresis run. The demodulator (and scope) are
+    subscribed once and polled back to back, so no data is lost between polls. The stream
+    is split into bias and 0 V segments using the device timestamps of the auxiliary
+    output offset changes, which are subscribed to alongside the data."""
+
+    fields = ('timestamp', 'x', 'y')
+    offset_tolerance = 1e-3 # Offsets read back from the device are quantized. They match values set within this [V]
+    event_wait = 1.0 # Data streamed past an offset change before giving up on its event [s]
+
+    def __init__(self, daq, device, demod_index, probeAux, botElectAux, scope=False,
+                 poll_timeout=500, poll_flags=0):
+        self.daq = daq
+        self.demod_path = '/%s/demods/%d/sample' % (device, demod_index)
+        self.scope_path = '/%s/scopes/0/wave' % device if scope else None
+        self.offset_paths = ('/%s/auxouts/%d/offset' % (device, probeAux),
+                             '/%s/auxouts/%d/offset' % (device, botElectAux))
+        self.poll_timeout = poll_timeout
+        self.poll_flags = poll_flags
+
+        # The clockbase does not change during a run so only read it once
+        self.clockbase = float(daq.getInt('/%s/clockbase' % device))
+
+        self._chunks = {field: [] for field in self.fields}
+        self._shots = []
+        self._events = {path: [] for path in self.offset_paths}
+        self._steps = [] # Steps waiting for the data that ends them
+        self._last_ts = None # Latest demodulator timestamp received
+        self._set = None # Offsets last set, to tell which changes must produce events
+        self._emitted_ts = None # Times of the next completed step are relative to this
+
+    # Subscribe to everything needed for the run
+    def start(self):
+        self.daq.unsubscribe('*')
+        self.daq.subscribe(self.demod_path)
+        if self.scope_path:
+            self.daq.subscribe(self.scope_path)
+        for path in self.offset_paths:
+            self.daq.subscribe(path)
+        self._set = [self.daq.getDouble(path) for path in self.offset_paths]
+
+        # Clear anything buffered before the run starts
+        self.daq.sync()
+
+    def stop(self):
+        self.daq.unsubscribe('*')
+
+    # Poll and buffer everything that has arrived since the last poll
+    def poll(self, duration):
+        data = self.daq.poll(duration, self.poll_timeout, self.poll_flags, True)
+
+        if self.demod_path in data:
+            sample = data[self.demod_path]
+            for field in self.fields:
+                self._chunks[field].append(np.asarray(sample[field]))
+            if len(sample['timestamp']) > 0:
+                self._last_ts = int(sample['timestamp'][-1])
+
+        if self.scope_path and self.scope_path in data:
+            self._shots.extend(data[self.scope_path])
+
+        for path in self.offset_paths:
+            if path in data:
+                self._events[path].extend(zip(data[path]['timestamp'], data[path]['value']))
+
+        # Offset changes made before this poll are now in the event buffers
+        for step in self._steps:
+            for change in (step['bias'], step['zero']):
+                if change is not None:
+                    change['polled'] = True
+
+    # Set the offsets, remembering which data had already arrived when they were set and which
+    # offsets were left unchanged
+    def apply(self, probeOffset, botElectOffset):
+        self.daq.set([[self.offset_paths[0], probeOffset],
+                      [self.offset_paths[1], botElectOffset]])
+        values = (probeOffset, botElectOffset)
+        unchanged = tuple(abs(value-old) <= self.offset_tolerance for value, old in zip(values, self._set))
+        self._set = list(values)
+        return {'values': values, 'unchanged': unchanged, 'after': self._last_ts,
+                'polled': False, 'timestamp': None}
+
+    # Apply a bias then 0 V, polling through the intermissions so the stream has no gaps.
+    # Returns the steps whose data is complete, which lag the step just taken by one step. Each
+    # is returned with the index it was taken with, e.g. its place in the run's schedule
+    def step(self, probeOffset, botElectOffset, biasTime, zeroVTime, biasInter, zeroVInter, index=None):
+
+        step = {'offsets': (probeOffset, botElectOffset), 'biasTime': biasTime, 'zeroVTime': zeroVTime,
+                'biasInter': biasInter, 'zeroVInter': zeroVInter, 'zero': None, 'index': index}
+
+        step['bias'] = self.apply(probeOffset, botElectOffset)
+        self._steps.append(step)
+        if biasInter+biasTime > 0:
+            self.poll(biasInter+biasTime)
+
+        if zeroVTime+zeroVInter > 0:
+            step['zero'] = self.apply(0, 0)
+            if zeroVInter+zeroVTime > 0:
+                self.poll(zeroVInter+zeroVTime)
+
+        return self.completed()
+
+    # Collect what the steps taken so far streamed before the run is held between steps
+    def hold(self):
+        self.poll(0)
+
+    # Drop what was streamed while the run was held, which belongs to no step
+    def release(self):
+        self.daq.sync()
+
+    # Collect the remaining data and return the steps it completes
+    def finish(self):
+        self.poll(0)
+        return self.completed(final=True)
+
+    # Device timestamp of the first event setting an offset node to value after a timestamp
+    def _event(self, path, value, after):
+        for ts, val in self._events[path]:
+            if ts > after and abs(val-value) <= self.offset_tolerance:
+                return int(ts)
+        return None
+
+    # Device timestamp of an offset change: the later of the two offset node events. None while
+    # the event of an offset it changed has yet to arrive
+    def _resolve(self, change, final=False):
+        if change['timestamp'] is None and change['polled']:
+            after = -1 if change['after'] is None else change['after']
+            found = []
+            missing = False
+            for path, value, unchanged in zip(self.offset_paths, change['values'], change['unchanged']):
+                ts = self._event(path, value, after)
+                if ts is not None:
+                    found.append(ts)
+                elif not unchanged:
+                    missing = True
+
+            # An offset that changed is waited for until the stream is well past it
+            if missing:
+                waited = self._last_ts is not None and self._last_ts-after > self.event_wait*self.clockbase
+                if not (final or waited):
+                    return None
+                warnings.warn("No event was streamed for the change of offsets to %s. Its segment starts at "
+                              "the first sample after it was set" % (change['values'],))
+
+            # Setting an unchanged value may not produce an event. The offset is then
+            # unchanged, so start from the first sample that arrived after setting it
+            change['timestamp'] = max(found) if found else after+1
+
+            # Older events can no longer match a change
+            for path in self.offset_paths:
+                self._events[path] = [(ts, val) for ts, val in self._events[path] if ts > change['timestamp']]
+
+        return change['timestamp']
+
+    # Steps that can be split into segments now that their end has been streamed
+    def completed(self, final=False):
+        steps = []
+        while self._steps:
+            step = self._steps[0]
+            bias_ts = self._resolve(step['bias'], final)
+            zero_ts = self._resolve(step['zero'], final) if step['zero'] is not None else None
+            if bias_ts is None or (step['zero'] is not None and zero_ts is None):
+                break
+
+            # A step ends where the next one's bias is applied
+            if len(self._steps) > 1:
+                end_ts = self._resolve(self._steps[1]['bias'], final)
+                if end_ts is None or self._last_ts is None or self._last_ts < end_ts:
+                    break
+            elif final:
+                end_ts = (self._last_ts if self._last_ts is not None else bias_ts)+1
+            else:
+                break
+
+            steps.append(self._split(step, bias_ts, zero_ts, end_ts))
+            self._steps.pop(0)
+
+        return steps
+
+    # Take a step's data out of the buffers and split it into bias and 0 V segments, returned
+    # along with the step's index
+    def _split(self, step, bias_ts, zero_ts, end_ts):
+
+        data = {}
+        for field in self.fields:
+            data[field] = np.concatenate(self._chunks[field]) if self._chunks[field] else np.empty((0))
+        ts = data['timestamp'].astype(np.int64)
+
+        # Leave data belonging to later steps in the buffers
+        keep = ts >= end_ts
+        for field in self.fields:
+            self._chunks[field] = [data[field][keep]]
+
+        shots = [shot for shot in self._shots if int(shot['timestamp']) < end_ts]
+        self._shots = [shot for shot in self._shots if int(shot['timestamp']) >= end_ts]
+
+        if self._emitted_ts is None:
+            self._emitted_ts = bias_ts
+
+        # Segments start once the intermission after their offset change is over
+        bias_end = zero_ts if zero_ts is not None else end_ts
+        windows = {'bias': (bias_ts+step['biasInter']*self.clockbase, bias_end, step['biasTime'], step['offsets']),
+                   'zero': (None if zero_ts is None else zero_ts+step['zeroVInter']*self.clockbase, end_ts,
+                            step['zeroVTime'], (0, 0))}
+
+        segments = {'index': step['index']}
+        for name, (start, end, duration, offsets) in windows.items():
+            if start is None or duration == 0:
+                segments[name] = None
+                continue
+
+            # A segment lasts its bias or 0 V time, however long the run is held before the next change
+            end = min(end, start+duration*self.clockbase)
+            mask = (ts >= start) & (ts < end)
+            segment = {field: data[field][mask] for field in self.fields}
+            segment['t'] = (ts[mask]-self._emitted_ts)/self.clockbase
+            segment['probeOffset'], segment['botElectOffset'] = offsets
+            segment['shots'] = [shot for shot in shots if start <= int(shot['timestamp']) < end]
+            segments[name] = segment
+
+        emitted = [segments[name]['timestamp'] for name in windows
+                   if segments[name] is not None and len(segments[name]['timestamp'])]
+        if emitted:
+            self._emitted_ts = int(np.max(np.concatenate(emitted)))
+
+        return segments
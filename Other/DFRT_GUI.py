@@ -9,7 +9,6 @@ Created on Thu Jul  6 10:57:40 2017
 from __future__ import print_function
 import time
 import numpy as np
-import zhinst.utils
 
 # For graphical user interface
 import tkinter as tk
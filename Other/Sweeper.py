@@ -9,7 +9,14 @@ Created on Thu Jul  6 10:57:40 2017
 from __future__ import print_function
 import time
 import numpy as np
-import zhinst.utils
+
+# Shared instrument modules live with the hysteresis measurement code
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Hysteresis_Measurement'))
+import device_session # Long-lived device sessions
+import run_average # Vectorised averaging over repeated values
+import sweep_job # Sweeps without the GUI
 
 # For graphical user interface
 import tkinter as tk
@@ -38,27 +45,17 @@ class SweepGUI(tk.Frame):
         
         # Intrinsic parameters
         self.deviceID = 'dev801'
-        self.sweepDir = ('Sequential', 'Binary', 'Bidirectional', 'Reverse')
-        self.sweepOver = ('Freq', 'Phase', 'TC', 'Amplitude', 'Aux Offset', 'PID Setpoint')
-        self.osc = ('1', '2', '3', '4', '5', '6')
+        self.sweepDir = sweep_job.sweepDir
+        self.sweepOver = sweep_job.sweepOver
+        self.osc = sweep_job.osc
         
         # Measurements to sample
-        self.sweepBadNames = ('r', 'auxin1', 'auxin0pwr', 'bandwidth', 'auxin0', 'ypwr', 'auxin0stddev', 
-                            'settimestamp', 'xpwr', 'rstddev', 'frequency', 'x', 'auxin1pwr', 'tcmeas', 
-                            'grid', 'tc', 'auxin1stddev', 'nexttimestamp', 'rpwr', 'xstddev', 'phasepwr', 
-                            'count', 'ystddev', 'settling', 'frequencypwr', 'y', 'frequencystddev', 'phase', 
-                            'phasestddev')
+        self.sweepBadNames = sweep_job.sweepBadNames
         # Nicer names for sweep sample
-        self.sweepSample = ('R', 'Aux In 1', 'Aux In 0 Power', 'Bandwidth', 'Aux In 0', 'Y Power', 'Aux In 0 Std Dev',
-                          'Set Timestamp', 'X Power', 'R Std Dev', 'Frequency', 'X', 'Aux In 1 Power', 'TC Meas',
-                          'Grid', 'TC', 'Aux In 1 Std Dev', 'Next Timestamp', 'R Power', 'X Std Dev', 'Phase Power',
-                          'Count', 'Y Std Dev', 'Settling', 'Frequency Power', 'Y', 'Freq Std Dev', 'Phase',
-                          'Phase Std Dev')
+        self.sweepSample = sweep_job.sweepSample
         
         # Make dictionary to look up nice name for bad name from
-        self.naughtyToNice = {}
-        for i in range(len(self.sweepSample)):
-            self.naughtyToNice[self.sweepBadNames[i]] = self.sweepSample[i]
+        self.naughtyToNice = sweep_job.naughtyToNice
 
         
         # Dictionary storing measurements
@@ -365,34 +362,17 @@ class SweepGUI(tk.Frame):
         
         
         # Check that entries are correctly formatted; assume they are within physical bounds
-        try:
-            startEntry = float(self.startEntry.get())
-        except ValueError:
-            errText.insert(tk.END, "Start is not a float\n")
-            
-        try:
-            endEntry = float(self.endEntry.get())
-        except ValueError:
-            errText.insert(tk.END, "End is not a float\n")
-            
-        try:
-            numPointsEntry = int(self.numPointsEntry.get())
-        except ValueError:
-            errText.insert(tk.END, "Num Points is not an int\n")
-            
-        if not self.sweepDirEntry.get() in self.sweepDir:
-            errText.insert(tk.END, "Sweep Direction is not in "+str(self.sweepDir)+"\n")
-            
-        if not self.sweepOverEntry.get() in self.sweepOver:
-            errText.insert(tk.END, "Sweep Over is not in "+str(self.sweepOver)+"\n")
-        
-        if not self.oscEntry.get() in self.osc:
-            errText.insert(tk.END, "Oscillator not in "+str(self.osc)+"\n")
-            
-        try:
-            numLoopsEntry = int(self.numLoopsEntry.get())
-        except ValueError:
-            errText.insert(tk.END, "Num Loops is not an int\n")
+        job = {'start': self.startEntry.get(),
+               'end': self.endEntry.get(),
+               'numPoints': self.numPointsEntry.get(),
+               'sweepDir': self.sweepDirEntry.get(),
+               'logSweep': self.logSweep.get(),
+               'sweepOver': self.sweepOverEntry.get(),
+               'osc': self.oscEntry.get(),
+               'sync': self.sync.get(),
+               'numLoops': self.numLoopsEntry.get()}
+        for error in sweep_job.check(job):
+            errText.insert(tk.END, error)
             
         if not self.plotxEntry.get() in self.sweepSample:
             errText.insert(tk.END, "Horizontal Axis not in "+str(self.sweepSample)+"\n")
@@ -405,16 +385,7 @@ class SweepGUI(tk.Frame):
             errDialogueBox.destroy()
             
             # Prepare measurement parameter array to be passed to hyst_meas
-            sweepParam = [None]*9
-            sweepParam[0] = startEntry
-            sweepParam[1] = endEntry
-            sweepParam[2] = numPointsEntry
-            sweepParam[3] = self.sweepDirEntry.get()
-            sweepParam[4] = str(self.logSweep.get())
-            sweepParam[5] = self.sweepOverEntry.get()
-            sweepParam[6] = self.oscEntry.get()
-            sweepParam[7] = str(self.sync.get())
-            sweepParam[8] = numLoopsEntry
+            sweepParam = sweep_job.sweep_param(job)
             
             self.sweep_meas(self.deviceID, sweepParam, 0.1)
         
@@ -480,190 +451,7 @@ class SweepGUI(tk.Frame):
             
             
     def sweep_meas(self, device_id, sweepParam, amplitude):
-        
-        # Measurement parameters
-        startVal = float(sweepParam[0])
-        endVal = float(sweepParam[1])
-        numPoints = int(sweepParam[2])
-        sweepDir = sweepParam[3]
-        logSweep = int(sweepParam[4])
-        sweepOver = sweepParam[5]
-        osc = int(sweepParam[6])
-        sync = int(sweepParam[7])
-        numLoops = int(sweepParam[8])
-
-
-        if sweepDir == 'Sequential':
-            sweepDirVal = 0
-        elif sweepDir == 'Binary':
-            sweepDirVal = 1
-        elif sweepDir == 'Bidirectional':
-            sweepDirVal = 2
-        elif sweepDir == 'Reverse':
-            sweepDirVal = 3
-
-        
-        apilevel_example = 5  # The API level supported by this example.
-        # Call a zhinst utility function that returns:
-        # - an API session `daq` in order to communicate with devices via the data server.
-        # - the device ID string that specifies the device branch in the server's node hierarchy.
-        # - the device's discovery properties.
-        err_msg = "This example only supports instruments with demodulators."
-        (daq, device, props) = zhinst.utils.create_api_session(device_id, apilevel_example,
-                                                               required_devtype='.*LI|.*IA|.*IS',
-                                                               required_err_msg=err_msg)
-    
-        # Create a base instrument configuration: disable all outputs, demods and scopes.
-        general_setting = [['/%s/demods/*/enable' % device, 0],
-                           ['/%s/demods/*/trigger' % device, 0],
-                           ['/%s/sigouts/*/enables/*' % device, 0],
-                           ['/%s/scopes/*/enable' % device, 0]]
-        if 'IA' in props['options']:
-            general_setting.append(['/%s/imps/*/enable' % device, 0])
-        daq.set(general_setting)
-        # Perform a global synchronisation between the device and the data server:
-        # Ensure that the settings have taken effect on the device before setting
-        # the next configuration.
-        daq.sync()
-    
-        # Now configure the instrument for this experiment. The following channels
-        # and indices work on all device configurations. The values below may be
-        # changed if the instrument has multiple input/output channels and/or either
-        # the Multifrequency or Multidemodulator options installed.
-        out_channel = 0
-        out_mixer_channel = zhinst.utils.default_output_mixer_channel(props)
-        in_channel = 0
-        demod_index = 0
-        demod_rate = 10e3
-        time_constant = 0.01
-        exp_setting = [['/%s/sigins/%d/ac'             % (device, in_channel), 0],
-                       ['/%s/sigins/%d/range'          % (device, in_channel), 2*amplitude],
-                       ['/%s/demods/%d/enable'         % (device, demod_index), 1],
-                       ['/%s/demods/%d/rate'           % (device, demod_index), demod_rate],
-                       ['/%s/demods/%d/adcselect'      % (device, demod_index), in_channel],
-                       ['/%s/demods/%d/order'          % (device, demod_index), 4],
-                       ['/%s/demods/%d/timeconstant'   % (device, demod_index), time_constant],
-                       ['/%s/demods/%d/oscselect'      % (device, demod_index), osc],
-                       ['/%s/demods/%d/harmonic'       % (device, demod_index), 1],
-                       ['/%s/sigouts/%d/on'            % (device, out_channel), 1],
-                       ['/%s/sigouts/%d/enables/%d'    % (device, out_channel, out_mixer_channel), 1],
-                       ['/%s/sigouts/%d/range'         % (device, out_channel), 1],
-                       ['/%s/sigouts/%d/amplitudes/%d' % (device, out_channel, out_mixer_channel), amplitude]]
-        # Some other device-type dependent configuration may be required. For
-        # example, disable the signal inputs `diff` and the signal outputs `add` for
-        # HF2 instruments.
-        if props['devicetype'].startswith('HF2'):
-            exp_setting.append(['/%s/sigins/%d/diff'      % (device, in_channel), 0])
-            exp_setting.append(['/%s/sigouts/%d/add'      % (device, out_channel), 0])
-        daq.set(exp_setting)
-    
-        # Create an instance of the Sweeper Module (ziDAQSweeper class).
-        sweeper = daq.sweep()
-    
-        # Configure the Sweeper Module's parameters.
-        # Set the device that will be used for the sweep - this parameter must be set.
-        sweeper.set('sweep/device', device)
-        # Specify the `gridnode`: The instrument node that we will sweep, the device
-        # setting corresponding to this node path will be changed by the sweeper.
-        if sweepOver == 'Freq':
-            sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
-        elif sweepOver == 'Phase':
-            sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
-        elif sweepOver == 'TC':
-            sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
-        elif sweepOver == 'Amplitude':
-            sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
-        elif sweepOver == 'Aux Offset':
-            sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
-        elif sweepOver == 'PID Setpoint':
-            sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
-        
-        # Set the `start` and `stop` values of the gridnode value interval we will use in the sweep.
-        sweeper.set('sweep/start', startVal)
-        sweeper.set('sweep/stop', endVal)
-        
-        # Set the number of points to use for the sweep, the number of gridnode
-        # setting values will use in the interval (`start`, `stop`).
-        sweeper.set('sweep/samplecount', numPoints)
-        
-        sweeper.set('sweep/xmapping', logSweep)
-        # Automatically control the demodulator bandwidth/time constants used.
-        # 0=manual, 1=fixed, 2=auto
-        # Note: to use manual and fixed, sweep/bandwidth has to be set to a value > 0.
-        sweeper.set('sweep/bandwidthcontrol', 2)
-        # Sets the bandwidth overlap mode (default 0). If enabled, the bandwidth of
-        # a sweep point may overlap with the frequency of neighboring sweep
-        # points. The effective bandwidth is only limited by the maximal bandwidth
-        # setting and omega suppression. As a result, the bandwidth is independent
-        # of the number of sweep points. For frequency response analysis bandwidth
-        # overlap should be enabled to achieve maximal sweep speed (default: 0). 0 =
-        # Disable, 1 = Enable.
-        sweeper.set('sweep/bandwidthoverlap', 0)
-    
-        # Sequential scanning mode (as opposed to binary or bidirectional).
-        sweeper.set('sweep/scan', sweepDirVal)
-        # Specify the number of sweeps to perform back-to-back.
-        sweeper.set('sweep/loopcount', numLoops)
-        # We don't require a fixed sweep/settling/time since there is no DUT
-        # involved in this example's setup (only a simple feedback cable), so we set
-        # this to zero. We need only wait for the filter response to settle,
-        # specified via sweep/settling/inaccuracy.
-        sweeper.set('sweep/settling/time', 0)
-        # The sweep/settling/inaccuracy' parameter defines the settling time the
-        # sweeper should wait before changing a sweep parameter and recording the next
-        # sweep data point. The settling time is calculated from the specified
-        # proportion of a step response function that should remain. The value
-        # provided here, 0.001, is appropriate for fast and reasonably accurate
-        # amplitude measurements. For precise noise measurements it should be set to
-        # ~100n.
-        # Note: The actual time the sweeper waits before recording data is the maximum
-        # time specified by sweep/settling/time and defined by
-        # sweep/settling/inaccuracy.
-        sweeper.set('sweep/settling/inaccuracy', 0.001)
-        # Set the minimum time to record and average data to 10 demodulator
-        # filter time constants.
-        sweeper.set('sweep/averaging/tc', 10)
-        # Minimal number of samples that we want to record and average is 100. Note,
-        # the number of samples used for averaging will be the maximum number of
-        # samples specified by either sweep/averaging/tc or sweep/averaging/sample.
-        sweeper.set('sweep/averaging/sample', 10)
-        # Sets up sinc filter
-        sweeper.set('sweep/sincfilter', sync)
-    
-        # Now subscribe to the nodes from which data will be recorded. Note, this is
-        # not the subscribe from ziDAQServer; it is a Module subscribe. The Sweeper
-        # Module needs to subscribe to the nodes it will return data for.x
-        path = '/%s/demods/%d/sample' % (device, demod_index)
-        sweeper.subscribe(path)
-    
-        # Start the Sweeper's thread
-        sweeper.execute()
-
-        while not sweeper.finished():  # Wait until the sweep is complete
-            time.sleep(0.2)
-
-        
-        # Read the sweep data. This command can also be executed whilst sweeping
-        # (before finished() is True), in this case sweep data up to that time point
-        # is returned. It's still necessary still need to issue read() at the end to
-        # fetch the rest.
-        return_flat_dict = True
-        data = sweeper.read(return_flat_dict)
-        sweeper.unsubscribe(path)
-        
-        # Stop the sweeper thread and clear the memory.
-        sweeper.clear()
-    
-        # Check the dictionary returned is non-empty.
-        assert data, "read() returned an empty data dictionary, did you subscribe to any paths?"
-        # Note: data could be empty if no data arrived, e.g., if the demods were
-        # disabled or had rate 0.
-        assert path in data, "No sweep data in data dictionary: it has no key '%s'" % path
-        samples = data[path]
-        assert len(samples) == numLoops, \
-            "The sweeper returned an unexpected number of sweeps: `%d`. Expected: `%d`." % (len(samples), numLoops)
-                        
-        self.record_meas(samples)
+        self.record_meas(sweep_job.sweep(device_id, sweepParam, amplitude))
             
             
     # Record all relevant measurements in dictionary        
@@ -742,48 +530,7 @@ class SweepGUI(tk.Frame):
        
     # Average over repeated x values. Can average over y by passing x and y the other way around
     def avg_xrepeats(self, x, y):
-        
-        avgedx, avgedy = np.empty((0)), np.empty((0))
-        
-        total = 0
-        start, end = 0, 1   # Average between y[start] and y[end] so x and y have same lengths
-        
-        prevx = x[0]
-        avgedx = np.append(avgedx, prevx)
-
-        # If the next value of x is not the same as the previous, add it to the array
-        for i in range(1, len(x)):
-            if x[i] == prevx:
-                end += 1
-                    
-                # Check if this is the last element of the array
-                if i == len(x)-1:
-                    avgedx = np.append(avgedx, prevx)
-                        
-                    for j in range(start, end):
-                        total += x[i]
-                    avgedy = np.append(avgedy, total/(end-start))
-                        
-                    total = 0
-                    
-            else:
-                avgedx = np.append(avgedx, prevx)
-                prevx = x[i]
-                    
-                for j in range(start, end):
-                    total += y[j]
-                avgedy = np.append(avgedy, total/(end-start))
-                    
-                total = 0
-                start, end = i, i+1
-                    
-                # Check if this is the last element of the array
-                if i == len(x)-1:
-                    avgedx = np.append(avgedx, x[i])
-                    avgedy = np.append(avgedy, y[i])    
-                    
-        print(len(x), len(y), len(avgedx), len(avgedy))
-        return avgedx, avgedy
+        return run_average.avg_xrepeats(x, y)
             
 if __name__ == "__main__":
     sweepGUI = tk.Tk()
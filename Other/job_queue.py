@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+# Persistent queue of measurement jobs, run back to back on one device. Hysteresis, sweep and
+# PFM setup jobs are added to a JSON queue file, which outlives the runs, and a scheduler takes
+# them highest priority first, in the order they were added within a priority. Every job goes
+# through the device's shared session, so settings already in effect from the job before are not
+# sent again. Each job's results go to its own file in the results directory unless it names one.
+#
+#   python job_queue.py add hysteresis '{"probeMaxDC": 2}' --priority 1
+#   python job_queue.py add sweep '{"start": 10, "end": 100, ...}'
+#   python job_queue.py list
+#   python job_queue.py pause / resume / cancel 3
+#   python job_queue.py run --device dev801 [--wait]
+#
+# Pausing holds a running hysteresis job at 0 V before its next step, and any other job once it
+# ends. Hysteresis jobs are checkpointed, so those cut short by a crash are resumed from their
+# last step when the queue is run again; other jobs cut short are run again from the start.
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import errno
+import json
+import os
+import shutil
+import sys
+
+# Shared instrument modules live with the hysteresis measurement code
+hyst_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Hysteresis_Measurement')
+sys.path.append(hyst_dir)
+import device_session # Long-lived device sessions
+import hyst_batch # Headless hysteresis runs
+import hyst_file # Binary columnar run files
+import hyst_job # Settings of hysteresis jobs
+import pfm_job # Normal PFM setup without the GUI
+import sweep_job # Sweeps without the GUI
+
+import time # Benchmark timing
+
+defaultQueue = 'measurement_queue.json'
+kinds = ('hysteresis', 'sweep', 'pfm')
+states = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+lock_timeout = 10.0 # Locks older than this [s] are taken to be left by a crashed process
+watch_interval = 1.0 # Time between checks of the queue file during a hysteresis run [s]
+
+
+# Hold the queue file's lock while reading and rewriting it
+@contextlib.contextmanager
+def locked(fileName):
+    lockName = fileName+'.lock'
+    while True:
+        try:
+            fd = os.open(lockName, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            try:
+                if time.time()-os.path.getmtime(lockName) > lock_timeout:
+                    os.remove(lockName)
+            except OSError:
+                pass
+            time.sleep(0.01)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        os.remove(lockName)
+
+
+# Contents of a queue file. A missing file is an empty queue
+def load(fileName):
+    if not os.path.exists(fileName):
+        return {'paused': False, 'next_id': 1, 'jobs': []}
+    with open(fileName, 'r') as f:
+        return json.load(f)
+
+
+# Replace a queue file's contents, so that it is never left half written
+def save(fileName, contents):
+    tmpName = fileName+'.tmp'
+    with open(tmpName, 'w') as f:
+        json.dump(contents, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpName, fileName)
+
+
+# Read, change and rewrite a queue file. Yields its contents to be changed in place
+@contextlib.contextmanager
+def editing(fileName):
+    with locked(fileName):
+        contents = load(fileName)
+        yield contents
+        save(fileName, contents)
+
+
+# Job of a queue by id
+def find(contents, job_id):
+    for job in contents['jobs']:
+        if job['id'] == job_id:
+            return job
+    raise KeyError("No job "+str(job_id)+" in the queue")
+
+
+# Settings of a job with any left out taken from the defaults of its kind
+def settings(job):
+    if job['kind'] == 'hysteresis':
+        return hyst_job.make(job['settings'], hyst_job.defaults(os.path.join(hyst_dir, hyst_job.defaultFile)))
+    return dict(job['settings'])
+
+
+# Problems with a job's settings that stop it being run
+def check(kind, job_settings):
+    if not kind in kinds:
+        return ["Job kind is not in "+str(kinds)+"\n"]
+
+    job = settings({'kind': kind, 'settings': job_settings})
+    if kind == 'hysteresis':
+        return hyst_job.check(job)
+    if kind == 'sweep':
+        return sweep_job.check(job)
+    return pfm_job.check(job)
+
+
+# Add a checked job to a queue. Returns its id
+def add(fileName, kind, job_settings, priority=0):
+    errors = check(kind, job_settings)
+    if errors:
+        raise ValueError("".join(errors))
+
+    with editing(fileName) as contents:
+        job_id = contents['next_id']
+        contents['next_id'] += 1
+        contents['jobs'].append({'id': job_id, 'kind': kind, 'priority': priority, 'settings': job_settings,
+                                 'state': 'queued', 'result': None, 'error': None, 'added': time.time(),
+                                 'started': None, 'finished': None, 'sent': 0, 'skipped': 0})
+    return job_id
+
+
+# Cancel a job. A running hysteresis job stops after its current step
+def cancel(fileName, job_id):
+    with editing(fileName) as contents:
+        job = find(contents, job_id)
+        if job['state'] in ('queued', 'running'):
+            job['state'] = 'cancelled'
+
+
+def set_paused(fileName, paused):
+    with editing(fileName) as contents:
+        contents['paused'] = paused
+
+
+# Queued job to run next, if any: the highest priority, then the first added
+def next_job(contents):
+    queued = [job for job in contents['jobs'] if job['state'] == 'queued']
+    return min(queued, key=lambda job: (-job['priority'], job['id'])) if queued else None
+
+
+# File a job's results are written to
+def result_file(job, results):
+    if job['kind'] == 'hysteresis':
+        recordTo = job['settings'].get('recordTo', "")
+        return recordTo if recordTo != "" else os.path.join(results, "job_"+str(job['id'])+hyst_file.extension)
+    if job['kind'] == 'sweep':
+        return os.path.join(results, "job_"+str(job['id'])+hyst_file.extension)
+    return os.path.join(results, "job_"+str(job['id'])+".json")
+
+
+# Hysteresis job as run from a queue: recorded to its result file and checkpointed, resuming from
+# its checkpoint if it was cut short before
+def hysteresis_job(job, results, rerun):
+    run_job = settings(job)
+    run_job['recordTo'] = result_file(job, results)
+    if run_job['checkpointTo'] == "":
+        run_job['checkpointTo'] = os.path.join(results, "job_"+str(job['id'])+".ckpt")
+    run_job['resume'] = 1 if rerun and os.path.exists(run_job['checkpointTo']) else 0
+
+    # Resumed runs replay their checkpointed samples, so a result file of the queue's own is
+    # started afresh rather than left holding the run that was cut short
+    if job['settings'].get('recordTo', "") == "" and os.path.isdir(run_job['recordTo']):
+        shutil.rmtree(run_job['recordTo'])
+    return run_job
+
+
+# Pause, resume or cancel a running hysteresis job as the queue file says
+class Watcher(object):
+    """Checks the queue file at most every watch_interval while a hysteresis job runs and pauses,
+    resumes or cancels its worker to match."""
+
+    def __init__(self, fileName, job_id, report):
+        self.fileName = fileName
+        self.job_id = job_id
+        self.report = report
+        self.checked = time.perf_counter()
+
+    def __call__(self, worker):
+        if time.perf_counter()-self.checked < watch_interval:
+            return
+        self.checked = time.perf_counter()
+
+        with locked(self.fileName):
+            contents = load(self.fileName)
+        if find(contents, self.job_id)['state'] == 'cancelled' and not worker.cancelled():
+            self.report("Cancelling after the current step")
+            worker.cancel()
+        elif contents['paused'] and not worker.paused():
+            self.report("Paused at 0 V")
+            worker.pause()
+        elif not contents['paused'] and worker.paused():
+            self.report("Resumed")
+            worker.resume()
+
+
+# Run a job, writing its results. Returns its result file
+def run_job(fileName, device_id, job, results, rerun=False, report=print):
+    resultName = result_file(job, results)
+    job_settings = settings(job)
+
+    if job['kind'] == 'hysteresis':
+        run_settings = hysteresis_job(job, results, rerun)
+        hyst_batch.run(device_id, run_settings, report, Watcher(fileName, job['id'], report))
+    elif job['kind'] == 'sweep':
+        samples = sweep_job.sweep(device_id, sweep_job.sweep_param(job_settings))
+        hyst_file.save(resultName, sweep_job.columns(samples),
+                       attributes={'device': device_id, 'kind': 'sweep', 'settings': job_settings})
+    else:
+        pfm_job.configure(device_id, pfm_job.pfm_param(job_settings))
+        with open(resultName, 'w') as f:
+            json.dump({'device': device_id, 'kind': 'pfm', 'settings': job_settings, 'configured': time.time()},
+                      f, indent=1)
+
+    return resultName
+
+
+# Run queued jobs until there are none left, or, if wait, until interrupted. Jobs left running by
+# an earlier scheduler that did not finish them are queued again first. Returns whether every job
+# that was run succeeded
+def run(fileName, device_id, results=None, wait=False, report=print):
+    results = results or os.path.join(os.path.dirname(os.path.abspath(fileName)), 'results')
+    if not os.path.isdir(results):
+        os.makedirs(results)
+
+    with editing(fileName) as contents:
+        rerun = set()
+        for job in contents['jobs']:
+            if job['state'] == 'running':
+                job['state'] = 'queued'
+                rerun.add(job['id'])
+
+    succeeded = True
+    said_paused = False
+    while True:
+        with editing(fileName) as contents:
+            job = None if contents['paused'] else next_job(contents)
+            if job is not None:
+                job['state'] = 'running'
+                job['started'] = time.time()
+            paused = contents['paused']
+
+        if job is None:
+            if paused and not said_paused:
+                report("Queue paused")
+            said_paused = paused
+            if not paused and not wait:
+                return succeeded
+            time.sleep(watch_interval)
+            continue
+        said_paused = False
+
+        prefix = "Job {0} ({1}): ".format(job['id'], job['kind'])
+        job_report = lambda message: report(prefix+message)
+        sent, skipped = device_session.counts(device_id)
+        start = time.perf_counter()
+        error = None
+        try:
+            resultName = run_job(fileName, device_id, job, results, job['id'] in rerun, job_report)
+        except KeyboardInterrupt:
+            # Left running, to be picked up again by the next scheduler
+            raise
+        except Exception as err:
+            error = err
+            resultName = None
+            device_session.forget(device_id)
+        now_sent, now_skipped = device_session.counts(device_id)
+
+        with editing(fileName) as contents:
+            done = find(contents, job['id'])
+            if done['state'] == 'running':
+                done['state'] = 'done' if error is None else 'failed'
+            done['result'] = resultName
+            done['error'] = None if error is None else str(error)
+            done['finished'] = time.time()
+            done['sent'] = max(now_sent-sent, 0)
+            done['skipped'] = max(now_skipped-skipped, 0)
+            state = done['state']
+
+        if error is None:
+            job_report("{0} in {1:.1f} s to {2}, {3} settings sent and {4} already in effect".format(
+                state, time.perf_counter()-start, resultName, done['sent'], done['skipped']))
+        else:
+            job_report("failed: "+str(error))
+            succeeded = False
+
+
+# Table of a queue's jobs
+def table(contents):
+    lines = ["{0:>4} {1:<11} {2:>8} {3:<10} {4}".format('Id', 'Kind', 'Priority', 'State', 'Result')]
+    for job in sorted(contents['jobs'], key=lambda job: job['id']):
+        lines.append("{0:>4} {1:<11} {2:>8} {3:<10} {4}".format(job['id'], job['kind'], job['priority'], job['state'],
+                                                                job['error'] or job['result'] or ""))
+    if contents['paused']:
+        lines.append("Paused")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue measurement jobs and run them on one device")
+    parser.add_argument('--queue', default=defaultQueue, help="Queue file")
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('add', help="Queue a job")
+    command.add_argument('kind', choices=kinds)
+    command.add_argument('settings', help="JSON settings by name, or a file holding them")
+    command.add_argument('--priority', type=int, default=0, help="Higher priorities are run first")
+    commands.add_parser('list', help="List the queue's jobs")
+    commands.add_parser('pause', help="Pause the queue")
+    commands.add_parser('resume', help="Resume the queue")
+    command = commands.add_parser('cancel', help="Cancel a job")
+    command.add_argument('id', type=int)
+    command = commands.add_parser('run', help="Run queued jobs")
+    command.add_argument('--device', default=hyst_batch.default_device, help="Device to measure with")
+    command.add_argument('--results', help="Result file directory. Defaults to results beside the queue file")
+    command.add_argument('--wait', action='store_true', help="Wait for more jobs once the queue is empty")
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        if os.path.exists(args.settings):
+            with open(args.settings, 'r') as f:
+                job_settings = json.load(f)
+        else:
+            job_settings = json.loads(args.settings)
+        try:
+            print("Queued job", add(args.queue, args.kind, job_settings, args.priority))
+        except ValueError as err:
+            sys.stderr.write(str(err))
+            return 1
+    elif args.command == 'list':
+        print(table(load(args.queue)))
+    elif args.command in ('pause', 'resume'):
+        set_paused(args.queue, args.command == 'pause')
+    elif args.command == 'cancel':
+        try:
+            cancel(args.queue, args.id)
+        except KeyError as err:
+            sys.stderr.write(str(err)+"\n")
+            return 1
+    elif args.command == 'run':
+        try:
+            return 0 if run(args.queue, args.device, args.results, args.wait) else 1
+        except KeyboardInterrupt:
+            return 130
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Normal PFM setup without the GUI. A PFM job is a dictionary of the Normal PFM Setup's settings
+# by name. The instrument is configured through the device's shared session, so settings already
+# in effect are not sent again. Nothing here needs Tk or matplotlib.
+
+from __future__ import print_function
+import time
+
+# Shared instrument modules live with the hysteresis measurement code
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Hysteresis_Measurement'))
+import device_session # Long-lived device sessions
+import sim_daq # Simulated instrument for hardware-free runs
+
+# Device parameters
+demods = ('1', '2', '3', '4', '5', '6')
+outVoltRange = ('10 mV', '100 mV', '1 V', '10 V')
+outVoltRangeToVolt = {'10 mV': 0.01, '100 mV': 0.1, '1 V': 1.0, '10 V': 10.0}
+inputs = ('1', '2')
+outputs = ('1', '2')
+
+# Settings of a setup, in the order of its parameters
+fields = ('input', 'inVoltRange', 'output', 'outVoltRange', 'demod', 'demodFreq', 'filterInput', 'filterdBOct',
+          'filterTC', 'demodX', 'demodY', 'auxOutX', 'auxOutY', 'auxXScale', 'auxYScale', 'auxX', 'auxY')
+
+
+# Check the settings that configure the instrument. Returns a line describing each problem
+def check(job):
+    errors = ["PFM setup has no "+name+" setting\n" for name in fields if not name in job]
+    if errors:
+        return errors
+
+    if not str(job['input']) in inputs:
+        errors.append("Input is not in "+str(inputs)+"\n")
+
+    if not str(job['output']) in outputs:
+        errors.append("Output is not in "+str(outputs)+"\n")
+
+    if not str(job['outVoltRange']) in outVoltRange:
+        errors.append("Output range is not in "+str(outVoltRange)+"\n")
+
+    if not str(job['demod']) in demods:
+        errors.append("Demodulator is not in "+str(demods)+"\n")
+
+    for name, label in (('inVoltRange', "Input range"), ('demodFreq', "Demodulator frequency"),
+                        ('filterdBOct', "Filter order"), ('filterTC', "Filter time constant")):
+        try:
+            float(job[name])
+        except ValueError:
+            errors.append(label+" is not a float\n")
+
+    return errors
+
+
+# Setup parameters of a checked job, as passed to configure
+def pfm_param(job):
+    return [str(job[name]) for name in fields]
+
+
+# Configure apparatus
+def configure(device, pfmParam):
+
+    # Measurement parameters
+    inputChan = int(pfmParam[0])-1
+    inVoltRange = float(pfmParam[1])
+    outputChan = int(pfmParam[2])-1
+    outVoltRange = outVoltRangeToVolt[pfmParam[3]]
+    demod = int(pfmParam[4])
+    demodFreq = float(pfmParam[5])*1000
+    filterInput = pfmParam[6]
+    filterdBOct = int(int(pfmParam[7])/6)
+    filterTC = float(pfmParam[8])
+    demodX = pfmParam[9]
+    demodY = pfmParam[10]
+    auxOutX = pfmParam[11]
+    auxOutY = pfmParam[12]
+    auxXScale = pfmParam[13]
+    auxYScale = pfmParam[14]
+    auxX = pfmParam[15]
+    auxY = pfmParam[16]
+
+    apilevel_example = 5  # The API level supported by this example.
+    # Call a zhinst utility function that returns:
+    # - an API session `daq` in order to communicate with devices via the data server.
+    # - the device ID string that specifies the device branch in the server's node hierarchy.
+    # - the device's discovery properties.
+    err_msg = "This example only supports instruments with demodulators."
+    (daq, device, props) = device_session.api_session(device, apilevel_example,
+                                                      required_devtype='.*LI|.*IA|.*IS',
+                                                      required_err_msg=err_msg)
+
+    # Create a base instrument configuration: disable all outputs, demods and scopes.
+    general_setting = [['/%s/demods/*/enable' % device, 0],
+                       ['/%s/demods/*/trigger' % device, 0],
+                       ['/%s/sigouts/*/enables/*' % device, 0],
+                       ['/%s/scopes/*/enable' % device, 0]]
+    if 'IA' in props['options']:
+        general_setting.append(['/%s/imps/*/enable' % device, 0])
+    daq.set(general_setting)
+    # Perform a global synchronisation between the device and the data server:
+    # Ensure that the settings have taken effect on the device before setting
+    # the next configuration.
+    daq.sync()
+
+    # Now configure the instrument for this experiment. The following channels
+    # and indices work on all device configurations. The values below may be
+    # changed if the instrument has multiple input/output channels and/or either
+    # the Multifrequency or Multidemodulator options installed.
+    out_channel = 0
+    out_mixer_channel = sim_daq.default_output_mixer_channel(props)
+    in_channel = 0
+    demod_index = 0
+    osc_index = 0
+    demod_rate = 10e3
+    time_constant = 1e-6
+    exp_setting = [['/%s/sigins/%d/range'          % (device, inputChan), inVoltRange],
+                   ['/%s/sigouts/%d/on'            % (device, outputChan), 1],
+                   ['/%s/sigouts/%d/range'         % (device, outputChan), outVoltRange],
+                   ['/%s/sigins/%d/diff'           % (device, inputChan), 0],
+                   ['/%s/demods/%d/enable'         % (device, demod), 1]]
+
+
+                   #['/%s/sigins/%d/ac'             % (device, in_channel), 0]]
+                   #['/%s/demods/%d/rate'           % (device, demod_index), demod_rate],
+                   #['/%s/demods/%d/adcselect'      % (device, demod_index), in_channel],
+                   #['/%s/demods/%d/harmonic'       % (device, demod_index), 1],
+                   #['/%s/sigouts/%d/enables/%d'    % (device, out_channel, out_mixer_channel), 1]]
+
+                   #['/%s/pids/%d/demod/adcselect'  % (device, demod), 0],
+                   #['/%s/pids/%d/demod/order'      % (device, demod), filterdBOct],
+                   #['/%s/pidss/%d/demod/timeconstant'   % (device, demod), filterTC],
+                   #['/%s/demods/%d/freq'           % (device, demod), demodFreq],
+
+    daq.set(exp_setting)
+
+    # Wait for the demodulator filter to settle.
+    time.sleep(10*time_constant)
+
+    # Perform a global synchronisation between the device and the data server:
+    # Ensure that the settings have taken effect on the device before issuing
+    # the getSample() command. Note: the sync() must be issued after waiting for
+    # the demodulator filter to settle above.
+    daq.sync()
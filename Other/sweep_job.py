@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+# Sweeps without the GUI. A sweep job is a dictionary of the Sweeper's settings by name. Jobs
+# are checked by the Sweeper's rules, then swept with the sweeper module through the device's
+# shared session, so a sweep run from the Sweeper or a job queue configures the instrument the
+# same way. Nothing here needs Tk or matplotlib.
+
+from __future__ import print_function
+import time
+import numpy as np
+
+# Shared instrument modules live with the hysteresis measurement code
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Hysteresis_Measurement'))
+import device_session # Long-lived device sessions
+import sim_daq # Simulated instrument for hardware-free runs
+
+sweepDir = ('Sequential', 'Binary', 'Bidirectional', 'Reverse')
+sweepOver = ('Freq', 'Phase', 'TC', 'Amplitude', 'Aux Offset', 'PID Setpoint')
+osc = ('1', '2', '3', '4', '5', '6')
+
+# Measurements to sample
+sweepBadNames = ('r', 'auxin1', 'auxin0pwr', 'bandwidth', 'auxin0', 'ypwr', 'auxin0stddev',
+                 'settimestamp', 'xpwr', 'rstddev', 'frequency', 'x', 'auxin1pwr', 'tcmeas',
+                 'grid', 'tc', 'auxin1stddev', 'nexttimestamp', 'rpwr', 'xstddev', 'phasepwr',
+                 'count', 'ystddev', 'settling', 'frequencypwr', 'y', 'frequencystddev', 'phase',
+                 'phasestddev')
+# Nicer names for sweep sample
+sweepSample = ('R', 'Aux In 1', 'Aux In 0 Power', 'Bandwidth', 'Aux In 0', 'Y Power', 'Aux In 0 Std Dev',
+               'Set Timestamp', 'X Power', 'R Std Dev', 'Frequency', 'X', 'Aux In 1 Power', 'TC Meas',
+               'Grid', 'TC', 'Aux In 1 Std Dev', 'Next Timestamp', 'R Power', 'X Std Dev', 'Phase Power',
+               'Count', 'Y Std Dev', 'Settling', 'Frequency Power', 'Y', 'Freq Std Dev', 'Phase',
+               'Phase Std Dev')
+naughtyToNice = dict(zip(sweepBadNames, sweepSample))
+
+# Settings of a sweep, in the order of its parameters
+fields = ('start', 'end', 'numPoints', 'sweepDir', 'logSweep', 'sweepOver', 'osc', 'sync', 'numLoops')
+
+amplitude = 0.1 # Drive amplitude [V]
+
+
+# Check that settings are correctly formatted; assume they are within physical bounds. Returns
+# a line describing each problem
+def check(job):
+    errors = ["Sweep has no "+name+" setting\n" for name in fields if not name in job]
+    if errors:
+        return errors
+
+    try:
+        float(job['start'])
+    except ValueError:
+        errors.append("Start is not a float\n")
+
+    try:
+        float(job['end'])
+    except ValueError:
+        errors.append("End is not a float\n")
+
+    try:
+        int(job['numPoints'])
+    except ValueError:
+        errors.append("Num Points is not an int\n")
+
+    if not str(job['sweepDir']) in sweepDir:
+        errors.append("Sweep Direction is not in "+str(sweepDir)+"\n")
+
+    if not str(job['sweepOver']) in sweepOver:
+        errors.append("Sweep Over is not in "+str(sweepOver)+"\n")
+
+    if not str(job['osc']) in osc:
+        errors.append("Oscillator not in "+str(osc)+"\n")
+
+    try:
+        int(job['numLoops'])
+    except ValueError:
+        errors.append("Num Loops is not an int\n")
+
+    return errors
+
+
+# Measurement parameters of a checked job, as passed to sweep
+def sweep_param(job):
+    sweepParam = [None]*9
+    sweepParam[0] = float(job['start'])
+    sweepParam[1] = float(job['end'])
+    sweepParam[2] = int(job['numPoints'])
+    sweepParam[3] = str(job['sweepDir'])
+    sweepParam[4] = str(job['logSweep'])
+    sweepParam[5] = str(job['sweepOver'])
+    sweepParam[6] = str(job['osc'])
+    sweepParam[7] = str(job['sync'])
+    sweepParam[8] = int(job['numLoops'])
+    return sweepParam
+
+
+# Sweep with the sweeper module. Returns the sweeps of the demodulator, one per loop
+def sweep(device_id, sweepParam, amplitude=amplitude):
+
+    # Measurement parameters
+    startVal = float(sweepParam[0])
+    endVal = float(sweepParam[1])
+    numPoints = int(sweepParam[2])
+    sweepDir = sweepParam[3]
+    logSweep = int(sweepParam[4])
+    sweepOver = sweepParam[5]
+    osc = int(sweepParam[6])
+    sync = int(sweepParam[7])
+    numLoops = int(sweepParam[8])
+
+
+    if sweepDir == 'Sequential':
+        sweepDirVal = 0
+    elif sweepDir == 'Binary':
+        sweepDirVal = 1
+    elif sweepDir == 'Bidirectional':
+        sweepDirVal = 2
+    elif sweepDir == 'Reverse':
+        sweepDirVal = 3
+
+
+    apilevel_example = 5  # The API level supported by this example.
+    # Call a zhinst utility function that returns:
+    # - an API session `daq` in order to communicate with devices via the data server.
+    # - the device ID string that specifies the device branch in the server's node hierarchy.
+    # - the device's discovery properties.
+    err_msg = "This example only supports instruments with demodulators."
+    (daq, device, props) = device_session.api_session(device_id, apilevel_example,
+                                                      required_devtype='.*LI|.*IA|.*IS',
+                                                      required_err_msg=err_msg)
+
+    # Create a base instrument configuration: disable all outputs, demods and scopes.
+    general_setting = [['/%s/demods/*/enable' % device, 0],
+                       ['/%s/demods/*/trigger' % device, 0],
+                       ['/%s/sigouts/*/enables/*' % device, 0],
+                       ['/%s/scopes/*/enable' % device, 0]]
+    if 'IA' in props['options']:
+        general_setting.append(['/%s/imps/*/enable' % device, 0])
+    daq.set(general_setting)
+    # Perform a global synchronisation between the device and the data server:
+    # Ensure that the settings have taken effect on the device before setting
+    # the next configuration.
+    daq.sync()
+
+    # Now configure the instrument for this experiment. The following channels
+    # and indices work on all device configurations. The values below may be
+    # changed if the instrument has multiple input/output channels and/or either
+    # the Multifrequency or Multidemodulator options installed.
+    out_channel = 0
+    out_mixer_channel = sim_daq.default_output_mixer_channel(props)
+    in_channel = 0
+    demod_index = 0
+    demod_rate = 10e3
+    time_constant = 0.01
+    exp_setting = [['/%s/sigins/%d/ac'             % (device, in_channel), 0],
+                   ['/%s/sigins/%d/range'          % (device, in_channel), 2*amplitude],
+                   ['/%s/demods/%d/enable'         % (device, demod_index), 1],
+                   ['/%s/demods/%d/rate'           % (device, demod_index), demod_rate],
+                   ['/%s/demods/%d/adcselect'      % (device, demod_index), in_channel],
+                   ['/%s/demods/%d/order'          % (device, demod_index), 4],
+                   ['/%s/demods/%d/timeconstant'   % (device, demod_index), time_constant],
+                   ['/%s/demods/%d/oscselect'      % (device, demod_index), osc],
+                   ['/%s/demods/%d/harmonic'       % (device, demod_index), 1],
+                   ['/%s/sigouts/%d/on'            % (device, out_channel), 1],
+                   ['/%s/sigouts/%d/enables/%d'    % (device, out_channel, out_mixer_channel), 1],
+                   ['/%s/sigouts/%d/range'         % (device, out_channel), 1],
+                   ['/%s/sigouts/%d/amplitudes/%d' % (device, out_channel, out_mixer_channel), amplitude]]
+    # Some other device-type dependent configuration may be required. For
+    # example, disable the signal inputs `diff` and the signal outputs `add` for
+    # HF2 instruments.
+    if props['devicetype'].startswith('HF2'):
+        exp_setting.append(['/%s/sigins/%d/diff'      % (device, in_channel), 0])
+        exp_setting.append(['/%s/sigouts/%d/add'      % (device, out_channel), 0])
+    daq.set(exp_setting)
+
+    # Create an instance of the Sweeper Module (ziDAQSweeper class).
+    sweeper = daq.sweep()
+
+    # Configure the Sweeper Module's parameters.
+    # Set the device that will be used for the sweep - this parameter must be set.
+    sweeper.set('sweep/device', device)
+    # Specify the `gridnode`: The instrument node that we will sweep, the device
+    # setting corresponding to this node path will be changed by the sweeper.
+    if sweepOver == 'Freq':
+        sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
+    elif sweepOver == 'Phase':
+        sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
+    elif sweepOver == 'TC':
+        sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
+    elif sweepOver == 'Amplitude':
+        sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
+    elif sweepOver == 'Aux Offset':
+        sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
+    elif sweepOver == 'PID Setpoint':
+        sweeper.set('sweep/gridnode', 'oscs/%d/freq' % osc)
+
+    # Set the `start` and `stop` values of the gridnode value interval we will use in the sweep.
+    sweeper.set('sweep/start', startVal)
+    sweeper.set('sweep/stop', endVal)
+
+    # Set the number of points to use for the sweep, the number of gridnode
+    # setting values will use in the interval (`start`, `stop`).
+    sweeper.set('sweep/samplecount', numPoints)
+
+    sweeper.set('sweep/xmapping', logSweep)
+    # Automatically control the demodulator bandwidth/time constants used.
+    # 0=manual, 1=fixed, 2=auto
+    # Note: to use manual and fixed, sweep/bandwidth has to be set to a value > 0.
+    sweeper.set('sweep/bandwidthcontrol', 2)
+    # Sets the bandwidth overlap mode (default 0). If enabled, the bandwidth of
+    # a sweep point may overlap with the frequency of neighboring sweep
+    # points. The effective bandwidth is only limited by the maximal bandwidth
+    # setting and omega suppression. As a result, the bandwidth is independent
+    # of the number of sweep points. For frequency response analysis bandwidth
+    # overlap should be enabled to achieve maximal sweep speed (default: 0). 0 =
+    # Disable, 1 = Enable.
+    sweeper.set('sweep/bandwidthoverlap', 0)
+
+    # Sequential scanning mode (as opposed to binary or bidirectional).
+    sweeper.set('sweep/scan', sweepDirVal)
+    # Specify the number of sweeps to perform back-to-back.
+    sweeper.set('sweep/loopcount', numLoops)
+    # We don't require a fixed sweep/settling/time since there is no DUT
+    # involved in this example's setup (only a simple feedback cable), so we set
+    # this to zero. We need only wait for the filter response to settle,
+    # specified via sweep/settling/inaccuracy.
+    sweeper.set('sweep/settling/time', 0)
+    # The sweep/settling/inaccuracy' parameter defines the settling time the
+    # sweeper should wait before changing a sweep parameter and recording the next
+    # sweep data point. The settling time is calculated from the specified
+    # proportion of a step response function that should remain. The value
+    # provided here, 0.001, is appropriate for fast and reasonably accurate
+    # amplitude measurements. For precise noise measurements it should be set to
+    # ~100n.
+    # Note: The actual time the sweeper waits before recording data is the maximum
+    # time specified by sweep/settling/time and defined by
+    # sweep/settling/inaccuracy.
+    sweeper.set('sweep/settling/inaccuracy', 0.001)
+    # Set the minimum time to record and average data to 10 demodulator
+    # filter time constants.
+    sweeper.set('sweep/averaging/tc', 10)
+    # Minimal number of samples that we want to record and average is 100. Note,
+    # the number of samples used for averaging will be the maximum number of
+    # samples specified by either sweep/averaging/tc or sweep/averaging/sample.
+    sweeper.set('sweep/averaging/sample', 10)
+    # Sets up sinc filter
+    sweeper.set('sweep/sincfilter', sync)
+
+    # Now subscribe to the nodes from which data will be recorded. Note, this is
+    # not the subscribe from ziDAQServer; it is a Module subscribe. The Sweeper
+    # Module needs to subscribe to the nodes it will return data for.x
+    path = '/%s/demods/%d/sample' % (device, demod_index)
+    sweeper.subscribe(path)
+
+    # Start the Sweeper's thread
+    sweeper.execute()
+
+    while not sweeper.finished():  # Wait until the sweep is complete
+        time.sleep(0.2)
+
+
+    # Read the sweep data. This command can also be executed whilst sweeping
+    # (before finished() is True), in this case sweep data up to that time point
+    # is returned. It's still necessary still need to issue read() at the end to
+    # fetch the rest.
+    return_flat_dict = True
+    data = sweeper.read(return_flat_dict)
+    sweeper.unsubscribe(path)
+
+    # Stop the sweeper thread and clear the memory.
+    sweeper.clear()
+
+    # The sweeper module changed the swept node without the session
+    daq.invalidate('/%s/oscs/%d/freq' % (device, osc))
+
+    # Check the dictionary returned is non-empty.
+    assert data, "read() returned an empty data dictionary, did you subscribe to any paths?"
+    # Note: data could be empty if no data arrived, e.g., if the demods were
+    # disabled or had rate 0.
+    assert path in data, "No sweep data in data dictionary: it has no key '%s'" % path
+    samples = data[path]
+    assert len(samples) == numLoops, \
+        "The sweeper returned an unexpected number of sweeps: `%d`. Expected: `%d`." % (len(samples), numLoops)
+
+    return samples
+
+
+# Sweeps as columns by their nicer names, the loops one after another
+def columns(samples):
+    measurements = {key: [] for key in sweepSample}
+    for key1 in samples:
+        for key2 in key1:
+            for key3 in key2:
+                if key3 in naughtyToNice:
+                    measurements[naughtyToNice[key3]].append(np.ravel(key2[key3]))
+    return {key: np.concatenate(values) if values else np.empty((0)) for key, values in measurements.items()}